@@ -0,0 +1,84 @@
+###############################################################################
+##
+##  Copyright 2013 Tavendo GmbH
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##      http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+##
+## Frames-per-second benchmark of the SRDP frame CRC: table-driven
+## engine (srdp.crc16) vs. the former crcmod based computation.
+##
+## Usage: python bench_crc.py [<frames>]
+##
+
+import sys, struct, time
+
+from srdp.crc16 import crc16, CRC16_CHECK
+from srdp.srdp import SrdpFrameHeader
+
+try:
+   import crcmod.predefined
+except ImportError:
+   crcmod = None
+
+
+def crcmodComputeCrc(header, data = None):
+   ## this is SrdpFrameHeader.computeCrc as it was implemented using crcmod
+   crc = crcmod.predefined.PredefinedCrc("xmodem")
+   h = struct.pack("<HHHHHH",
+                   ((header.frametype & 0x03) << 14) | ((header.opcode & 0x03) << 12) | (header.device & 0x0fff),
+                   header.seq,
+                   header.register,
+                   header.position,
+                   header.length,
+                   0)
+   crc.update(h)
+   if data:
+      crc.update(data)
+   return crc.crcValue
+
+
+def run(name, fun, frames, data):
+   header = SrdpFrameHeader(seq = 1,
+                            frametype = SrdpFrameHeader.SRDP_FT_ACK,
+                            opcode = SrdpFrameHeader.SRDP_OP_READ,
+                            device = 3,
+                            register = 1027,
+                            length = len(data))
+   started = time.time()
+   for i in xrange(frames):
+      header.seq = i & 0xffff
+      fun(header, data)
+   elapsed = time.time() - started
+   print "%-24s payload %3d octets: %10.0f frames/s" % (name, len(data), frames / elapsed)
+
+
+if __name__ == '__main__':
+
+   frames = 20000
+   if len(sys.argv) > 1:
+      frames = int(sys.argv[1])
+
+   if crc16("123456789") != CRC16_CHECK:
+      raise Exception("CRC-16 check value mismatch: 0x%04x" % crc16("123456789"))
+
+   for data in ['', '\x01\x00\x00\x00' * 2, 'x' * 69]:
+      run("srdp.crc16", lambda h, d: h.computeCrc(d), frames, data)
+      if crcmod:
+         if crcmodComputeCrc(SrdpFrameHeader(length = len(data)), data) != SrdpFrameHeader(length = len(data)).computeCrc(data):
+            raise Exception("CRC mismatch between crcmod and srdp.crc16")
+         run("crcmod (xmodem)", crcmodComputeCrc, frames, data)
+      else:
+         print "crcmod not installed - skipping comparison"
@@ -0,0 +1,467 @@
+###############################################################################
+##
+##  Copyright 2013 Tavendo GmbH
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##      http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+##
+## Benchmark suite for the SRDP protocol stack: frame codec and CRC,
+## stream reassembly, EDS value codec and request round-trips over
+## in-memory and loopback (UDP, socket pair) transports.
+##
+## Usage: python srdpbench.py [--list] [--filter <regex>] [--repeat <n>]
+##                            [--min-time <seconds>] [--json <file>|-]
+##
+## Each benchmark is calibrated to run at least --min-time seconds, then
+## run --repeat times. Results (best and median rate) are printed as a
+## table and optionally written as JSON (format version RESULTS_VERSION).
+##
+
+import sys, re, time, json, random, platform, argparse, pkg_resources
+
+from zope.interface import implementer
+
+from twisted.test.proto_helpers import StringTransport
+
+from srdp import __version__
+from srdp.interfaces import ISrdpProvider
+from srdp.srdp import SrdpFrameHeader, \
+                      SrdpStreamProtocol, \
+                      SrdpDatagramProtocol, \
+                      SrdpDatagramServerProtocol, \
+                      encodeFrame
+from srdp.flowcontrol import SrdpSendWindow
+from srdp.eds import SrdpEdsDatabase
+from srdp.emulator import SrdpEmulator, SrdpEmulatorProvider, connectSocketPair
+
+
+RESULTS_VERSION = 1
+
+
+
+@implementer(ISrdpProvider)
+class _CountingProvider(object):
+   """
+   Host side provider counting register change notifications.
+   """
+
+   def __init__(self):
+      self.changes = 0
+
+   def onChannelOpen(self, channel):
+      pass
+
+   def onChannelClose(self, reason):
+      pass
+
+   def onRegisterRead(self, device, register, position, length):
+      return None
+
+   def onRegisterWrite(self, device, register, position, data):
+      return None
+
+   def onRegisterChange(self, device, register, position, data):
+      self.changes += 1
+
+
+
+##
+## Frame codec and CRC
+##
+
+def benchHeaderParse():
+   wire = encodeFrame(SrdpFrameHeader.SRDP_FT_ACK, SrdpFrameHeader.SRDP_OP_READ, 3, 1, 1027, 0, 8, 'x' * 8)[0]
+   header = SrdpFrameHeader()
+   def run(n):
+      for i in xrange(n):
+         header.parse(wire)
+   return run
+
+
+def benchHeaderSerialize():
+   header = SrdpFrameHeader(seq = 1,
+                            frametype = SrdpFrameHeader.SRDP_FT_REQ,
+                            opcode = SrdpFrameHeader.SRDP_OP_READ,
+                            device = 3,
+                            register = 1027)
+   def run(n):
+      for i in xrange(n):
+         header.serialize()
+   return run
+
+
+def benchHeaderEncode(payload):
+   header = SrdpFrameHeader(seq = 1,
+                            frametype = SrdpFrameHeader.SRDP_FT_ACK,
+                            opcode = SrdpFrameHeader.SRDP_OP_READ,
+                            device = 3,
+                            register = 1027,
+                            length = payload)
+   data = 'x' * payload
+   def run(n):
+      for i in xrange(n):
+         header.encode(data)
+   return run
+
+
+def benchComputeCrc(payload):
+   header = SrdpFrameHeader(seq = 1,
+                            frametype = SrdpFrameHeader.SRDP_FT_ACK,
+                            opcode = SrdpFrameHeader.SRDP_OP_READ,
+                            device = 3,
+                            register = 1027,
+                            length = payload)
+   data = 'x' * payload
+   def run(n):
+      for i in xrange(n):
+         header.computeCrc(data)
+   return run
+
+
+
+##
+## Stream reassembly
+##
+
+def _fragment(wire, pattern, frameLength):
+   """
+   Split wire data into the chunks a stream transport could deliver.
+   """
+   if pattern == 'frame':
+      size = frameLength
+   elif pattern == 'octet':
+      size = 1
+   elif pattern == 'batch':
+      size = frameLength * 64
+   elif pattern == 'random':
+      rnd = random.Random(1)
+      chunks = []
+      i = 0
+      while i < len(wire):
+         n = rnd.randint(1, 2 * frameLength)
+         chunks.append(wire[i:i + n])
+         i += n
+      return chunks
+   else:
+      raise Exception("unknown fragmentation pattern %s" % pattern)
+   return [wire[pos:pos + size] for pos in xrange(0, len(wire), size)]
+
+
+def benchStreamReassembly(pattern, frames = 1000):
+   ## CHANGE notifications with a 4 octet payload, as sent for sensor values
+   ##
+   wire = ''.join([encodeFrame(SrdpFrameHeader.SRDP_FT_REQ,
+                               SrdpFrameHeader.SRDP_OP_CHANGE,
+                               2,
+                               i + 1,
+                               1029,
+                               0,
+                               4,
+                               '\x00\x00\x80\x3f')[0] for i in xrange(frames)])
+   chunks = _fragment(wire, pattern, len(wire) // frames)
+
+   provider = _CountingProvider()
+   protocol = SrdpStreamProtocol(provider, batchLimit = 0)
+   protocol.makeConnection(StringTransport())
+
+   def run(n):
+      for i in xrange(0, n, frames):
+         for chunk in chunks:
+            protocol.dataReceived(chunk)
+      return ((n + frames - 1) // frames) * frames
+   return run
+
+
+
+##
+## EDS value codec
+##
+
+## one register per kind of register type in the shipped EDS files
+##
+_EDS_REGISTERS = [('string', "http://eds.tavendo.com/adapter/adapter", '/system/eds', u"http://eds.tavendo.com/adapter/adapter"),
+                  ('octets', "http://eds.tavendo.com/adapter/adapter", '/system/id', range(16)),
+                  ('array', "http://eds.tavendo.com/adapter/adapter", '/system/devices', range(2, 34)),
+                  ('struct', "http://eds.tavendo.com/adapter/adapter", '/system/stats/protocol', {'loops': 1, 'octetsReceived': 2, 'octetsSent': 3, 'framesReceived': 4, 'framesSent': 5}),
+                  ('uint8', "http://eds.tavendo.com/device/combocontrol", '/button#watch', 1),
+                  ('uint16', "http://eds.tavendo.com/device/combocontrol", '/slider#max', 1000),
+                  ('uint32', "http://eds.tavendo.com/adapter/arduino-demoboard", '/freemem', 1234),
+                  ('float', "http://eds.tavendo.com/device/openenergymonitor", '/realpower', 230.5)]
+
+
+def benchEdsSerialize(edsDb, uri, path, value):
+   eds = edsDb.getEdsByUri(uri)
+   def run(n):
+      for i in xrange(n):
+         eds.serialize(path, value)
+   return run
+
+
+def benchEdsUnserialize(edsDb, uri, path, value):
+   eds = edsDb.getEdsByUri(uri)
+   _, data = eds.serialize(path, value)
+   def run(n):
+      for i in xrange(n):
+         eds.unserialize(path, data)
+   return run
+
+
+
+##
+## Request round-trips
+##
+
+class _MemoryLink(object):
+   """
+   Two stream protocols connected back to back in memory. Output is
+   delivered when pumped, so no reactor is involved.
+   """
+
+   def __init__(self, a, b):
+      self.a, self.ta = a, StringTransport()
+      self.b, self.tb = b, StringTransport()
+      a.makeConnection(self.ta)
+      b.makeConnection(self.tb)
+
+   def pump(self):
+      moved = True
+      while moved:
+         moved = False
+         for t, peer in [(self.ta, self.b), (self.tb, self.a)]:
+            data = t.value()
+            if data:
+               t.clear()
+               peer.dataReceived(data)
+               moved = True
+
+
+def _roundTrips(channel, n, concurrency, wait):
+   """
+   Issue n register reads with up to concurrency requests outstanding,
+   calling wait() until all are answered.
+   """
+   state = {'sent': 0, 'done': 0}
+
+   def issue(_ = None):
+      if state['sent'] < n:
+         state['sent'] += 1
+         d = channel.readRegister(2, 1)
+         d.addCallback(done)
+
+   def done(_):
+      state['done'] += 1
+      issue()
+
+   for i in xrange(min(concurrency, n)):
+      issue()
+   while state['done'] < n:
+      wait()
+
+
+def _fullWindow():
+   ## start at the maximum send window, so round-trips are not limited by
+   ## the window growing during calibration
+   ##
+   return SrdpSendWindow(initial = 8, maximum = 8)
+
+
+def _emulator(edsDb):
+   return SrdpEmulator(edsDb, devices = 1, deviceEdsUris = ["http://eds.tavendo.com/device/device"])
+
+
+def benchRoundTripMemory(edsDb, concurrency):
+   emulator = _emulator(edsDb)
+   host = SrdpStreamProtocol(_CountingProvider(), window = _fullWindow(), batchLimit = 0)
+   adapter = SrdpStreamProtocol(SrdpEmulatorProvider(emulator), batchLimit = 0)
+   link = _MemoryLink(host, adapter)
+   def run(n):
+      _roundTrips(host, n, concurrency, link.pump)
+   return run
+
+
+def _iterate():
+   from twisted.internet import reactor
+   reactor.iterate(1.)
+
+
+def benchRoundTripUdp(edsDb, concurrency):
+   from twisted.internet import reactor
+   emulator = _emulator(edsDb)
+   server = SrdpDatagramServerProtocol(lambda addr: SrdpEmulatorProvider(emulator), sessionTimeout = None)
+   port = reactor.listenUDP(0, server, interface = '127.0.0.1')
+   host = SrdpDatagramProtocol(_CountingProvider(), addr = ('127.0.0.1', port.getHost().port), window = _fullWindow(), retries = None)
+   reactor.listenUDP(0, host, interface = '127.0.0.1')
+   def run(n):
+      _roundTrips(host, n, concurrency, _iterate)
+   return run
+
+
+def benchRoundTripSocketPair(edsDb, concurrency):
+   emulator = _emulator(edsDb)
+   host = SrdpStreamProtocol(_CountingProvider(), window = _fullWindow())
+   adapter = SrdpStreamProtocol(SrdpEmulatorProvider(emulator))
+   connectSocketPair(host, adapter)
+   while not host._isConnected:
+      _iterate()
+   def run(n):
+      _roundTrips(host, n, concurrency, _iterate)
+   return run
+
+
+
+def benchmarks(edsDb):
+   """
+   All benchmarks as list of (name, unit, setup), where setup() returns a
+   function run(n) performing n operations (and optionally returning the
+   number of operations actually performed).
+   """
+   b = []
+
+   b.append(("frame.parse", "frames", benchHeaderParse))
+   b.append(("frame.serialize", "frames", benchHeaderSerialize))
+   for payload in [0, 8, 69]:
+      b.append(("frame.encode[%d]" % payload, "frames", lambda payload = payload: benchHeaderEncode(payload)))
+   for payload in [0, 8, 69]:
+      b.append(("frame.computeCrc[%d]" % payload, "frames", lambda payload = payload: benchComputeCrc(payload)))
+
+   for pattern in ['frame', 'octet', 'batch', 'random']:
+      b.append(("stream.reassembly[%s]" % pattern, "frames", lambda pattern = pattern: benchStreamReassembly(pattern)))
+
+   for kind, uri, path, value in _EDS_REGISTERS:
+      b.append(("eds.serialize[%s]" % kind, "values", lambda uri = uri, path = path, value = value: benchEdsSerialize(edsDb, uri, path, value)))
+      b.append(("eds.unserialize[%s]" % kind, "values", lambda uri = uri, path = path, value = value: benchEdsUnserialize(edsDb, uri, path, value)))
+
+   for concurrency in [1, 8]:
+      b.append(("roundtrip.memory[%d]" % concurrency, "requests", lambda c = concurrency: benchRoundTripMemory(edsDb, c)))
+      b.append(("roundtrip.socketpair[%d]" % concurrency, "requests", lambda c = concurrency: benchRoundTripSocketPair(edsDb, c)))
+      b.append(("roundtrip.udp[%d]" % concurrency, "requests", lambda c = concurrency: benchRoundTripUdp(edsDb, c)))
+
+   return b
+
+
+
+def measure(run, minTime, repeat):
+   """
+   Calibrate the number of operations to take at least minTime seconds,
+   then time repeat runs. Returns (operations per run, list of seconds).
+   """
+   n = 1
+   while True:
+      started = time.time()
+      done = run(n) or n
+      elapsed = time.time() - started
+      if elapsed >= minTime:
+         break
+      if elapsed > 0:
+         n = max(n * 2, int(n * minTime * 1.2 / elapsed))
+      else:
+         n *= 10
+
+   times = []
+   for i in xrange(repeat):
+      started = time.time()
+      done = run(n) or n
+      times.append(time.time() - started)
+   return done, times
+
+
+def main():
+   parser = argparse.ArgumentParser(prog = "srdpbench",
+                                    description = "SRDP Benchmark Suite v%s" % __version__)
+
+   parser.add_argument("--list",
+                       action = "store_true",
+                       help = "List benchmarks and exit.")
+
+   parser.add_argument("-k",
+                       "--filter",
+                       type = str,
+                       metavar = "<regex>",
+                       help = "Only run benchmarks with names matching the regular expression.")
+
+   parser.add_argument("-r",
+                       "--repeat",
+                       type = int,
+                       default = 5,
+                       metavar = "<count>",
+                       help = "Number of timed runs per benchmark.")
+
+   parser.add_argument("-t",
+                       "--min-time",
+                       type = float,
+                       default = 0.2,
+                       metavar = "<seconds>",
+                       help = "Minimum duration of one timed run (seconds|float).")
+
+   parser.add_argument("-o",
+                       "--json",
+                       type = str,
+                       metavar = "<file>",
+                       help = "Write results as JSON to given file ('-' for stdout).")
+
+   args = parser.parse_args()
+
+   edsDb = SrdpEdsDatabase()
+   edsDb.loadFromDir(pkg_resources.resource_filename("srdp", "eds"))
+   edsDb.check()
+
+   selected = benchmarks(edsDb)
+   if args.filter:
+      pat = re.compile(args.filter)
+      selected = [b for b in selected if pat.search(b[0])]
+
+   if args.list:
+      for name, unit, _ in selected:
+         print name
+      return
+
+   table = args.json != '-'
+
+   results = []
+   for name, unit, setup in selected:
+      done, times = measure(setup(), args.min_time, args.repeat)
+      times.sort()
+      best = done / times[0]
+      median = done / times[len(times) // 2]
+      results.append({'name': name,
+                      'unit': unit,
+                      'operations': done,
+                      'seconds': times,
+                      'best': best,
+                      'median': median})
+      if table:
+         print "%-32s %14.0f %-12s (median %14.0f)" % (name, best, unit + "/s", median)
+
+   if args.json:
+      output = {'version': RESULTS_VERSION,
+                'srdp': __version__,
+                'python': platform.python_version(),
+                'implementation': platform.python_implementation(),
+                'platform': platform.platform(),
+                'timestamp': time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                'repeat': args.repeat,
+                'minTime': args.min_time,
+                'results': results}
+      if args.json == '-':
+         json.dump(output, sys.stdout, indent = 3, sort_keys = True)
+         print
+      else:
+         with open(args.json, 'w') as f:
+            json.dump(output, f, indent = 3, sort_keys = True)
+
+
+
+if __name__ == '__main__':
+   main()
@@ -48,8 +48,10 @@ setup (
    install_requires = ['setuptools',
                        'zope.interface>=3.6.0',
                        'Twisted>=11.1',
-                       'crcmod>=1.7',
                        'pyserial>=2.6'],
+   extras_require = {
+      'numpy': ['numpy>=1.7']
+    },
    packages = find_packages(),
    #packages = ['srdp'],
    include_package_data = True,
@@ -59,7 +61,8 @@ setup (
    zip_safe = False,
    entry_points = {
       'console_scripts': [
-         'srdptool = srdp.srdptool:run'
+         'srdptool = srdp.srdptool:run',
+         'srdpemu = srdp.emulator:run'
       ]},
    ## http://pypi.python.org/pypi?%3Aaction=list_classifiers
    ##
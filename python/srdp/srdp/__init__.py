@@ -19,8 +19,17 @@
 from _version import __version__
 
 import interfaces
+import crc16
+import flowcontrol
+import pending
+import metrics
+import subscription
+import cache
+import discovery
 import eds
 import srdp
+import blockwise
+import emulator
 import srdpprovider
 #import srdptool
 import srdptoolprovider
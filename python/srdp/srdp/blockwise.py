@@ -0,0 +1,228 @@
+###############################################################################
+##
+##  Copyright 2013 Tavendo GmbH
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##      http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+__all__ = ("SrdpBlockwiseTransfer",)
+
+from collections import deque
+
+from twisted.internet.defer import Deferred
+
+from srdp import SrdpFrameHeader, SrdpException
+
+
+class SrdpBlockwiseTransfer(object):
+   """
+   Blockwise transfer of registers larger than one frame.
+
+   Register reads and writes are split into chunks addressed by the
+   position/length frame header fields, and several chunks are kept in
+   flight at once (subject to the channel's send window).
+
+   Chunks carry at most maxPayload octets, which defaults to the
+   SRDP_FRAME_DATA_MAX_LEN of the C library: adapters do not handle larger
+   frames. The payload size can be learned per channel with probe = True
+   for adapters that advertise a larger frame buffer (payloadLimit): the
+   chunk size is then doubled after clean full-size chunks, up to
+   payloadLimit, and fixed once the adapter answers with a short read (the
+   size it returned) or rejects a chunk with SRDP_ERR_INVALID_REG_POSLEN
+   (half of the rejected size).
+   """
+
+   ## SRDP_FRAME_DATA_MAX_LEN in ansic/srdp/srdp.h (default build)
+   ##
+   SRDP_FRAME_DATA_MAX_LEN = 81 - SrdpFrameHeader.SRDP_FRAME_HEADER_LEN
+
+   ## largest payload that fits the 16-bit frame length field
+   ##
+   SRDP_FRAME_DATA_LIMIT = 0xffff
+
+   ## number of clean full-size chunks before probing a larger size
+   ##
+   PROBE_AFTER = 4
+
+
+   def __init__(self,
+                channel,
+                maxPayload = SRDP_FRAME_DATA_MAX_LEN,
+                payloadLimit = SRDP_FRAME_DATA_MAX_LEN,
+                probe = False,
+                concurrency = 4):
+      self.channel = channel
+      self.payloadLimit = min(payloadLimit, SrdpBlockwiseTransfer.SRDP_FRAME_DATA_LIMIT)
+      self.maxPayload = min(maxPayload, self.payloadLimit)
+      self.concurrency = concurrency
+
+      self._probing = probe and maxPayload < self.payloadLimit
+      self._clean = 0
+
+
+   def readRegister(self, device, register, length, concurrency = None):
+      """
+      Read length octets of a register. Returns a Deferred that fires with
+      a bytearray holding the register data.
+      """
+      transfer = _SrdpBlockTransfer(self, device, register, length, bytearray(length), None, concurrency)
+      return transfer.start()
+
+
+   def writeRegister(self, device, register, data, concurrency = None):
+      """
+      Write data to a register. Returns a Deferred that fires with None when
+      all chunks have been acknowledged.
+      """
+      transfer = _SrdpBlockTransfer(self, device, register, len(data), None, memoryview(data), concurrency)
+      return transfer.start()
+
+
+   def _chunkDone(self, n):
+      if self._probing and n >= self.maxPayload:
+         self._clean += 1
+         if self._clean >= SrdpBlockwiseTransfer.PROBE_AFTER:
+            self._clean = 0
+            self.maxPayload = min(self.maxPayload * 2, self.payloadLimit)
+            self._probing = self.maxPayload < self.payloadLimit
+
+
+   def _chunkShort(self, got):
+      self.maxPayload = got
+      self._probing = False
+
+
+   def _chunkRejected(self, n):
+      self.maxPayload = min(self.maxPayload, max(1, n // 2))
+      self._probing = False
+
+
+
+class _SrdpBlockTransfer(object):
+   """
+   State of one blockwise register read or write.
+   """
+
+   def __init__(self, blockwise, device, register, total, buf, data, concurrency):
+      self.blockwise = blockwise
+      self.device = device
+      self.register = register
+      self.total = total
+      self.buf = buf
+      self.data = data
+      if concurrency is None:
+         concurrency = blockwise.concurrency
+      self.concurrency = concurrency
+
+      self.deferred = Deferred()
+      self.next = 0
+      self.retry = deque()
+      self.inflight = 0
+      self.done = 0
+      self.failed = False
+
+
+   def start(self):
+      self._pump()
+      return self.deferred
+
+
+   def _pump(self):
+      blockwise = self.blockwise
+      while not self.failed and self.inflight < self.concurrency:
+         maxPayload = blockwise.maxPayload
+         if self.retry:
+            pos, n = self.retry.popleft()
+            if n > maxPayload:
+               self.retry.appendleft((pos + maxPayload, n - maxPayload))
+               n = maxPayload
+         elif self.next < self.total:
+            pos = self.next
+            n = min(maxPayload, self.total - pos)
+            self.next += n
+         else:
+            break
+         self._issue(pos, n)
+
+      if not self.failed and self.inflight == 0 and self.done == self.total and not self.deferred.called:
+         if self.buf is not None:
+            self.deferred.callback(self.buf)
+         else:
+            self.deferred.callback(None)
+
+
+   def _issue(self, pos, n):
+      self.inflight += 1
+      if self.buf is not None:
+         d = self.blockwise.channel.readRegister(self.device, self.register, pos, n)
+         d.addCallbacks(self._readDone, self._chunkFailed, callbackArgs = (pos, n), errbackArgs = (pos, n))
+      else:
+         d = self.blockwise.channel.writeRegister(self.device, self.register, self.data[pos:pos + n], pos)
+         d.addCallbacks(self._writeDone, self._chunkFailed, callbackArgs = (pos, n), errbackArgs = (pos, n))
+
+
+   def _readDone(self, data, pos, n):
+      self.inflight -= 1
+      if self.failed:
+         return
+
+      got = len(data) if data else 0
+      if got >= n:
+         self.buf[pos:pos + n] = data[:n]
+         self.done += n
+         self.blockwise._chunkDone(n)
+      elif got > 0:
+         ## short read: the adapter returned as much as fits its frame buffer
+         ##
+         self.buf[pos:pos + got] = data
+         self.done += got
+         self.blockwise._chunkShort(got)
+         self.retry.appendleft((pos + got, n - got))
+      else:
+         self._fail(Exception("blockwise read of register %d on device %d made no progress at position %d" % (self.register, self.device, pos)))
+         return
+
+      self._pump()
+
+
+   def _writeDone(self, _, pos, n):
+      self.inflight -= 1
+      if self.failed:
+         return
+
+      self.done += n
+      self.blockwise._chunkDone(n)
+      self._pump()
+
+
+   def _chunkFailed(self, failure, pos, n):
+      self.inflight -= 1
+      if self.failed:
+         return
+
+      if failure.check(SrdpException) and \
+         failure.value.args[0] == SrdpFrameHeader.SRDP_ERR_INVALID_REG_POSLEN and \
+         n > 1:
+         ## chunk too large for the adapter: shrink and retry
+         ##
+         self.blockwise._chunkRejected(n)
+         self.retry.appendleft((pos, n))
+         self._pump()
+      else:
+         self._fail(failure)
+
+
+   def _fail(self, failure):
+      self.failed = True
+      self.deferred.errback(failure)
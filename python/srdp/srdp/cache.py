@@ -0,0 +1,234 @@
+###############################################################################
+##
+##  Copyright 2013 Tavendo GmbH
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##      http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+__all__ = ("SrdpRegisterCache",)
+
+from twisted.internet.defer import Deferred, succeed
+
+from srdp import readRegisters
+
+
+class _SrdpCacheEntry(object):
+
+   __slots__ = ('data', 'storedAt')
+
+   def __init__(self, data, storedAt):
+      self.data = data
+      self.storedAt = storedAt
+
+
+
+class SrdpRegisterCache(object):
+   """
+   Register value cache layered on a SRDP channel.
+
+   The cache is a drop-in for the channel (everything but register reads
+   and writes is passed through), so it can be handed to providers:
+
+      provider.channel = SrdpRegisterCache(channel)
+
+   Complete register values (read at position 0 with length 0) are cached
+   per (device, register), and reused according to the register's policy:
+
+      - POLICY_IMMUTABLE: always (eg UUID and EDS URI, the default for the
+        system registers 1 to 4)
+      - POLICY_TTL: for the policy's time to live (seconds)
+      - POLICY_CHANGE: until a change notification for the register is
+        received
+      - POLICY_VOLATILE: only when the caller explicitly accepts a cached
+        value by giving maxAge (the default for all other registers)
+
+   Independent of the policy, a cached value is dropped when the register
+   is written through the cache or a change notification for it arrives,
+   and readRegister(maxAge = ..) only accepts values not older than maxAge
+   seconds (maxAge = 0 always reads from the device). A change of the
+   adapter's device list drops all values cached for devices.
+
+   Concurrent reads of the same register share one request on the wire.
+   """
+
+   POLICY_VOLATILE = 'volatile'
+   POLICY_TTL = 'ttl'
+   POLICY_CHANGE = 'change'
+   POLICY_IMMUTABLE = 'immutable'
+
+   ## register index of the adapter's device list (see SrdpProvider)
+   ##
+   IDX_REG_DEVICES = 5
+
+
+   def __init__(self, channel, policy = POLICY_VOLATILE, ttl = None, reactor = None):
+      self._channel = channel
+      self._policies = {}
+      self._default = (policy, ttl)
+
+      for register in [1, 2, 3, 4]:
+         self.setPolicy(register, SrdpRegisterCache.POLICY_IMMUTABLE)
+
+      if reactor is None:
+         from twisted.internet import reactor
+      self._reactor = reactor
+
+      self._entries = {}
+      self._inflight = {}
+      self._generations = {}
+
+      self.hits = 0
+      self.misses = 0
+
+      self._subscription = channel.subscribe(self._onRegisterChange)
+
+
+   def __getattr__(self, name):
+      return getattr(self._channel, name)
+
+
+   def setPolicy(self, register, policy, ttl = None, device = None):
+      """
+      Set the cache policy of a register on the given device, or on all
+      devices (device = None).
+      """
+      if policy not in [SrdpRegisterCache.POLICY_VOLATILE,
+                        SrdpRegisterCache.POLICY_TTL,
+                        SrdpRegisterCache.POLICY_CHANGE,
+                        SrdpRegisterCache.POLICY_IMMUTABLE]:
+         raise Exception("invalid cache policy %s" % policy)
+      if policy == SrdpRegisterCache.POLICY_TTL and ttl is None:
+         raise Exception("cache policy %s needs a time to live" % policy)
+      self._policies[(device, register)] = (policy, ttl)
+
+
+   def getPolicy(self, device, register):
+      policy = self._policies.get((device, register), None)
+      if policy is None:
+         policy = self._policies.get((None, register), self._default)
+      return policy
+
+
+   def _lookup(self, key, maxAge):
+      entry = self._entries.get(key, None)
+      if entry is None or maxAge == 0:
+         return None
+
+      age = self._reactor.seconds() - entry.storedAt
+      if maxAge is not None and age > maxAge:
+         return None
+
+      policy, ttl = self.getPolicy(*key)
+      if policy == SrdpRegisterCache.POLICY_VOLATILE:
+         if maxAge is None:
+            return None
+      elif policy == SrdpRegisterCache.POLICY_TTL:
+         if age > ttl:
+            return None
+
+      return entry
+
+
+   def readRegister(self, device, register, position = 0, length = 0, retries = None, maxAge = None):
+      """
+      Read a register, from the cache when allowed by the register policy
+      and maxAge. Partial reads always go to the device.
+      """
+      if position != 0 or length != 0:
+         return self._channel.readRegister(device, register, position, length, retries = retries)
+
+      key = (device, register)
+      entry = self._lookup(key, maxAge)
+      if entry is not None:
+         self.hits += 1
+         return succeed(entry.data)
+
+      self.misses += 1
+      d = Deferred()
+      waiters = self._inflight.get(key, None)
+      if waiters is not None:
+         waiters.append(d)
+         return d
+
+      self._inflight[key] = [d]
+      generation = self._generations.get(key, 0)
+      r = self._channel.readRegister(device, register, retries = retries)
+      r.addCallbacks(self._readDone, self._readFailed, callbackArgs = (key, generation), errbackArgs = (key,))
+      return d
+
+
+   def _readDone(self, data, key, generation):
+      ## do not cache a value that was invalidated while being read
+      ##
+      if self._generations.get(key, 0) == generation:
+         self._entries[key] = _SrdpCacheEntry(data, self._reactor.seconds())
+      for d in self._inflight.pop(key, []):
+         d.callback(data)
+
+
+   def _readFailed(self, failure, key):
+      for d in self._inflight.pop(key, []):
+         d.errback(failure)
+
+
+   def readRegisters(self, device, registers, concurrency = None, retries = None, maxAge = None):
+      """
+      Read a set of registers of a device concurrently, through the cache.
+      """
+      return readRegisters(lambda register: self.readRegister(device, register, retries = retries, maxAge = maxAge), registers, concurrency)
+
+
+   def writeRegister(self, device, register, data, position = 0, retries = None):
+      """
+      Write a register on the device, dropping its cached value.
+      """
+      key = (device, register)
+      self._invalidate(key)
+
+      def done(res):
+         self._invalidate(key)
+         return res
+
+      d = self._channel.writeRegister(device, register, data, position, retries = retries)
+      d.addBoth(done)
+      return d
+
+
+   def _invalidate(self, key):
+      self._entries.pop(key, None)
+      self._generations[key] = self._generations.get(key, 0) + 1
+
+
+   def invalidate(self, device = None, register = None):
+      """
+      Drop cached values of a register, of all registers of a device or
+      of everything.
+      """
+      keys = set(self._entries.keys()) | set(self._inflight.keys())
+      for key in keys:
+         if (device is None or key[0] == device) and (register is None or key[1] == register):
+            self._invalidate(key)
+
+
+   def _onRegisterChange(self, device, register, position, value):
+      self._invalidate((device, register))
+      if device == 1 and register == SrdpRegisterCache.IDX_REG_DEVICES:
+         for key in set(self._entries.keys()) | set(self._inflight.keys()):
+            if key[0] != 1:
+               self._invalidate(key)
+
+
+   def close(self):
+      self._subscription.unsubscribe()
+      self._channel.close()
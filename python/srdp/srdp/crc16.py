@@ -0,0 +1,94 @@
+###############################################################################
+##
+##  Copyright 2013 Tavendo GmbH
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##      http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+__all__ = ("CRC16_TABLE",
+           "CRC16_CHECK",
+           "crc16",
+           "Crc16",)
+
+
+## SRDP uses CRC-16 with parameters like Xmodem (see doc/SRDP.md):
+##
+##   Poly: 0x1021, Initial value: 0x0000, No Reverse, No XOR
+##
+## The check value for the ASCII byte string "123456789" is 0x31C3.
+##
+CRC16_POLY = 0x1021
+CRC16_INIT = 0x0000
+CRC16_CHECK = 0x31C3
+
+
+def _makeTable(poly):
+   table = []
+   for i in xrange(256):
+      crc = i << 8
+      for _ in xrange(8):
+         if crc & 0x8000:
+            crc = ((crc << 1) ^ poly) & 0xffff
+         else:
+            crc = (crc << 1) & 0xffff
+      table.append(crc)
+   return tuple(table)
+
+
+## precomputed 256-entry table (same as crc_table[] in ansic/srdp/srdp.c)
+##
+CRC16_TABLE = _makeTable(CRC16_POLY)
+
+
+def crc16(data, crc = CRC16_INIT):
+   """
+   Compute CRC-16/XMODEM over data, continuing from the given CRC value.
+
+   Data can be anything exposing the buffer interface (str, bytearray,
+   memoryview), so header and payload can be run through consecutive
+   calls without building a joined string first:
+
+      crc = crc16(header)
+      crc = crc16(payload, crc)
+   """
+   table = CRC16_TABLE
+   if type(data) is memoryview:
+      data = data.tolist()
+   elif type(data) is not bytearray:
+      data = bytearray(data)
+   for b in data:
+      crc = ((crc << 8) & 0xff00) ^ table[(crc >> 8) ^ b]
+   return crc
+
+
+class Crc16(object):
+   """
+   Incremental CRC-16/XMODEM engine, API compatible with the subset of
+   crcmod.predefined.PredefinedCrc used by SRDP (update/crcValue).
+   """
+
+   __slots__ = ('crcValue',)
+
+   def __init__(self, data = None):
+      self.crcValue = CRC16_INIT
+      if data:
+         self.update(data)
+
+
+   def update(self, data):
+      self.crcValue = crc16(data, self.crcValue)
+
+
+   def reset(self):
+      self.crcValue = CRC16_INIT
@@ -0,0 +1,249 @@
+###############################################################################
+##
+##  Copyright 2013 Tavendo GmbH
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##      http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+__all__ = ("SrdpDeviceInfo",
+           "SrdpDeviceRegistry",
+           "SrdpDiscovery",)
+
+import os, json, time, struct, binascii
+
+from twisted.python import log
+from twisted.internet.defer import DeferredList, inlineCallbacks, returnValue
+
+from srdpprovider import SrdpProvider
+
+
+class SrdpDeviceInfo(object):
+   """
+   A device connected to an adapter: index, UUID (16 octets), EDS URI and
+   the EDS bound from the EDS database (None if not in the database).
+   """
+
+   __slots__ = ('index', 'uuid', 'edsUri', 'eds')
+
+   def __init__(self, index, uuid, edsUri, eds = None):
+      self.index = index
+      self.uuid = uuid
+      self.edsUri = edsUri
+      self.eds = eds
+
+
+   def __repr__(self):
+      return "SrdpDeviceInfo(index = %d, uuid = %s, edsUri = %s)" % (self.index, binascii.hexlify(self.uuid), self.edsUri)
+
+
+
+class SrdpDeviceRegistry(object):
+   """
+   Registry of the devices seen on adapters, keyed by adapter UUID, and
+   persisted as JSON file (or kept in memory only when no path is given).
+   """
+
+   VERSION = 1
+
+   def __init__(self, path = None):
+      self.path = path
+      self._adapters = {}
+      if path and os.path.exists(path):
+         self.load()
+
+
+   def load(self):
+      try:
+         with open(self.path) as f:
+            obj = json.load(f)
+         if obj.get('version', None) != SrdpDeviceRegistry.VERSION:
+            raise Exception("unsupported registry version %s" % obj.get('version', None))
+         self._adapters = obj['adapters']
+      except Exception, e:
+         ## the registry is only a cache of what is on the wire
+         ##
+         log.msg("SRDP device registry %s ignored (%s)" % (self.path, e))
+         self._adapters = {}
+
+
+   def save(self):
+      """
+      Write the registry file. Saving is best-effort: the registry is only a
+      cache, so failing to write it (eg read-only home directory) is logged
+      and otherwise ignored. Returns True when the registry was written.
+      """
+      if not self.path:
+         return False
+
+      ## write to a temporary file and rename, so concurrent readers never
+      ## see a partially written registry
+      ##
+      tmp = "%s.%d.tmp" % (self.path, os.getpid())
+      try:
+         d = os.path.dirname(self.path)
+         if d and not os.path.isdir(d):
+            os.makedirs(d)
+         with open(tmp, 'w') as f:
+            json.dump({'version': SrdpDeviceRegistry.VERSION, 'adapters': self._adapters}, f, indent = 3, sort_keys = True)
+         os.rename(tmp, self.path)
+      except EnvironmentError, e:
+         log.msg("SRDP device registry %s not saved (%s)" % (self.path, e))
+         if os.path.exists(tmp):
+            os.remove(tmp)
+         return False
+      return True
+
+
+   def getAdapter(self, uuid):
+      """
+      Get devices recorded for the adapter with given UUID as dict
+      device index -> (device UUID, EDS URI).
+      """
+      adapter = self._adapters.get(binascii.hexlify(uuid), None)
+      if adapter is None:
+         return {}
+      devices = {}
+      for index, device in adapter['devices'].items():
+         devices[int(index)] = (binascii.unhexlify(device['uuid']), device['eds'])
+      return devices
+
+
+   def setAdapter(self, uuid, devices):
+      """
+      Record the devices (list of SrdpDeviceInfo) of the adapter with given
+      UUID.
+      """
+      entry = {}
+      for device in devices:
+         entry[str(device.index)] = {'uuid': binascii.hexlify(device.uuid), 'eds': device.edsUri}
+      self._adapters[binascii.hexlify(uuid)] = {'devices': entry, 'seen': int(time.time())}
+
+
+   def removeAdapter(self, uuid):
+      self._adapters.pop(binascii.hexlify(uuid), None)
+
+
+
+class SrdpDiscovery(object):
+   """
+   Device discovery on an adapter in one pipelined pass.
+
+   The adapter UUID and the device list are read first (in parallel), then
+   UUID and EDS URI of all devices are requested at once, so the requests
+   can be pipelined by the channel's send window.
+
+   With a registry, the EDS URI of devices recorded for the adapter (by
+   UUID) at the same index is taken from the registry, and only their UUID
+   is read to detect devices replaced at the same index (whose EDS URI is
+   then read as well, replacing the recorded entry). With revalidate,
+   nothing is taken from the registry: the EDS URI of recorded devices is
+   read again too.
+
+   The EDS bound to each device is set on the subscription registry of the
+   channel, so changes can be subscribed to by register path.
+   """
+
+   def __init__(self, channel, edsDb = None, registry = None, revalidate = False):
+      self.channel = channel
+      self.edsDb = edsDb
+      self.registry = registry
+      self.revalidate = revalidate
+      self.reads = 0
+
+
+   def _read(self, device, register):
+      self.reads += 1
+      return self.channel.readRegister(device, register)
+
+
+   @inlineCallbacks
+   def discover(self):
+      """
+      Discover the adapter and its devices. Returns a Deferred that fires
+      with a dict device index -> SrdpDeviceInfo (device 1 is the adapter).
+      """
+      self.reads = 0
+
+      res = yield self._gather({'uuid': self._read(1, SrdpProvider.IDX_REG_ID),
+                                'devices': self._read(1, SrdpProvider.IDX_REG_DEVICES)})
+      adapterUuid = res['uuid']
+      data = res['devices']
+      count = struct.unpack("<H", data[:2])[0]
+      indices = [1] + list(struct.unpack("<%dH" % count, data[2:2 + 2 * count]))
+
+      known = {}
+      if self.registry is not None:
+         known = self.registry.getAdapter(adapterUuid)
+
+      ## issue all reads before waiting for any of them
+      ##
+      reads = {}
+      for index in indices:
+         if index != 1:
+            reads[('uuid', index)] = self._read(index, SrdpProvider.IDX_REG_ID)
+         if index not in known or self.revalidate:
+            reads[('eds', index)] = self._read(index, SrdpProvider.IDX_REG_EDS)
+      res = yield self._gather(reads)
+
+      ## devices replaced at a recorded index
+      ##
+      reads = {}
+      for index in indices:
+         if index in known and ('eds', index) not in res and index != 1 and res[('uuid', index)] != known[index][0]:
+            reads[('eds', index)] = self._read(index, SrdpProvider.IDX_REG_EDS)
+      replaced = yield self._gather(reads)
+      res.update(replaced)
+
+      subscriptions = getattr(self.channel, 'subscriptions', None)
+      devices = {}
+      for index in indices:
+         if index == 1:
+            uuid = adapterUuid
+         else:
+            uuid = res[('uuid', index)]
+         if ('eds', index) in res:
+            edsUri = str(res[('eds', index)][2:])
+         else:
+            edsUri = known[index][1]
+
+         eds = None
+         if self.edsDb is not None:
+            eds = self.edsDb.getEdsByUri(edsUri)
+         devices[index] = SrdpDeviceInfo(index, uuid, edsUri, eds)
+         if subscriptions is not None and eds is not None:
+            subscriptions.setDeviceEds(index, eds)
+
+      if self.registry is not None:
+         self.registry.setAdapter(adapterUuid, devices.values())
+         self.registry.save()
+
+      returnValue(devices)
+
+
+   def _gather(self, deferreds):
+      """
+      Wait for a dict key -> Deferred. Returns a Deferred that fires with
+      a dict key -> result, or fails with the first failed read.
+      """
+      keys = deferreds.keys()
+      d = DeferredList([deferreds[k] for k in keys], fireOnOneErrback = True, consumeErrors = True)
+
+      def done(res):
+         values = {}
+         for i in xrange(len(keys)):
+            values[keys[i]] = res[i][1]
+         return values
+
+      d.addCallbacks(done, lambda failure: failure.value.subFailure)
+      return d
@@ -16,29 +16,413 @@
 ##
 ###############################################################################
 
-__all__ = ("SrdpEds",
+__all__ = ("SrdpRegister",
+           "SrdpRegisterMap",
+           "SrdpEds",
            "SrdpEdsDatabase",)
 
 
 import struct, binascii
-import json, os, re
+import json, os, re, time
+import cPickle, marshal, gc
+import itertools, multiprocessing
 from pprint import pprint
 
 from twisted.python import log
 
+try:
+   import numpy
+except ImportError:
+   numpy = None
+
+
+SRDP_STYPE_TO_PTYPE = {'int8': 'b',
+                       'uint8': 'B',
+                       'int16': 'h',
+                       'uint16': 'H',
+                       'int32': 'l',
+                       'uint32': 'L',
+                       'int64': 'q',
+                       'uint64': 'Q',
+                       'float': 'f',
+                       'double': 'd'}
+
+## NumPy types for SRDP types (SRDP is little endian)
+##
+SRDP_STYPE_TO_NTYPE = {'int8': 'i1',
+                       'uint8': 'u1',
+                       'int16': '<i2',
+                       'uint16': '<u2',
+                       'int32': '<i4',
+                       'uint32': '<u4',
+                       'int64': '<i8',
+                       'uint64': '<u8',
+                       'float': '<f4',
+                       'double': '<f8'}
+
+
+class SrdpRegister(object):
+   """
+   Compiled register descriptor.
+
+   The register type is compiled once into a codec (precompiled struct
+   format for scalars, fixed arrays and struct-typed registers, specialized
+   functions for length-prefixed strings and variable arrays), so that
+
+      value = reg.decode(data)
+      data = reg.encode(value)
+
+   do not interpret the EDS register definition again. For compatibility,
+   the descriptor can be accessed like the register definition dict, eg
+   reg['path'].
+
+   With NumPy installed, numeric and struct-typed registers (scalars, fixed
+   and variable arrays) can also be decoded into NumPy arrays sharing the
+   memory of the payload (decodeArray), and many recorded payloads of the
+   register into one array (decodeBatch).
+   """
+
+   __slots__ = ('index',
+                'path',
+                'access',
+                'optional',
+                'type',
+                'count',
+                'desc',
+                'spec',
+                'decode',
+                'encode',
+                'dtype',
+                '_prefix')
+
+   ## compiled codecs by register type and count, shared by all registers
+   ## of the same type
+   ##
+   _codecs = {}
+
+   def __init__(self, spec):
+      self.spec = spec
+      self.index = spec['index']
+      self.path = spec['path']
+      self.access = spec.get('access', None)
+      self.optional = spec.get('optional', False)
+      self.type = spec['type']
+      self.count = spec.get('count', 1)
+      self.desc = spec.get('desc', None)
+
+      key = self._codecKey()
+      codec = SrdpRegister._codecs.get(key, None)
+      if codec is None:
+         self.dtype = None
+         self._prefix = None
+         self.decode, self.encode = self._compile()
+         codec = (self.decode, self.encode, self.dtype, self._prefix)
+         SrdpRegister._codecs[key] = codec
+      else:
+         self.decode, self.encode, self.dtype, self._prefix = codec
+
+
+   def __getitem__(self, key):
+      return self.spec[key]
+
+
+   def get(self, key, default = None):
+      return self.spec.get(key, default)
+
+
+   def has_key(self, key):
+      return self.spec.has_key(key)
+
+
+   def __contains__(self, key):
+      return key in self.spec
+
+
+   def keys(self):
+      return self.spec.keys()
+
+
+   def __repr__(self):
+      return "SrdpRegister(%r)" % self.spec
+
+
+   ## pickled as the register definition, the codec is looked up (or
+   ## compiled) again when unpickling
+   ##
+   def __reduce__(self):
+      return (SrdpRegister, (self.spec,))
+
+
+   def _codecKey(self):
+      rtype = self.type
+      if type(rtype) == list:
+         rtype = tuple([(field['field'], field['type']) for field in rtype])
+      return (rtype, self.count)
+
+
+   def _compile(self):
+      rtype = self.type
+      count = self.count
+
+      if count in ['uint8', 'uint16']:
+         self._prefix = struct.Struct('<' + SRDP_STYPE_TO_PTYPE[count])
+
+      ## string
+      ##
+      if rtype == 'char' and self._prefix is not None:
+         skip = self._prefix.size
+         pack = self._prefix.pack
+
+         def decode(data):
+            return data[skip:].decode('utf8')
+
+         def encode(value):
+            if type(value) not in [str, unicode]:
+               raise Exception("expected str/unicode value")
+            s = value.encode('utf8')
+            return pack(len(s)) + s
+
+         return decode, encode
+
+      ## element: struct (dict of fields) or scalar
+      ##
+      if type(rtype) == list:
+         fields = tuple([str(field['field']) for field in rtype])
+         fmt = ''.join([SRDP_STYPE_TO_PTYPE[field['type']] for field in rtype])
+         if numpy is not None:
+            self.dtype = numpy.dtype([(f['field'].encode('ascii'), SRDP_STYPE_TO_NTYPE[f['type']]) for f in rtype])
+      elif SRDP_STYPE_TO_PTYPE.has_key(rtype):
+         fields = None
+         fmt = SRDP_STYPE_TO_PTYPE[rtype]
+         if numpy is not None:
+            self.dtype = numpy.dtype(SRDP_STYPE_TO_NTYPE[rtype])
+      else:
+         def decode(data):
+            return '?'
+
+         def encode(value):
+            raise Exception("serialize type not implemted")
+
+         return decode, encode
+
+      width = len(fmt)
+
+      def toValues(flat):
+         if fields is None:
+            return list(flat)
+         return [dict(zip(fields, flat[i:i + width])) for i in xrange(0, len(flat), width)]
+
+      def fromValues(values):
+         if fields is None:
+            return values
+         flat = []
+         for value in values:
+            flat.extend([value[field] for field in fields])
+         return flat
+
+      if type(count) == int:
+         st = struct.Struct('<' + fmt * count)
+         unpack = st.unpack
+         pack = st.pack
+
+         ## scalar or struct
+         ##
+         if count == 1:
+            if fields is None:
+               def decode(data):
+                  return unpack(data)[0]
+
+               return decode, pack
+            else:
+               def decode(data):
+                  return dict(zip(fields, unpack(data)))
+
+               def encode(value):
+                  return pack(*[value[field] for field in fields])
+
+               return decode, encode
+
+         ## fixed size array: list of values (octet arrays are decoded to
+         ## hex string, and can be given as hex string when encoding)
+         ##
+         octets = rtype == 'uint8'
+
+         if octets:
+            def decode(data):
+               return '0x' + binascii.hexlify(data)
+         else:
+            def decode(data):
+               return toValues(unpack(data))
+
+         def encode(value):
+            if octets and type(value) in [str, unicode]:
+               if value.startswith('0x'):
+                  value = value[2:]
+               value = list(bytearray(binascii.unhexlify(value)))
+            if len(value) != count:
+               raise Exception("expected %d values" % count)
+            return pack(*fromValues(value))
+
+         return decode, encode
+
+      ## variable size array: count followed by values
+      ##
+      elif self._prefix is not None:
+         prefix = self._prefix
+         skip = prefix.size
+
+         def decode(data):
+            n = prefix.unpack_from(data)[0]
+            return toValues(struct.unpack_from('<' + fmt * n, data, skip))
+
+         def encode(value):
+            return prefix.pack(len(value)) + struct.pack('<' + fmt * len(value), *fromValues(value))
+
+         return decode, encode
+
+      else:
+         def decode(data):
+            return '?'
+
+         def encode(value):
+            raise Exception("serialize type not implemted")
+
+         return decode, encode
+
+
+   def _checkArray(self):
+      if numpy is None:
+         raise Exception("decoding into arrays needs NumPy")
+      if self.dtype is None:
+         raise Exception("register %s has no array type" % self.path)
+
+
+   def decodeArray(self, data):
+      """
+      Decode register data into a 1-dimensional NumPy array (with a
+      structured dtype for struct-typed registers). The array is a read-only
+      view on data, no values are copied. Scalar registers give an array
+      of length 1.
+      """
+      self._checkArray()
+      if self._prefix is not None:
+         n = self._prefix.unpack_from(data)[0]
+         return numpy.frombuffer(data, self.dtype, n, self._prefix.size)
+      return numpy.frombuffer(data, self.dtype, self.count)
+
+
+   def decodeBatch(self, payloads):
+      """
+      Decode many payloads of the register (eg recorded change notifications)
+      into one NumPy array of shape (len(payloads),) for scalar and struct
+      registers, or (len(payloads), count) for arrays. All payloads of a
+      variable size array must have the same count. Payloads can also be
+      given as one string of concatenated fixed size payloads.
+      """
+      self._checkArray()
+      if type(payloads) == str:
+         if self._prefix is not None:
+            raise Exception("concatenated payloads need a fixed size register")
+         buf = payloads
+         count = self.count
+         rows = -1
+      elif self._prefix is not None:
+         prefix = self._prefix
+         skip = prefix.size
+         counts = set([prefix.unpack_from(data)[0] for data in payloads])
+         if len(counts) > 1:
+            raise Exception("payloads of register %s differ in count" % self.path)
+         count = counts.pop() if counts else 0
+         buf = ''.join([data[skip:] for data in payloads])
+         rows = len(payloads)
+      else:
+         buf = ''.join(payloads)
+         count = self.count
+         rows = len(payloads)
+
+      a = numpy.frombuffer(buf, self.dtype)
+      if count == 1 and self._prefix is None:
+         return a
+      return a.reshape((rows, count))
+
+
+
+class SrdpRegisterMap(object):
+   """
+   Read-only register map (by index or by path) of an EDS: the registers
+   defined by the EDS itself, layered on the map of all registers it
+   includes. Base maps are shared by all EDS with the same includes.
+   """
+
+   __slots__ = ('own', 'base')
+
+   def __init__(self, own, base = None):
+      self.own = own
+      self.base = base
+
+
+   def __getitem__(self, key):
+      r = self.own.get(key, None)
+      if r is None:
+         if self.base is None:
+            raise KeyError(key)
+         return self.base[key]
+      return r
+
+
+   def get(self, key, default = None):
+      r = self.own.get(key, None)
+      if r is None and self.base is not None:
+         r = self.base.get(key, None)
+      if r is None:
+         return default
+      return r
+
+
+   def has_key(self, key):
+      return self.own.has_key(key) or (self.base is not None and self.base.has_key(key))
+
+
+   def __contains__(self, key):
+      return self.has_key(key)
+
+
+   def keys(self):
+      return [k for k, _ in self.items()]
+
+
+   def values(self):
+      return [r for _, r in self.items()]
+
+
+   def items(self):
+      if self.base is None:
+         return self.own.items()
+      return self.own.items() + self.base.items()
+
+
+   def __iter__(self):
+      return iter(self.keys())
+
+
+   def __len__(self):
+      if self.base is None:
+         return len(self.own)
+      return len(self.own) + len(self.base)
+
+
+   def __repr__(self):
+      return repr(dict(self.items()))
+
+
+   def __reduce__(self):
+      return (SrdpRegisterMap, (self.own, self.base))
+
+
 
 class SrdpEds:
 
-   SRDP_STYPE_TO_PTYPE = {'int8': 'b',
-                          'uint8': 'B',
-                          'int16': 'h',
-                          'uint16': 'H',
-                          'int32': 'l',
-                          'uint32': 'L',
-                          'int64': 'q',
-                          'uint64': 'Q',
-                          'float': 'f',
-                          'double': 'd'}
+   SRDP_STYPE_TO_PTYPE = SRDP_STYPE_TO_PTYPE
 
 
    def __init__(self):
@@ -48,11 +432,36 @@ class SrdpEds:
       self.registersByPath = {}
       self.registerIncludes = []
       self.registersIncluded = False
+      self._registerTable = None
+      self._registerOffset = 0
+
+
+   ## strings (keys and values) of all EDS are shared, so that the many
+   ## identical type names, access modes etc are only kept (and pickled
+   ## to the cache) once
+   ##
+   _strings = {}
+
+   @staticmethod
+   def _share(pairs):
+      strings = SrdpEds._strings
+      o = {}
+      for k, v in pairs:
+         if type(v) is unicode:
+            v = strings.setdefault(v, v)
+         o[strings.setdefault(k, k)] = v
+      return o
 
 
    def load(self, filename):
-      eds = json.loads(open(filename).read())
+      self._loadObject(json.loads(open(filename).read(), object_pairs_hook = SrdpEds._share))
 
+
+   def _loadObject(self, eds, share = False):
+      """
+      Load from a parsed EDS file. With share, strings are shared with
+      other EDS (for EDS parsed in another process).
+      """
       for att in ['uri', 'label', 'desc', 'vendor', 'model']:
          if eds.has_key(att):
             setattr(self, att, eds[att])
@@ -63,21 +472,140 @@ class SrdpEds:
          if type(r) in [str, unicode]:
             self.registerIncludes.append(r)
          else:
+            if share:
+               r = SrdpEds._share(r.iteritems())
+               if type(r['type']) == list:
+                  r['type'] = [SrdpEds._share(field.iteritems()) for field in r['type']]
+            if self.registersByIndex.has_key(r['index']):
+               raise Exception("Register overlap by index %d, %s" % (r['index'], self.uri))
+            if self.registersByPath.has_key(r['path']):
+               raise Exception("Register overlap by path %s, %s" % (r['path'], self.uri))
             self.registersByIndex[r['index']] = r
             self.registersByPath[r['path']] = r
 
+      self._registerTable = None
+
+
+   def validate(self):
+      """
+      Check the definitions of the registers defined by this EDS (not
+      including registers included from other EDS). Raises on the first
+      invalid definition.
+      """
+      if not self.uri:
+         raise Exception("EDS URI missing")
+
+      for r in sorted(self.registersByIndex.values(), key = lambda r: r['index']):
+         if type(r['index']) not in [int, long] or r['index'] < 0:
+            raise Exception("invalid register index %s" % r['index'])
+
+         where = "register %d" % r['index']
+
+         if type(r['path']) not in [str, unicode] or not r['path']:
+            raise Exception("%s: invalid path %s" % (where, r['path']))
+
+         if r.get('access', None) not in ['read', 'write', 'readwrite']:
+            raise Exception("%s: invalid access %s" % (where, r.get('access', None)))
+
+         count = r.get('count', 1)
+         if not ((type(count) in [int, long] and count >= 1) or count in ['uint8', 'uint16']):
+            raise Exception("%s: invalid count %s" % (where, count))
+
+         if not r.has_key('type'):
+            raise Exception("%s: type missing" % where)
+         rtype = r['type']
+         if type(rtype) == list:
+            if not rtype:
+               raise Exception("%s: struct type without fields" % where)
+            for field in rtype:
+               if not field.has_key('field') or not SRDP_STYPE_TO_PTYPE.has_key(field.get('type', None)):
+                  raise Exception("%s: invalid struct field %s" % (where, field))
+         elif rtype != 'char' and not SRDP_STYPE_TO_PTYPE.has_key(rtype):
+            raise Exception("%s: invalid type %s" % (where, rtype))
+
+
+   def compile(self, compiled = None, baseByIndex = None, baseByPath = None):
+      """
+      Compile the registers defined by this EDS into SrdpRegister
+      descriptors and build the dense register index table. The registers
+      included (already compiled) are given as base maps by index and path
+      (see SrdpRegisterMap). Descriptors already compiled can be given as
+      dict id(definition) -> descriptor.
+      """
+      if compiled is None:
+         compiled = {}
+
+      own = self.registersByIndex
+      if isinstance(own, SrdpRegisterMap):
+         if baseByIndex is None:
+            baseByIndex = own.base
+            baseByPath = self.registersByPath.base
+         own = own.own
+
+      byIndex = {}
+      byPath = {}
+      for r in own.values():
+         if not isinstance(r, SrdpRegister):
+            reg = compiled.get(id(r), None)
+            if reg is None:
+               reg = SrdpRegister(r)
+               compiled[id(r)] = reg
+            r = reg
+         byIndex[r.index] = r
+         byPath[r.path] = r
+
+      self.registersByIndex = SrdpRegisterMap(byIndex, baseByIndex)
+      self.registersByPath = SrdpRegisterMap(byPath, baseByPath)
+
+      ## the table only covers the index range of registers defined by
+      ## this EDS, included registers are looked up in the base map
+      ##
+      if byIndex:
+         self._registerOffset = min(byIndex.keys())
+         table = [None] * (max(byIndex.keys()) - self._registerOffset + 1)
+         for index, r in byIndex.items():
+            table[index - self._registerOffset] = r
+      else:
+         self._registerOffset = 0
+         table = []
+      self._registerTable = table
+
+
+   ## the index table is derived from the registers, and rebuilt instead
+   ## of pickled (to the cache)
+   ##
+   def __getstate__(self):
+      state = self.__dict__.copy()
+      state['_registerTable'] = None
+      return state
+
+
+   def __setstate__(self, state):
+      self.__dict__.update(state)
+      if isinstance(self.registersByIndex, SrdpRegisterMap):
+         self.compile()
+
 
    def getRegister(self, register):
       """
       Given a register path or index, return the register descriptor
       or None if register cannot be found.
       """
-      reg = None
+      if self._registerTable is None:
+         self.compile()
       if type(register) == int:
-         reg = self.registersByIndex.get(register, None)
+         i = register - self._registerOffset
+         if 0 <= i < len(self._registerTable):
+            reg = self._registerTable[i]
+            if reg is not None:
+               return reg
+         base = self.registersByIndex.base
+         if base is not None:
+            return base.get(register, None)
+         return None
       elif type(register) in [str, unicode]:
-         reg = self.registersByPath.get(register, None)
-      return reg
+         return self.registersByPath.get(register, None)
+      return None
 
 
    def unserialize(self, register, data):
@@ -88,37 +616,7 @@ class SrdpEds:
       reg = self.getRegister(register)
       if reg is None:
          raise Exception("no such register")
-
-      ## string
-      ##
-      if reg['type']  == 'char' and reg['count'] in ['uint8', 'uint16']:
-         if reg['count'] == 'uint8':
-            return reg, data[1:].decode('utf8')
-         elif reg['count'] == 'uint16':
-            return reg, data[2:].decode('utf8')
-
-      elif type(reg['type']) == list:
-         o = {}
-         td = '<'
-         for field in reg['type']:
-            td += SrdpEds.SRDP_STYPE_TO_PTYPE[field['type']]
-         tval = list(struct.unpack(td, data))
-         for i in xrange(len(tval)):
-            o[str(reg['type'][i]['field'])] = tval[i]
-
-         return reg, o
-
-      elif type(reg['count']) == int:
-         if reg['count'] == 1:
-            fmt = '<' + SrdpEds.SRDP_STYPE_TO_PTYPE[reg['type']]
-            tval = struct.unpack(fmt, data)[0]
-            return reg, tval
-         else:
-            if reg['type'] == 'uint8':
-               return reg, '0x' + binascii.hexlify(data)
-
-      else:
-         return reg, '?'
+      return reg, reg.decode(data)
 
 
    def serialize(self, register, value):
@@ -129,121 +627,454 @@ class SrdpEds:
       reg = self.getRegister(register)
       if reg is None:
          raise Exception("no such register")
+      return reg, reg.encode(value)
 
-      ## string
-      ##
-      if reg['type']  == 'char' and reg['count'] in ['uint8', 'uint16']:
-         if type(value) in [str, unicode]:
-            s = value.encode('utf8')
-            if reg['count'] == 'uint8':
-               return reg, struct.pack('<B', len(s)) + s
-            elif reg['count'] == 'uint16':
-               return reg, struct.pack('<H', len(s)) + s
-         else:
-            raise Exception("expected str/unicode value")
 
-      elif type(reg['type']) == list:
-         o = []
-         td = '<'
-         for field in reg['type']:
-            td += SrdpEds.SRDP_STYPE_TO_PTYPE[field['type']]
-            o.append(value[field['field']])
-         return reg, struct.pack(td, *o)
+   def unserializeArray(self, register, data):
+      """
+      Given a register path or index, decode the given data (octets)
+      into a NumPy array (see SrdpRegister.decodeArray).
+      """
+      reg = self.getRegister(register)
+      if reg is None:
+         raise Exception("no such register")
+      return reg, reg.decodeArray(data)
+
+
+   def unserializeBatch(self, register, payloads):
+      """
+      Given a register path or index, decode a list of payloads (octets)
+      into one NumPy array (see SrdpRegister.decodeBatch).
+      """
+      reg = self.getRegister(register)
+      if reg is None:
+         raise Exception("no such register")
+      return reg, reg.decodeBatch(payloads)
+
+
+
+def _readEdsFile(filename):
+   started = time.time()
+   try:
+      obj = json.loads(open(filename).read(), object_pairs_hook = SrdpEds._share)
+      eds = SrdpEds()
+      eds._loadObject(obj)
+      eds.filename = filename
+      eds.validate()
+   except Exception, e:
+      raise Exception("Invalid EDS file %s (%s)" % (filename, e))
+   return eds, obj, time.time() - started
+
 
-      elif type(reg['count']) == int:
-         if reg['count'] == 1:
-            fmt = '<' + SrdpEds.SRDP_STYPE_TO_PTYPE[reg['type']]
-            return reg, struct.pack(fmt, value)
+def _loadEdsFile(filename):
+   """
+   Parse and validate an EDS file. Returns (eds, seconds).
+   """
+   eds, _, seconds = _readEdsFile(filename)
+   return eds, seconds
 
-      raise Exception("serialize type not implemted")
+
+def _parseEdsFile(filename):
+   """
+   Parse and validate an EDS file in a loader process. Returns the parsed
+   file marshalled (which is much faster to load than a pickled SrdpEds)
+   and seconds.
+   """
+   _, obj, seconds = _readEdsFile(filename)
+   return marshal.dumps(obj), seconds
 
 
 
 class SrdpEdsDatabase:
+   """
+   Database of EDS loaded from EDS directories.
+
+   In lazy mode, loadFromDir only builds a manifest EDS URI -> filename
+   (taking the URI from the EDS file without parsing all of it), and EDS
+   are parsed, their includes resolved and checked when first requested
+   by getEdsByUri or getEdsByFilename.
+
+   Otherwise, EDS files can be parsed and validated in parallel by a pool
+   of processes (loadFromDir(dir, processes = ..)). Parse and validation
+   times of EDS files are recorded in timings (list of filename, seconds).
+
+   Included EDS are resolved before the EDS including them (include cycles
+   are reported as error), and the registers inherited from includes are
+   kept in read-only maps shared by all EDS with the same includes.
+   """
 
-   def __init__(self, debug = False):
+   ## binary cache file format: magic, version and the pickled database
+   ##
+   CACHE_MAGIC = 'SRDPEDSC'
+   CACHE_VERSION = 3
+
+   ## EDS URI member as found by scanning EDS files
+   ##
+   URI_PAT = re.compile(r'"uri"\s*:\s*("(?:[^"\\]|\\.)*")')
+
+   def __init__(self, debug = False, lazy = False):
       self.debug = debug
+      self.lazy = lazy
       self.reset()
 
 
    def reset(self):
       self._edsByUri = {}
       self._edsByFilename = {}
+      self._manifest = {}
+      self._parsed = {}
+      self._compiled = {}
+      self._bases = {}
+      self._flat = {}
+      self._sources = []
+      self.timings = []
 
 
-   def _includeRegisters(self, eds, uri):
+   def _getParsed(self, uri):
+      """
+      Get the EDS with given URI, resolved or only parsed (parsing it now
+      in lazy mode).
+      """
+      eds = self._edsByUri.get(uri, None)
+      if eds is None:
+         eds = self._parsed.get(uri, None)
+         if eds is None and self.lazy and self._manifest.has_key(uri):
+            eds, seconds = _loadEdsFile(self._manifest[uri])
+            self.timings.append((eds.filename, seconds))
+            self._parsed[uri] = eds
+      return eds
 
-      if self._edsByUri.has_key(uri):
 
-         for r in self._edsByUri[uri].registersByIndex.values():
+   def _scanUri(self, filename):
+      text = open(filename).read()
+      uris = SrdpEdsDatabase.URI_PAT.findall(text)
+      if len(uris) == 1:
+         return str(json.loads(uris[0]))
 
-            if eds.registersByIndex.has_key(r['index']):
-               msg = "Register overlap by index %d, %s, %s" % (r['index'], eds.uri, uri)
-               raise Exception(msg)
-            else:
-               eds.registersByIndex[r['index']] = r
+      ## no or more than one "uri" member: need to parse
+      ##
+      return str(json.loads(text).get('uri', None))
 
-            if eds.registersByPath.has_key(r['path']):
-               msg = "Register overlap by path %s, %s, %s" % (r['path'], eds.uri, uri)
-               raise Exception(msg)
-            else:
-               eds.registersByPath[r['path']] = r
 
-         eds.registersIncluded = True
+   def _includeOrder(self, uri, path, order, ordered):
+      """
+      Collect the EDS to resolve before the EDS with given URI can be
+      resolved (itself last) in dependency order.
+      """
+      if self._edsByUri.has_key(uri) or uri in ordered:
+         return
 
-         if not self._edsByUri[uri].registersIncluded:
-            for u in self._edsByUri[uri].registerIncludes:
-               self._includeRegisters(eds, u)
+      if uri in path:
+         cycle = path[path.index(uri):] + [uri]
+         raise Exception("Register include cycle: %s" % " -> ".join(cycle))
 
-      else:
+      eds = self._getParsed(uri)
+      if eds is None:
          raise Exception("Register include failed: no EDS with URI %s in database" % uri)
 
+      path.append(uri)
+      for u in eds.registerIncludes:
+         self._includeOrder(u, path, order, ordered)
+      path.pop()
+
+      order.append(uri)
+      ordered.add(uri)
+
 
-   def loadFromDir(self, dir):
+   def _flatten(self, uri):
+      """
+      Get the maps (by index and path) of all registers of a resolved EDS,
+      as read-only maps without base (shared by all EDS including it).
+      """
+      flat = self._flat.get(uri, None)
+      if flat is None:
+         eds = self._edsByUri[uri]
+         if eds.registersByIndex.base is None:
+            flat = (eds.registersByIndex, eds.registersByPath)
+         else:
+            flat = (SrdpRegisterMap(dict(eds.registersByIndex.items())),
+                    SrdpRegisterMap(dict(eds.registersByPath.items())))
+         self._flat[uri] = flat
+      return flat
+
+
+   def _getBase(self, eds):
+      """
+      Get the base maps (by index and path) of the registers included by
+      an EDS, shared by all EDS with the same includes.
+      """
+      includes = tuple(eds.registerIncludes)
+      if not includes:
+         return None, None
+
+      base = self._bases.get(includes, None)
+      if base is None:
+         if len(includes) == 1:
+            base = self._flatten(includes[0])
+         else:
+            byIndex = {}
+            byPath = {}
+            for uri in includes:
+               flatByIndex, flatByPath = self._flatten(uri)
+
+               ## registers included more than once over different
+               ## includes (of a common EDS) are no overlap
+               ##
+               for index, r in flatByIndex.items():
+                  if byIndex.get(index, r) is not r:
+                     raise Exception("Register overlap by index %d, %s, %s" % (index, eds.uri, uri))
+                  byIndex[index] = r
+               for path, r in flatByPath.items():
+                  if byPath.get(path, r) is not r:
+                     raise Exception("Register overlap by path %s, %s, %s" % (path, eds.uri, uri))
+                  byPath[path] = r
+            base = (SrdpRegisterMap(byIndex), SrdpRegisterMap(byPath))
+         self._bases[includes] = base
+      return base
+
+
+   def _includedFrom(self, eds, i, key):
+      """
+      URI of the include of an EDS providing the register with given key
+      (index for i = 0, path for i = 1).
+      """
+      for uri in eds.registerIncludes:
+         if self._flatten(uri)[i].has_key(key):
+            return uri
+
+
+   def _resolveOne(self, uri):
+      eds = self._parsed.pop(uri)
+      if self.debug:
+         log.msg("Postprocessing EDS %s [%s]" % (eds.uri, eds.filename))
 
+      baseByIndex, baseByPath = self._getBase(eds)
+      if baseByIndex is not None:
+
+         ## base maps are flat (without base of their own)
+         ##
+         inheritedByIndex = baseByIndex.own
+         inheritedByPath = baseByPath.own
+         for r in eds.registersByIndex.values():
+            if inheritedByIndex.has_key(r['index']):
+               msg = "Register overlap by index %d, %s, %s" % (r['index'], eds.uri, self._includedFrom(eds, 0, r['index']))
+               raise Exception(msg)
+            if inheritedByPath.has_key(r['path']):
+               msg = "Register overlap by path %s, %s, %s" % (r['path'], eds.uri, self._includedFrom(eds, 1, r['path']))
+               raise Exception(msg)
+         eds.registersIncluded = True
+
+      eds.compile(self._compiled, baseByIndex, baseByPath)
+      self._edsByUri[uri] = eds
+      self._edsByFilename[eds.filename] = eds
+
+
+   def _resolve(self, uri):
+      """
+      Resolve the includes of the EDS with given URI (resolving included
+      EDS first) and compile its registers.
+      """
+      order = []
+      self._includeOrder(uri, [], order, set())
+      for u in order:
+         self._resolveOne(u)
+      return self._edsByUri[uri]
+
+
+   def loadFromDir(self, dir, processes = 1):
+      """
+      Load EDS files from a directory (recursively). EDS files are parsed
+      and validated by a pool of the given number of processes (None for
+      one per CPU). Results are merged in the order files are found (as
+      when loading sequentially), so of EDS files with the same URI, the
+      same file is loaded. Returns the number of EDS loaded.
+      """
       n = 0
 
+      ## remember modification times and sizes of everything the database
+      ## is built from (taken before reading), to validate a cache later
+      ##
+      stats = {}
+      self._sources.append((dir, stats))
+
+      filenames = []
       pat = re.compile("^.*\.json$")
       for root, dirs, files in os.walk(dir):
+         stats[root] = self._stat(root)
          for f in files:
             if pat.match(f):
-               f = os.path.join(root, f)
+               f = str(os.path.join(root, f))
+               stats[f] = self._stat(f)
+               filenames.append(f)
+
+      if self.lazy:
+         for f in filenames:
+            uri = self._scanUri(f)
+            if not self._manifest.has_key(uri):
+               self._manifest[uri] = f
+               n += 1
+            else:
+               print "Warning: EDS file with same URI was already loaded (skipping this one)"
+         return n
+
+      if processes is None:
+         processes = multiprocessing.cpu_count()
+
+      pool = None
+      if processes > 1 and len(filenames) > 1:
+         pool = multiprocessing.Pool(processes)
+         chunksize = max(1, len(filenames) / (4 * processes))
+         results = pool.imap(_parseEdsFile, filenames, chunksize)
+      else:
+         results = itertools.imap(_loadEdsFile, filenames)
+
+      try:
+         for filename, (eds, seconds) in itertools.izip(filenames, results):
+            self.timings.append((filename, seconds))
+            if pool is not None:
+               data = eds
                eds = SrdpEds()
-               eds.load(f)
-               eds.filename = f
-               uri = str(eds.uri)
-               if not self._edsByUri.has_key(uri):
-                  self._edsByUri[uri] = eds
-                  self._edsByFilename[str(f)] = eds
-                  n += 1
-               else:
-                  print "Warning: EDS file with same URI was already loaded (skipping this one)"
+               eds._loadObject(marshal.loads(data), share = True)
+               eds.filename = filename
+            uri = str(eds.uri)
+            if not self._manifest.has_key(uri):
+               self._manifest[uri] = eds.filename
+               self._parsed[uri] = eds
+               n += 1
+            else:
+               print "Warning: EDS file with same URI was already loaded (skipping this one)"
+      finally:
+         if pool is not None:
+            pool.terminate()
+            pool.join()
 
       return n
 
 
+   def _stat(self, path):
+      st = os.stat(path)
+      return (st.st_mtime, st.st_size)
+
+
+   def saveCache(self, path):
+      """
+      Save the database (after check()) to a binary cache file.
+      """
+      d = os.path.dirname(path)
+      if d and not os.path.isdir(d):
+         os.makedirs(d)
+
+      data = cPickle.dumps((self.lazy,
+                            self._sources,
+                            self._manifest,
+                            self._edsByUri,
+                            self._edsByFilename), cPickle.HIGHEST_PROTOCOL)
+
+      ## write to a temporary file and rename, so concurrent readers never
+      ## see a partially written cache
+      ##
+      tmp = "%s.%d.tmp" % (path, os.getpid())
+      with open(tmp, 'wb') as f:
+         f.write(SrdpEdsDatabase.CACHE_MAGIC)
+         f.write(struct.pack("<L", SrdpEdsDatabase.CACHE_VERSION))
+         f.write(data)
+      os.rename(tmp, path)
+
+
+   def loadCache(self, path, dirs):
+      """
+      Load the database from a binary cache file, if the cache was built from
+      the given EDS directories (in this order) and none of the directories
+      or EDS files changed since. Returns the number of EDS loaded, or None
+      if the cache is missing or not valid (the database is then unchanged).
+      A cache written in lazy mode (holding the manifest and the EDS
+      requested so far) can only be loaded in lazy mode.
+      """
+      try:
+         with open(path, 'rb') as f:
+            data = f.read()
+      except IOError:
+         return None
+
+      try:
+         header = len(SrdpEdsDatabase.CACHE_MAGIC) + 4
+         if data[:len(SrdpEdsDatabase.CACHE_MAGIC)] != SrdpEdsDatabase.CACHE_MAGIC or \
+            struct.unpack("<L", data[header - 4:header])[0] != SrdpEdsDatabase.CACHE_VERSION:
+            raise Exception("unsupported cache format")
+
+         ## unpickling creates lots of objects, but no garbage cycles
+         ##
+         enabled = gc.isenabled()
+         gc.disable()
+         try:
+            lazy, sources, manifest, edsByUri, edsByFilename = cPickle.loads(data[header:])
+         finally:
+            if enabled:
+               gc.enable()
+      except Exception, e:
+         log.msg("SRDP EDS cache %s ignored (%s)" % (path, e))
+         return None
+
+      if [d for d, _ in sources] != list(dirs) or (lazy and not self.lazy):
+         return None
+
+      for _, stats in sources:
+         for p, st in stats.items():
+            try:
+               if self._stat(p) != st:
+                  return None
+            except OSError:
+               return None
+
+      self._sources = sources
+      self._manifest = manifest
+      self._edsByUri = edsByUri
+      self._edsByFilename = edsByFilename
+      return len(self._manifest)
+
+
    def check(self):
+      """
+      Resolve register includes and compile the registers of all EDS loaded.
+      In lazy mode, this is done for each EDS when first requested. Returns
+      the number of EDS in the database.
+      """
+      if self.lazy:
+         return len(self._manifest)
 
-      for eds in self._edsByUri.values():
-         if self.debug:
-            log.msg("Postprocessing EDS %s [%s]" % (eds.uri, eds.filename))
-         for i in eds.registerIncludes:
-            self._includeRegisters(eds, i)
+      for uri in sorted(self._parsed.keys()):
+         if self._parsed.has_key(uri):
+            self._resolve(uri)
 
       return len(self._edsByUri)
 
 
+   def getUris(self):
+      """
+      Get the URIs of all EDS in the database.
+      """
+      return sorted(self._manifest.keys())
+
+
    def getEdsByUri(self, uri):
-      return self._edsByUri.get(uri, None)
+      eds = self._edsByUri.get(uri, None)
+      if eds is None and (self._parsed.has_key(uri) or (self.lazy and self._manifest.has_key(uri))):
+         eds = self._resolve(uri)
+      return eds
 
 
    def getEdsByFilename(self, filename):
-      return self._edsByFilename.get(filename, None)
+      eds = self._edsByFilename.get(filename, None)
+      if eds is None:
+         for uri, f in self._manifest.items():
+            if f == filename:
+               return self.getEdsByUri(uri)
+      return eds
 
 
    def pprint(self, uri = None):
       if uri is None:
-         for eds in self._edsByUri.values():
+         for eds in [self.getEdsByUri(u) for u in self.getUris()]:
             print "="*30
             print "EDS : ", eds.uri
             pprint(eds.registerIncludes)
@@ -0,0 +1,498 @@
+###############################################################################
+##
+##  Copyright 2013 Tavendo GmbH
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##      http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+__all__ = ('SrdpEmulator',
+           'SrdpEmulatorProvider',
+           'connectSocketPair',
+           'run',)
+
+
+import sys, os, socket, random, uuid, argparse, pkg_resources
+
+from zope.interface import implementer
+
+from twisted.python import log
+from twisted.internet.protocol import Factory
+from twisted.internet.task import LoopingCall
+
+from _version import __version__
+
+from interfaces import ISrdpProvider
+from srdp import SrdpFrameHeader, SrdpException, SrdpDatagramServerProtocol
+from eds import SrdpEds, SrdpEdsDatabase
+
+
+
+class _SrdpEmulatedDevice(object):
+   """
+   Virtual device: the EDS and the current register values (wire octets).
+   """
+
+   def __init__(self, index, eds, registers):
+      self.index = index
+      self.eds = eds
+      self.registers = registers
+
+
+
+class SrdpEmulator(object):
+   """
+   SRDP adapter emulator driven by the EDS database.
+
+   The emulated adapter (device 1) has any number of virtual devices
+   (devices 2, 3, ..) attached, each implementing one of the given device
+   EDS. Every register of every device can be read and written (subject to
+   its access mode): values are kept as octets, initialized from defaults
+   serialized with SrdpEds.serialize. Readable application registers of
+   the virtual devices change randomly at a configurable total rate, and
+   each change is notified to all channels connected to the emulator.
+
+   The emulator is served over SRDP channels with SrdpEmulatorProvider,
+   eg on a UDP port (listenUDP) or on one end of a socket pair
+   (connectSocketPair).
+   """
+
+   ADAPTER_EDS_URI = "http://eds.tavendo.com/adapter/adapter"
+
+   ## adapter and device index are 12 bit, device 1 is the adapter
+   ##
+   DEVICES_MAX = 0x0fff - 1
+
+   ## longest interval between change notification bursts (seconds)
+   ##
+   CHANGE_TICK = 0.01
+
+
+   def __init__(self,
+                edsDb,
+                devices = 1,
+                adapterEdsUri = ADAPTER_EDS_URI,
+                deviceEdsUris = None,
+                changeRate = 0,
+                seed = None,
+                debug = False,
+                reactor = None):
+      if devices < 0 or devices > SrdpEmulator.DEVICES_MAX:
+         raise Exception("number of devices must be in [0, %d]" % SrdpEmulator.DEVICES_MAX)
+
+      self._edsDb = edsDb
+      self._random = random.Random(seed)
+      self._debug = debug
+
+      if reactor is None:
+         from twisted.internet import reactor
+      self._reactor = reactor
+
+      adapterEds = edsDb.getEdsByUri(adapterEdsUri)
+      if adapterEds is None:
+         raise Exception("no EDS with URI %s in database" % adapterEdsUri)
+
+      if deviceEdsUris is None:
+         deviceEdsUris = self._leafDeviceEdsUris()
+      deviceEds = []
+      for uri in deviceEdsUris:
+         eds = edsDb.getEdsByUri(uri)
+         if eds is None:
+            raise Exception("no EDS with URI %s in database" % uri)
+         deviceEds.append(eds)
+      if devices and not deviceEds:
+         raise Exception("no device EDS to emulate")
+
+      self._devices = {}
+      for i in xrange(devices):
+         self._addDevice(i + 2, deviceEds[i % len(deviceEds)])
+      self._addDevice(1, adapterEds)
+
+      ## registers with changing values, per device EDS
+      ##
+      self._changing = {}
+      self._changingDevices = []
+      for device in self._devices.values():
+         if device.index > 1 and self._getChanging(device.eds):
+            self._changingDevices.append(device.index)
+
+      self._channels = set()
+      self._changeRate = 0
+      self._changeCredit = 0.
+      self._changer = None
+      self.setChangeRate(changeRate)
+
+      self.changesSent = 0
+
+
+   def _leafDeviceEdsUris(self):
+      """
+      URIs of all device EDS in the database not included by another one.
+      """
+      uris = []
+      included = set()
+      for uri in self._edsDb.getUris():
+         if "/device/" in uri:
+            uris.append(uri)
+            included.update(self._edsDb.getEdsByUri(uri).registerIncludes)
+      return sorted([uri for uri in uris if uri not in included])
+
+
+   def _addDevice(self, index, eds):
+      registers = {}
+      for reg in eds.registersByIndex.values():
+         _, data = eds.serialize(reg['index'], self._defaultValue(index, eds, reg))
+         registers[reg['index']] = bytearray(data)
+      self._devices[index] = _SrdpEmulatedDevice(index, eds, registers)
+
+
+   def _defaultValue(self, index, eds, reg):
+      path = reg['path']
+
+      if path == '/system/id':
+         return list(bytearray(uuid.UUID(int = self._random.getrandbits(128), version = 4).bytes))
+      elif path == '/system/eds':
+         return eds.uri
+      elif path.startswith('/system/version'):
+         return "SRDP Emulator %s" % __version__
+      elif path == '/system/devices':
+         return sorted([i for i in self._devices.keys() if i > 1])
+
+      if reg['type'] == 'char':
+         return u""
+      elif type(reg['type']) == list:
+         value = {}
+         for field in reg['type']:
+            value[field['field']] = 0
+         return value
+      elif reg['count'] == 1:
+         return 0
+      elif type(reg['count']) == int:
+         return [0] * reg['count']
+      else:
+         return []
+
+
+   def _getChanging(self, eds):
+      changing = self._changing.get(eds.uri, None)
+      if changing is None:
+         changing = []
+         for reg in eds.registersByIndex.values():
+            if reg['index'] >= 1024 and \
+               reg['access'] in ['read', 'readwrite'] and \
+               reg['type'] != 'char' and \
+               (type(reg['type']) == list or reg['count'] == 1):
+               changing.append(reg)
+         changing.sort(key = lambda reg: reg['index'])
+         self._changing[eds.uri] = changing
+      return changing
+
+
+   def _randomScalar(self, stype):
+      if stype in ['float', 'double']:
+         return round(self._random.uniform(0., 1000.), 3)
+      ptype = SrdpEds.SRDP_STYPE_TO_PTYPE[stype]
+      bits = {'b': 8, 'h': 16, 'l': 32, 'q': 64}[ptype.lower()]
+      if ptype.isupper():
+         return self._random.randint(0, (1 << bits) - 1)
+      else:
+         return self._random.randint(-(1 << (bits - 1)), (1 << (bits - 1)) - 1)
+
+
+   def getDevice(self, device):
+      return self._devices.get(device, None)
+
+
+   def getDevices(self):
+      return sorted(self._devices.keys())
+
+
+   def readRegister(self, device, register, position = 0, length = 0):
+      """
+      Read (part of) a register. A length of 0 reads up to the end of the
+      register.
+      """
+      reg, data = self._getRegister(device, register, 'read')
+      if position > len(data):
+         raise SrdpException(SrdpFrameHeader.SRDP_ERR_INVALID_REG_POSLEN)
+      if length:
+         if position + length > len(data):
+            raise SrdpException(SrdpFrameHeader.SRDP_ERR_INVALID_REG_POSLEN)
+         return str(data[position:position + length])
+      return str(data[position:])
+
+
+   def writeRegister(self, device, register, position, data):
+      """
+      Write (part of) a register. Registers of fixed size cannot be written
+      beyond their end, variable size registers are truncated or extended.
+      Returns the number of octets written.
+      """
+      reg, current = self._getRegister(device, register, 'write')
+      if position > len(current):
+         raise SrdpException(SrdpFrameHeader.SRDP_ERR_INVALID_REG_POSLEN)
+      if type(reg['count']) == int:
+         if position + len(data) > len(current):
+            raise SrdpException(SrdpFrameHeader.SRDP_ERR_INVALID_REG_POSLEN)
+         current[position:position + len(data)] = data
+      else:
+         self._devices[device].registers[register] = current[:position] + bytearray(data)
+      return len(data)
+
+
+   def _getRegister(self, device, register, access):
+      dev = self._devices.get(device, None)
+      if dev is None:
+         raise SrdpException(SrdpFrameHeader.SRDP_ERR_NO_SUCH_DEVICE)
+      reg = dev.eds.registersByIndex.get(register, None)
+      if reg is None:
+         raise SrdpException(SrdpFrameHeader.SRDP_ERR_NO_SUCH_REGISTER)
+      if access not in reg['access']:
+         raise SrdpException(SrdpFrameHeader.SRDP_ERR_INVALID_REG_OP)
+      return reg, dev.registers[register]
+
+
+   def setChangeRate(self, changeRate):
+      """
+      Set the total rate of register changes (changes/s over all devices).
+      """
+      self._changeRate = changeRate
+      if self._changer is not None:
+         if self._changer.running:
+            self._changer.stop()
+         self._changer = None
+      if changeRate > 0 and self._changingDevices:
+         self._changer = LoopingCall(self._changeRegisters)
+         self._changer.clock = self._reactor
+         if self._channels:
+            self._startChanger()
+
+
+   def _startChanger(self):
+      if self._changer is not None and not self._changer.running:
+         self._changeCredit = 0.
+         self._changer.start(min(1. / self._changeRate, SrdpEmulator.CHANGE_TICK), now = False)
+
+
+   def _stopChanger(self):
+      if self._changer is not None and self._changer.running:
+         self._changer.stop()
+
+
+   def _changeRegisters(self):
+      self._changeCredit += self._changeRate * self._changer.interval
+      while self._changeCredit >= 1.:
+         self._changeCredit -= 1.
+         self.changeRegister()
+
+
+   def changeRegister(self, device = None, register = None, value = None):
+      """
+      Change a register to the given value (or a random one), and notify
+      the change on all connected channels. Device and register are
+      chosen randomly when not given.
+      """
+      if device is None:
+         device = self._random.choice(self._changingDevices)
+      dev = self._devices[device]
+      if register is None:
+         reg = self._random.choice(self._getChanging(dev.eds))
+      else:
+         reg = dev.eds.getRegister(register)
+
+      if value is None:
+         if type(reg['type']) == list:
+            value = {}
+            for field in reg['type']:
+               value[field['field']] = self._randomScalar(field['type'])
+         else:
+            value = self._randomScalar(reg['type'])
+
+      _, data = dev.eds.serialize(reg['index'], value)
+      dev.registers[reg['index']] = bytearray(data)
+
+      for channel in self._channels:
+         channel.notifyRegister(device, reg['index'], 0, len(data)).addErrback(self._changeFailed)
+      self.changesSent += len(self._channels)
+
+
+   def _changeFailed(self, failure):
+      if self._debug:
+         log.msg("SRDP emulator change notification failed: %s" % failure.getErrorMessage())
+
+
+   def _channelOpen(self, channel):
+      self._channels.add(channel)
+      self._startChanger()
+
+
+   def _channelClose(self, channel):
+      self._channels.discard(channel)
+      if not self._channels:
+         self._stopChanger()
+
+
+
+@implementer(ISrdpProvider)
+class SrdpEmulatorProvider(object):
+   """
+   SRDP provider serving an emulated adapter on one channel.
+   """
+
+   def __init__(self, emulator):
+      self._emulator = emulator
+      self.channel = None
+
+
+   def onChannelOpen(self, channel):
+      self._emulator._channelOpen(channel)
+
+
+   def onChannelClose(self, reason):
+      self._emulator._channelClose(self.channel)
+
+
+   def onRegisterRead(self, device, register, position, length):
+      return self._emulator.readRegister(device, register, position, length)
+
+
+   def onRegisterWrite(self, device, register, position, data):
+      return self._emulator.writeRegister(device, register, position, data)
+
+
+   def onRegisterChange(self, device, register, position, data):
+      pass
+
+
+
+def connectSocketPair(hostProtocol, emulatorProtocol, reactor = None):
+   """
+   Connect two stream protocols (eg a SrdpStreamProtocol on the host side
+   and one serving an emulator) over a local socket pair.
+   """
+   if reactor is None:
+      from twisted.internet import reactor
+
+   s1, s2 = socket.socketpair()
+   for s, protocol in [(s1, hostProtocol), (s2, emulatorProtocol)]:
+      factory = Factory()
+      factory.buildProtocol = lambda addr, protocol = protocol: protocol
+      s.setblocking(False)
+      reactor.adoptStreamConnection(s.fileno(), socket.AF_UNIX, factory)
+      s.close()
+
+
+
+def run():
+   """
+   Console entry point: run an emulated adapter on a UDP port.
+   """
+   parser = argparse.ArgumentParser(prog = "srdpemu",
+                                    description = "SRDP Adapter Emulator v%s" % __version__)
+
+   parser.add_argument("-p",
+                       "--port",
+                       type = int,
+                       default = 1910,
+                       metavar = "<port>",
+                       help = "UDP port to listen on.")
+
+   parser.add_argument("--interface",
+                       type = str,
+                       default = "127.0.0.1",
+                       metavar = "<interface>",
+                       help = "Interface to listen on.")
+
+   parser.add_argument("-n",
+                       "--devices",
+                       type = int,
+                       default = 1,
+                       metavar = "<count>",
+                       help = "Number of virtual devices attached to the adapter.")
+
+   parser.add_argument("-r",
+                       "--rate",
+                       type = float,
+                       default = 0,
+                       metavar = "<changes/s>",
+                       help = "Total rate of register change notifications (over all devices).")
+
+   parser.add_argument("-e",
+                       "--eds",
+                       type = str,
+                       action = "append",
+                       metavar = "<directory path>",
+                       help = "Path to EDS directory.")
+
+   parser.add_argument("--adapter",
+                       type = str,
+                       default = SrdpEmulator.ADAPTER_EDS_URI,
+                       metavar = "<EDS URI>",
+                       help = "EDS of the emulated adapter.")
+
+   parser.add_argument("--device",
+                       type = str,
+                       action = "append",
+                       metavar = "<EDS URI>",
+                       help = "EDS of virtual devices (devices are assigned round robin, default: all device EDS).")
+
+   parser.add_argument("--seed",
+                       type = int,
+                       metavar = "<seed>",
+                       help = "Random seed (for reproducible UUIDs and register changes).")
+
+   parser.add_argument("-d",
+                       "--debug",
+                       help = "Enable debug output.",
+                       action = "store_true")
+
+   args = parser.parse_args()
+
+   from twisted.internet import reactor
+
+   if args.debug:
+      log.startLogging(sys.stdout)
+
+   edsDirectories = []
+   if args.eds:
+      for e in args.eds:
+         edsDirectories.append(os.path.abspath(e))
+   edsDirectories.append(pkg_resources.resource_filename("srdp", "eds"))
+
+   edsDb = SrdpEdsDatabase(debug = args.debug)
+   for d in edsDirectories:
+      edsDb.loadFromDir(d)
+   edsDb.check()
+
+   emulator = SrdpEmulator(edsDb,
+                           devices = args.devices,
+                           adapterEdsUri = args.adapter,
+                           deviceEdsUris = args.device,
+                           changeRate = args.rate,
+                           seed = args.seed,
+                           debug = args.debug,
+                           reactor = reactor)
+
+   protocol = SrdpDatagramServerProtocol(lambda addr: SrdpEmulatorProvider(emulator),
+                                         debug = args.debug,
+                                         reactor = reactor)
+   reactor.listenUDP(args.port, protocol, interface = args.interface)
+
+   print "SRDP adapter emulator with %d devices listening on UDP %s:%d .." % (args.devices, args.interface, args.port)
+
+   reactor.run()
+
+
+
+if __name__ == '__main__':
+   run()
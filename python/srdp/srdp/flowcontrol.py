@@ -0,0 +1,246 @@
+###############################################################################
+##
+##  Copyright 2013 Tavendo GmbH
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##      http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+__all__ = ("SrdpSendWindow",
+           "SrdpRttEstimator",
+           "SrdpDuplicateFilter",
+           "SrdpTokenBucket",)
+
+
+class SrdpSendWindow(object):
+   """
+   Send window limiting the number of requests in flight on a channel.
+
+   The window size adapts AIMD-style: it grows by one per clean response
+   while below the slow start threshold and by 1/size per clean response
+   above it, and is halved when a request is lost (timeout, CRC error or
+   other transport level failure). Only one decrease happens per window of
+   requests, so a burst of losses from one overrun halves the window once.
+   """
+
+   def __init__(self, initial = 1, minimum = 1, maximum = 8):
+      if not (1 <= minimum <= initial <= maximum):
+         raise Exception("invalid send window limits (need 1 <= minimum <= initial <= maximum)")
+      self.minimum = minimum
+      self.maximum = maximum
+      self.size = float(initial)
+      self.ssthresh = float(maximum)
+      self.inflight = 0
+      self.inflightMax = 0
+
+      ## requests are numbered in send order: a loss only decreases the
+      ## window when the lost request was sent after the last decrease
+      ##
+      self._sent = 0
+      self._recoveryPoint = 0
+
+
+   def canSend(self):
+      """
+      Check if another request may be put in flight.
+      """
+      return self.inflight < int(self.size)
+
+
+   def acquire(self):
+      """
+      Account for a request put in flight. Returns a ticket that must be
+      handed back to release().
+      """
+      self.inflight += 1
+      if self.inflight > self.inflightMax:
+         self.inflightMax = self.inflight
+      self._sent += 1
+      return self._sent
+
+
+   def release(self, ticket, congested = False):
+      """
+      Account for a request leaving flight, either completed cleanly or
+      lost / failed due to congestion. Every request put in flight must
+      leave it through release() or abandon() exactly once.
+      """
+      self.inflight -= 1
+      if congested:
+         self.onTimeout(ticket)
+      else:
+         self.increase()
+
+
+   def abandon(self, ticket):
+      """
+      Account for a request leaving flight without any outcome (eg failed
+      when the channel was closed), not changing the window size.
+      """
+      self.inflight -= 1
+
+
+   def onTimeout(self, ticket):
+      """
+      Account for a request in flight that timed out (and is retransmitted
+      or given up on). Returns True when this starts a new loss event (the
+      window was decreased).
+      """
+      if ticket > self._recoveryPoint:
+         self.decrease()
+         return True
+      return False
+
+
+   def onLoss(self):
+      """
+      Account for a loss that cannot be attributed to a request in flight
+      (eg a frame with CRC error). This only shrinks the window and does
+      not free a slot: the request hit leaves flight when it times out.
+      """
+      if self._sent > self._recoveryPoint:
+         self.decrease()
+
+
+   def increase(self):
+      if self.size < self.ssthresh:
+         self.size += 1.
+      else:
+         self.size += 1. / self.size
+      if self.size > self.maximum:
+         self.size = float(self.maximum)
+
+
+   def decrease(self):
+      self.ssthresh = max(self.size / 2., float(self.minimum))
+      self.size = self.ssthresh
+      self._recoveryPoint = self._sent
+
+
+   def __str__(self):
+      return "size = %.2f, ssthresh = %.2f, inflight = %d" % (self.size, self.ssthresh, self.inflight)
+
+
+
+class SrdpRttEstimator(object):
+   """
+   Round-trip time estimator and retransmission timeout (RTO) computation
+   following RFC 6298 (SRTT/RTTVAR with exponential backoff).
+   """
+
+   ALPHA = 1. / 8.
+   BETA = 1. / 4.
+   K = 4.
+
+   def __init__(self, initial = 1., minimum = 0.2, maximum = 60.):
+      self.minimum = minimum
+      self.maximum = maximum
+      self.srtt = None
+      self.rttvar = None
+      self.rto = initial
+
+
+   def sample(self, rtt):
+      """
+      Feed a RTT measurement (seconds) of a request that was not
+      retransmitted (Karn's algorithm). This also resets any backoff.
+      """
+      if self.srtt is None:
+         self.srtt = rtt
+         self.rttvar = rtt / 2.
+      else:
+         self.rttvar = (1. - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+         self.srtt = (1. - self.ALPHA) * self.srtt + self.ALPHA * rtt
+      self.rto = min(max(self.srtt + self.K * self.rttvar, self.minimum), self.maximum)
+
+
+   def backoff(self):
+      """
+      Double the RTO after a retransmission timeout (once per loss event,
+      not for every request timing out in it).
+      """
+      self.rto = min(self.rto * 2., self.maximum)
+
+
+   def __str__(self):
+      if self.srtt is None:
+         return "srtt = -, rttvar = -, rto = %.3f" % self.rto
+      return "srtt = %.3f, rttvar = %.3f, rto = %.3f" % (self.srtt, self.rttvar, self.rto)
+
+
+
+class SrdpDuplicateFilter(object):
+   """
+   Sliding window over the sequence numbers of recently completed requests,
+   used to recognize (and silently drop) duplicate responses caused by
+   retransmissions.
+   """
+
+   def __init__(self, size = 256):
+      self._ring = [None] * size
+      self._pos = 0
+      self._seen = set()
+      self.duplicates = 0
+
+
+   def add(self, seq):
+      old = self._ring[self._pos]
+      if old is not None:
+         self._seen.discard(old)
+      self._ring[self._pos] = seq
+      self._pos = (self._pos + 1) % len(self._ring)
+      self._seen.add(seq)
+
+
+   def isDuplicate(self, seq):
+      if seq in self._seen:
+         self.duplicates += 1
+         return True
+      return False
+
+
+
+class SrdpTokenBucket(object):
+   """
+   Token bucket for pacing output: tokens (octets) are added at a fixed
+   rate up to the bucket capacity, and output may only be released while
+   tokens are available.
+   """
+
+   def __init__(self, rate, capacity, now = 0.):
+      if rate <= 0 or capacity < 1:
+         raise Exception("token bucket needs a positive rate and a capacity of at least 1")
+      self.rate = float(rate)
+      self.capacity = capacity
+      self.tokens = float(capacity)
+      self._last = now
+
+
+   def refill(self, now):
+      if now > self._last:
+         self.tokens = min(self.tokens + (now - self._last) * self.rate, float(self.capacity))
+      self._last = now
+
+
+   def consume(self, n):
+      self.tokens -= n
+
+
+   def delay(self, n):
+      """
+      Seconds until n tokens (at most the capacity) are available.
+      """
+      missing = min(n, self.capacity) - self.tokens
+      if missing <= 0:
+         return 0.
+      return missing / self.rate
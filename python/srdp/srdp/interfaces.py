@@ -32,10 +32,16 @@ class ISrdpProvider(zope.interface.Interface):
 
    def onRegisterRead(device, register, position, length):
       """
+      Register read request from the peer. Return the register data (or a
+      Deferred that fires with it), or raise SrdpException(SRDP_ERR_*) to
+      answer with an ERR frame.
       """
 
    def onRegisterWrite(device, register, position, data):
       """
+      Register write request from the peer. Return the number of octets
+      written (or a Deferred that fires with it, None meaning all), or
+      raise SrdpException(SRDP_ERR_*) to answer with an ERR frame.
       """
 
    def onRegisterChange(device, register, position, data):
@@ -53,11 +59,19 @@ class ISrdpChannel(zope.interface.Interface):
       """
       """
 
-   def readRegister(device, register, position = 0, length = 0):
+   def readRegister(device, register, position = 0, length = 0, retries = None):
       """
       """
 
-   def writeRegister(device, register, data, position = 0):
+   def readRegisters(device, registers, concurrency = None, retries = None):
+      """
+      """
+
+   def writeRegister(device, register, data, position = 0, retries = None):
+      """
+      """
+
+   def subscribe(handler, device = None, register = None):
       """
       """
 
@@ -0,0 +1,222 @@
+###############################################################################
+##
+##  Copyright 2013 Tavendo GmbH
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##      http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+__all__ = ("SrdpLatencyHistogram",
+           "SrdpChannelMetrics",)
+
+from bisect import bisect_left
+
+
+def _frameName(direction, frametype, opcode):
+   from srdp import SrdpFrameHeader
+   return "%s %s/%s" % (direction,
+                        SrdpFrameHeader.SRDP_FT_NAME.get(frametype, str(frametype)),
+                        SrdpFrameHeader.SRDP_OP_NAME.get(opcode, str(opcode)))
+
+
+class SrdpLatencyHistogram(object):
+   """
+   Request latency histogram with fixed buckets (milliseconds).
+   """
+
+   BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+   __slots__ = ('counts', 'count', 'total', 'min', 'max')
+
+   def __init__(self):
+      self.counts = [0] * (len(SrdpLatencyHistogram.BUCKETS) + 1)
+      self.count = 0
+      self.total = 0.
+      self.min = None
+      self.max = None
+
+
+   def record(self, seconds):
+      ms = seconds * 1000.
+      self.counts[bisect_left(SrdpLatencyHistogram.BUCKETS, ms)] += 1
+      self.count += 1
+      self.total += ms
+      if self.min is None or ms < self.min:
+         self.min = ms
+      if self.max is None or ms > self.max:
+         self.max = ms
+
+
+   def percentile(self, p):
+      """
+      Upper bucket bound (ms) below which the given fraction of samples fall.
+      """
+      if self.count == 0:
+         return None
+      need = p * self.count
+      seen = 0
+      for i in xrange(len(self.counts)):
+         seen += self.counts[i]
+         if seen >= need:
+            if i < len(SrdpLatencyHistogram.BUCKETS):
+               return SrdpLatencyHistogram.BUCKETS[i]
+            return self.max
+      return self.max
+
+
+   def snapshot(self):
+      buckets = {}
+      for i in xrange(len(self.counts)):
+         if self.counts[i]:
+            if i < len(SrdpLatencyHistogram.BUCKETS):
+               buckets["<=%d" % SrdpLatencyHistogram.BUCKETS[i]] = self.counts[i]
+            else:
+               buckets[">%d" % SrdpLatencyHistogram.BUCKETS[-1]] = self.counts[i]
+      if self.count:
+         mean = self.total / self.count
+      else:
+         mean = None
+      return {'count': self.count,
+              'mean': mean,
+              'min': self.min,
+              'max': self.max,
+              'p50': self.percentile(.5),
+              'p90': self.percentile(.9),
+              'p99': self.percentile(.99),
+              'buckets': buckets}
+
+
+
+class SrdpChannelMetrics(object):
+   """
+   Metrics registry of a SRDP channel. Updating is a couple of dict/int
+   operations per frame, names are only resolved when taking a snapshot.
+   """
+
+   RX = 'rx'
+   TX = 'tx'
+
+   def __init__(self):
+      self.reset()
+
+
+   def reset(self):
+      ## (direction, frametype, opcode) -> frames
+      self.frames = {}
+
+      ## (direction, frametype, opcode) -> octets
+      self.octets = {}
+
+      ## SRDP error code -> ERR frames received
+      self.errors = {}
+
+      self.crcErrors = 0
+      self.timeouts = 0
+      self.retransmits = 0
+      self.duplicates = 0
+      self.queueMax = 0
+
+      ## (device, register) -> SrdpLatencyHistogram
+      self.latency = {}
+
+
+   def frameReceived(self, frametype, opcode, octets):
+      key = (SrdpChannelMetrics.RX, frametype, opcode)
+      self.frames[key] = self.frames.get(key, 0) + 1
+      self.octets[key] = self.octets.get(key, 0) + octets
+
+
+   def frameSent(self, frametype, opcode, octets):
+      key = (SrdpChannelMetrics.TX, frametype, opcode)
+      self.frames[key] = self.frames.get(key, 0) + 1
+      self.octets[key] = self.octets.get(key, 0) + octets
+
+
+   def errorReceived(self, code):
+      self.errors[code] = self.errors.get(code, 0) + 1
+
+
+   def requestDone(self, device, register, seconds):
+      key = (device, register)
+      histogram = self.latency.get(key, None)
+      if histogram is None:
+         histogram = SrdpLatencyHistogram()
+         self.latency[key] = histogram
+      histogram.record(seconds)
+
+
+   def octetsTotal(self, direction):
+      return sum([n for (d, frametype, opcode), n in self.octets.items() if d == direction])
+
+
+   def snapshot(self):
+      """
+      Return all metrics as a dict of plain values (suitable for JSON).
+      """
+      from srdp import SrdpFrameHeader
+
+      frames = {}
+      octets = {}
+      for key, n in self.frames.items():
+         name = _frameName(*key)
+         frames[name] = n
+         octets[name] = self.octets.get(key, 0)
+
+      errors = {}
+      for code, n in self.errors.items():
+         errors["%d (%s)" % (code, SrdpFrameHeader.SRDP_ERR_DESC.get(code, 'unknown'))] = n
+
+      latency = {}
+      for (device, register), histogram in self.latency.items():
+         latency["%d/%d" % (device, register)] = histogram.snapshot()
+
+      return {'frames': frames,
+              'octets': octets,
+              'octetsTotal': {SrdpChannelMetrics.RX: self.octetsTotal(SrdpChannelMetrics.RX),
+                              SrdpChannelMetrics.TX: self.octetsTotal(SrdpChannelMetrics.TX)},
+              'errors': errors,
+              'crcErrors': self.crcErrors,
+              'timeouts': self.timeouts,
+              'retransmits': self.retransmits,
+              'duplicates': self.duplicates,
+              'queueMax': self.queueMax,
+              'latency': latency}
+
+
+   def summary(self):
+      """
+      Return the metrics as human readable text (one line per frame type
+      and opcode in each direction, counters, errors and latencies).
+      """
+      from srdp import SrdpFrameHeader
+
+      lines = []
+      for key in sorted(self.frames.keys()):
+         lines.append("%-16s %10d frames %12d octets" % (_frameName(*key), self.frames[key], self.octets.get(key, 0)))
+      for direction in [SrdpChannelMetrics.RX, SrdpChannelMetrics.TX]:
+         frames = sum([n for (d, frametype, opcode), n in self.frames.items() if d == direction])
+         lines.append("%-16s %10d frames %12d octets" % ("%s total" % direction, frames, self.octetsTotal(direction)))
+
+      lines.append("crc errors = %d, timeouts = %d, retransmits = %d, duplicates = %d, max queued = %d" % \
+                   (self.crcErrors, self.timeouts, self.retransmits, self.duplicates, self.queueMax))
+
+      for code in sorted(self.errors.keys()):
+         lines.append("error %d (%s): %d" % (code, SrdpFrameHeader.SRDP_ERR_DESC.get(code, 'unknown'), self.errors[code]))
+
+      for device, register in sorted(self.latency.keys()):
+         histogram = self.latency[(device, register)]
+         lines.append("latency %d/%d: %d requests, mean = %.1f ms, p50 <= %s ms, p99 <= %s ms" % \
+                      (device, register, histogram.count, histogram.total / histogram.count,
+                       histogram.percentile(.5), histogram.percentile(.99)))
+
+      return '\n'.join(lines)
@@ -0,0 +1,106 @@
+###############################################################################
+##
+##  Copyright 2013 Tavendo GmbH
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##      http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+__all__ = ("SrdpPendingTable",)
+
+
+class SrdpPendingTable(object):
+   """
+   Sequence number allocator and table of requests in flight.
+
+   Sequence numbers run 1 .. 65535 and wrap around to 1 (0 is never used,
+   so a zeroed frame header never matches a request). Entries are stored in
+   a fixed-size array indexed by the low bits of the sequence number, and
+   allocation skips every sequence number whose slot is still taken. This
+   gives O(1) allocation and lookup, and memory proportional to the
+   table size rather than to the number of requests ever sent.
+
+   Entries must have a "seq" attribute, which is set on allocation.
+   """
+
+   SEQ_MAX = 0xffff
+
+   def __init__(self, size = 256):
+      if size < 2 or size > SrdpPendingTable.SEQ_MAX + 1 or size & (size - 1):
+         raise Exception("pending table size must be a power of 2 in [2, 65536]")
+      self._slots = [None] * size
+      self._mask = size - 1
+      self._next = 1
+      self._count = 0
+
+
+   def allocate(self, entry):
+      """
+      Allocate the next free sequence number for entry and store the entry.
+      Returns the sequence number.
+      """
+      if self.isFull():
+         raise Exception("too many SRDP requests in flight (pending table full)")
+
+      slots = self._slots
+      mask = self._mask
+      seq = self._next
+      while slots[seq & mask] is not None:
+         seq = seq % SrdpPendingTable.SEQ_MAX + 1
+
+      entry.seq = seq
+      slots[seq & mask] = entry
+      self._count += 1
+      self._next = seq % SrdpPendingTable.SEQ_MAX + 1
+      return seq
+
+
+   def isFull(self):
+      return self._count >= len(self._slots) - 1
+
+
+   def get(self, seq):
+      """
+      Get the entry for sequence number or None.
+      """
+      entry = self._slots[seq & self._mask]
+      if entry is not None and entry.seq == seq:
+         return entry
+      return None
+
+
+   def pop(self, seq):
+      """
+      Remove and return the entry for sequence number or None.
+      """
+      i = seq & self._mask
+      entry = self._slots[i]
+      if entry is not None and entry.seq == seq:
+         self._slots[i] = None
+         self._count -= 1
+         return entry
+      return None
+
+
+   def clear(self):
+      """
+      Remove and return all entries.
+      """
+      entries = [e for e in self._slots if e is not None]
+      self._slots = [None] * len(self._slots)
+      self._count = 0
+      return entries
+
+
+   def __len__(self):
+      return self._count
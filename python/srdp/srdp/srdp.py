@@ -17,10 +17,17 @@
 ###############################################################################
 
 __all__ = ("SrdpException",
+           "SrdpTimeoutException",
            "SrdpFrameHeader",
+           "packFrameHeader",
+           "unpackFrameHeader",
+           "encodeFrame",
+           "readRegisters",
            "SrdpProtocol",
            "SrdpStreamProtocol",
-           "SrdpDatagramProtocol",)
+           "SrdpDatagramProtocol",
+           "SrdpDatagramSession",
+           "SrdpDatagramServerProtocol",)
 
 import zope
 from zope.interface import implementer
@@ -28,21 +35,32 @@ from zope.interface import implementer
 import struct, binascii
 from collections import deque
 
-## https://pypi.python.org/pypi/crcmod
-import crcmod
-
 from twisted.python import log
 from twisted.internet.protocol import Protocol, DatagramProtocol
-from twisted.internet.defer import Deferred 
+from twisted.internet.defer import Deferred, maybeDeferred
+from twisted.internet.task import LoopingCall
 from twisted.python.failure import Failure
 
 from interfaces import ISrdpProvider, ISrdpChannel
+from crc16 import crc16
+from flowcontrol import SrdpSendWindow, SrdpRttEstimator, SrdpDuplicateFilter, SrdpTokenBucket
+from pending import SrdpPendingTable
+from metrics import SrdpChannelMetrics
+from subscription import SrdpSubscriptionRegistry
 
 
 class SrdpException(Exception):
+   """
+   SRDP error, created either from the payload of an ERR frame or from an
+   error code (SRDP_ERR_*), eg when raised by a provider to answer a
+   register request with an ERR frame.
+   """
 
    def __init__(self, data):
-      error_code = struct.unpack("<l", data)[0]
+      if type(data) in (int, long):
+         error_code = data
+      else:
+         error_code = struct.unpack("<l", data)[0]
       if SrdpFrameHeader.SRDP_ERR_DESC.has_key(error_code):
          error_text = SrdpFrameHeader.SRDP_ERR_DESC[error_code]
       else:
@@ -51,7 +69,119 @@ class SrdpException(Exception):
 
 
 
-class SrdpFrameHeader:
+class SrdpTimeoutException(Exception):
+
+   def __init__(self, retries):
+      Exception.__init__(self, None, "timeout (no response after %d retransmissions)" % retries)
+
+
+
+## precompiled codec for the fixed 12 octets SRDP frame header:
+##
+##   | FT (2) | OP (2) | DEV (12) | SEQ | REG | POS | LEN | CRC16 |
+##
+_FRAME_HEADER = struct.Struct("<HHHHHH")
+
+## CRC-16 codec (for patching the CRC field at header offset 10)
+##
+_FRAME_CRC = struct.Struct("<H")
+_FRAME_CRC_OFFSET = 10
+_ZERO_CRC = '\x00\x00'
+
+
+def packFrameHeader(buf,
+                    offset,
+                    frametype,
+                    opcode,
+                    device,
+                    seq,
+                    register,
+                    position,
+                    length,
+                    crc16 = 0):
+   """
+   Pack a SRDP frame header into the caller supplied (writable) buffer
+   at the given offset.
+   """
+   _FRAME_HEADER.pack_into(buf,
+                           offset,
+                           ((frametype & 0x03) << 14) | ((opcode & 0x03) << 12) | (device & 0x0fff),
+                           seq,
+                           register,
+                           position,
+                           length,
+                           crc16)
+
+
+def unpackFrameHeader(data, offset = 0):
+   """
+   Unpack a SRDP frame header from data at the given offset without
+   constructing a header object.
+
+   Returns a tuple (frametype, opcode, device, seq, register, position, length, crc16).
+   """
+   opdev, seq, register, position, length, crc = _FRAME_HEADER.unpack_from(data, offset)
+   return (opdev >> 14) & 0x03, (opdev >> 12) & 0x03, opdev & 0x0fff, seq, register, position, length, crc
+
+
+def encodeFrame(frametype,
+                opcode,
+                device,
+                seq,
+                register,
+                position,
+                length,
+                data = None):
+   """
+   Encode a complete SRDP frame (header with CRC followed by data) in one
+   buffer, without going through a header object.
+
+   Returns a tuple (wireData, crc16).
+   """
+   n = _FRAME_HEADER.size
+   if data:
+      buf = bytearray(n + len(data))
+      buf[n:] = data
+   else:
+      buf = bytearray(n)
+   packFrameHeader(buf, 0, frametype, opcode, device, seq, register, position, length, 0)
+   crc = crc16(buf)
+   _FRAME_CRC.pack_into(buf, _FRAME_CRC_OFFSET, crc)
+   return str(buf), crc
+
+
+def _unpackReceivedHeader(data, offset = 0):
+   """
+   Unpack the header of a received frame for dispatch, without constructing
+   a header object.
+
+   Returns a tuple (fields, dataLength, headerCrc): the header fields as
+   returned by unpackFrameHeader(), the number of data octets following the
+   header, and the CRC over the header octets with the CRC field set to 0
+   (to be continued over the frame data).
+   """
+   fields = unpackFrameHeader(data, offset)
+   if (fields[0], fields[1]) in SrdpFrameHeader._NO_DATA_FRAMES:
+      dataLength = 0
+   else:
+      dataLength = fields[6]
+   headerCrc = crc16(_ZERO_CRC, crc16(data[offset:offset + _FRAME_CRC_OFFSET]))
+   return fields, dataLength, headerCrc
+
+
+def _frameHeader(fields, senderAddr = None):
+   """
+   Construct a header object from the fields of a received frame header,
+   for the (rare) paths that need one, eg logging.
+   """
+   frametype, opcode, device, seq, register, position, length, crc = fields
+   header = SrdpFrameHeader(seq, frametype, opcode, device, register, position, length, crc)
+   header.senderAddr = senderAddr
+   return header
+
+
+
+class SrdpFrameHeader(object):
 
    SRDP_FT_REQ = 0x01
    SRDP_FT_ACK = 0x02
@@ -85,6 +215,22 @@ class SrdpFrameHeader:
 
    SRDP_FRAME_HEADER_LEN = 12
 
+   _NO_DATA_FRAMES = frozenset([(SRDP_FT_REQ, SRDP_OP_SYNC),
+                                (SRDP_FT_REQ, SRDP_OP_READ),
+                                (SRDP_FT_ACK, SRDP_OP_WRITE)])
+
+   __slots__ = ('seq',
+                'frametype',
+                'opcode',
+                'device',
+                'register',
+                'position',
+                'length',
+                'crc16',
+                'dataLength',
+                'senderAddr',
+                '_headerCrc')
+
 
    def __init__(self,
                 seq = 0,
@@ -106,6 +252,7 @@ class SrdpFrameHeader:
 
       self.dataLength = 0
       self.senderAddr = None
+      self._headerCrc = None
 
 
    def reset(self):
@@ -117,6 +264,7 @@ class SrdpFrameHeader:
       self.position = 0
       self.length = 0
       self.crc16 = 0
+      self._headerCrc = None
 
 
    def __str__(self):
@@ -124,51 +272,203 @@ class SrdpFrameHeader:
 
 
    def computeCrc(self, data = None):
+      """
+      Compute the frame CRC over the header (with CRC field set to 0)
+      and the frame data.
+      """
+      buf = bytearray(_FRAME_HEADER.size)
+      self.packInto(buf, 0, 0)
+      crc = crc16(buf)
+      if data:
+         crc = crc16(data, crc)
+      return crc
+
+
+   def checkCrc(self, data = None):
+      """
+      Check the received CRC against the CRC computed over the frame.
+      When the header was parsed from wire data, the CRC over the raw
+      header octets was already computed in parse() and is reused here.
+      """
+      crc = self._headerCrc
+      if crc is None:
+         crc = self.computeCrc(data)
+      elif data:
+         crc = crc16(data, crc)
+      return crc == self.crc16
+
+
+   def encode(self, data = None):
+      """
+      Compute and set the frame CRC and return the complete wire frame
+      (header followed by data).
+      """
+      wireData, self.crc16 = encodeFrame(self.frametype,
+                                         self.opcode,
+                                         self.device,
+                                         self.seq,
+                                         self.register,
+                                         self.position,
+                                         self.length,
+                                         data)
+      return wireData
 
-      crc = crcmod.predefined.PredefinedCrc("xmodem")
 
-      header = struct.pack("<HHHHHH",
-                           ((self.frametype & 0x03) << 14) | ((self.opcode & 0x03) << 12) | (self.device & 0x0fff),
-                           self.seq,
-                           self.register,
-                           self.position,
-                           self.length,
-                           0)
-      crc.update(header)
+   def serialize(self):
+      return _FRAME_HEADER.pack(((self.frametype & 0x03) << 14) | ((self.opcode & 0x03) << 12) | (self.device & 0x0fff),
+                                self.seq,
+                                self.register,
+                                self.position,
+                                self.length,
+                                self.crc16)
+
+
+   def packInto(self, buf, offset = 0, crc16 = None):
+      """
+      Pack the header into the caller supplied buffer at the given offset.
+      The CRC field is set from crc16 if given, else from the header.
+      """
+      if crc16 is None:
+         crc16 = self.crc16
+      packFrameHeader(buf,
+                      offset,
+                      self.frametype,
+                      self.opcode,
+                      self.device,
+                      self.seq,
+                      self.register,
+                      self.position,
+                      self.length,
+                      crc16)
+
+
+   def parse(self, data, offset = 0):
+      self.frametype, \
+      self.opcode, \
+      self.device, \
+      self.seq, \
+      self.register, \
+      self.position, \
+      self.length, \
+      self.crc16 = unpackFrameHeader(data, offset)
+
+      ## verify-on-parse: run the CRC over the raw header octets with
+      ## the CRC field set to 0, the frame data is added in checkCrc()
+      ##
+      self._headerCrc = crc16(_ZERO_CRC, crc16(data[offset:offset + _FRAME_CRC_OFFSET]))
 
-      if data:
-         crc.update(data)
+      ## frames which carry no data even though the length field is set
+      ##
+      if (self.frametype, self.opcode) in SrdpFrameHeader._NO_DATA_FRAMES:
+         self.dataLength = 0
+      else:
+         self.dataLength = self.length
 
-      return crc.crcValue
 
 
-   def serialize(self):
-      return struct.pack("<HHHHHH",
-                         ((self.frametype & 0x03) << 14) | ((self.opcode & 0x03) << 12) | (self.device & 0x0fff),
-                         self.seq,
-                         self.register,
-                         self.position,
-                         self.length,
-                         self.crc16)
-   
-
-   def parse(self, data):
-      t = struct.unpack("<HHHHHH", data[0:SrdpFrameHeader.SRDP_FRAME_HEADER_LEN])
-      self.frametype = (t[0] >> 14) & 0x03
-      self.opcode = (t[0] >> 12) & 0x03
-      self.device = t[0] & 0xfff
-      self.seq = t[1]
-      self.register = t[2]
-      self.position = t[3]
-      self.length = t[4]
-      self.crc16 = t[5]
+def readRegisters(read, registers, concurrency = None):
+   """
+   Read a set of registers with up to concurrency reads outstanding
+   (all at once when None), using read(register) -> Deferred.
+
+   Returns a Deferred that fires with a dict register -> data, or the
+   exception (eg SrdpException) for registers that could not be read.
+   """
+   registers = list(registers)
+   results = {}
+   done = Deferred()
+   if concurrency is None or concurrency < 1:
+      concurrency = len(registers)
+   state = {'next': 0, 'outstanding': 0, 'issuing': False}
+
+   def issue():
+      ## reads completing synchronously (eg cache hits) fire while issuing:
+      ## they only update the counters and the loop below picks up, so the
+      ## stack does not grow with the number of registers
+      ##
+      if state['issuing']:
+         return
+      state['issuing'] = True
+      while state['outstanding'] < concurrency and state['next'] < len(registers):
+         register = registers[state['next']]
+         state['next'] += 1
+         state['outstanding'] += 1
+         try:
+            d = read(register)
+         except Exception, e:
+            d = Deferred()
+            d.errback(Failure(e))
+         d.addCallbacks(readDone, readFailed, callbackArgs = (register,), errbackArgs = (register,))
+      state['issuing'] = False
+      if state['outstanding'] == 0 and state['next'] == len(registers) and not done.called:
+         done.callback(results)
+
+   def readDone(data, register):
+      results[register] = data
+      state['outstanding'] -= 1
+      issue()
+
+   def readFailed(failure, register):
+      results[register] = failure.value
+      state['outstanding'] -= 1
+      issue()
+
+   issue()
+   return done
+
+
+
+class _SrdpRequest(object):
+   """
+   A host request waiting in the send queue or in flight.
+   """
+
+   __slots__ = ('opcode',
+                'device',
+                'register',
+                'position',
+                'length',
+                'data',
+                'deferred',
+                'seq',
+                'ticket',
+                'wireData',
+                'retries',
+                'retransmits',
+                'rto',
+                'sentAt',
+                'timer')
+
+   def __init__(self, opcode, device, register, position, length, data, retries):
+      self.opcode = opcode
+      self.device = device
+      self.register = register
+      self.position = position
+      self.length = length
+      self.data = data
+      self.deferred = Deferred()
+      self.seq = None
+      self.ticket = None
+      self.wireData = None
+      self.retries = retries
+      self.retransmits = 0
+      self.rto = None
+      self.sentAt = None
+      self.timer = None
 
 
 
 @implementer(ISrdpChannel)
 class SrdpProtocol(object):
 
-   def __init__(self, provider, debug = False):
+   def __init__(self,
+                provider,
+                debug = False,
+                window = None,
+                queueLimit = 64,
+                retries = None,
+                rtt = None,
+                reactor = None):
       if not ISrdpProvider.providedBy(provider):
          raise Exception("provider must implement ISrdpProvider")
 
@@ -176,8 +476,54 @@ class SrdpProtocol(object):
       self._provider.channel = self
       self._debug = debug
       self._isConnected = None
-      self._seq = 0
-      self._pending = {}
+
+      ## sequence numbers and requests in flight
+      ##
+      self._pending = SrdpPendingTable()
+
+      ## requests are put in flight only while the send window has room,
+      ## the rest waits in the send queue
+      ##
+      if window is None:
+         window = SrdpSendWindow()
+      self._window = window
+      self._sendQueue = deque()
+      self._queueLimit = queueLimit
+      self._sendableWaiters = []
+
+      ## request timeouts: when retries is None, requests wait for their
+      ## response forever. otherwise a request is retransmitted after the
+      ## retransmission timeout (RTO) computed from measured round-trip times,
+      ## up to the given number of times, before it fails
+      ##
+      self._retries = retries
+      if rtt is None:
+         rtt = SrdpRttEstimator()
+      self._rtt = rtt
+      self._duplicates = SrdpDuplicateFilter()
+
+      ## frame/octet counters, error counters and request latencies
+      ##
+      self.metrics = SrdpChannelMetrics()
+
+      ## handlers for register change notifications
+      ##
+      self.subscriptions = SrdpSubscriptionRegistry()
+
+      ## register requests received from the peer which are still being
+      ## processed by the provider ((sender address, seq) -> response frame
+      ## header). the sender address tells apart the peers of an unconnected
+      ## datagram channel, it is None on other channels
+      ##
+      self._serving = {}
+
+      ## sequence number for outgoing register change notifications
+      ##
+      self._seqOut = 0
+
+      if reactor is None:
+         from twisted.internet import reactor
+      self._reactor = reactor
 
 
    def _logFrame(self, msg, header, data):
@@ -190,84 +536,379 @@ class SrdpProtocol(object):
       log.msg("%s [%s, data = '%s']" % (msg, header, d))
 
 
-   def _frameReceived(self, frameHeader, frameData):
+   def _frameReceived(self, fields, dataLength, headerCrc, frameData, senderAddr = None):
+      """
+      Process a received frame given by its header fields (see
+      _unpackReceivedHeader) and data. No header object is constructed on
+      the way, unless needed to log the frame or to answer a request.
+      """
       if self._debug:
-         self._logFrame("SRDP frame received", frameHeader, frameData)
+         self._logFrame("SRDP frame received", _frameHeader(fields, senderAddr), frameData)
 
       ## check frame CRC
       ##
-      crc16 = frameHeader.computeCrc(frameData)
-      if crc16 != frameHeader.crc16:
-         print "CRC Error: computed = %s, received = %s" % (binascii.hexlify(struct.pack("<H", crc16)), binascii.hexlify(struct.pack("<H", self._srdpFrameHeader.crc16)))
+      crc = headerCrc
+      if frameData:
+         crc = crc16(frameData, crc)
+      if crc != fields[7]:
+         log.msg("SRDP frame CRC error: received = 0x%04x [%s]" % (fields[7], _frameHeader(fields, senderAddr)))
          # FIXME: send ERR
-      
-      self._processFrame(frameHeader, frameData)
+         self.metrics.crcErrors += 1
+         self._window.onLoss()
+         return
 
+      ## the stream reassembly hands us a view into its receive buffer,
+      ## which must not outlive this call
+      ##
+      if type(frameData) is memoryview:
+         frameData = frameData.tobytes()
+
+      self.metrics.frameReceived(fields[0],
+                                 fields[1],
+                                 SrdpFrameHeader.SRDP_FRAME_HEADER_LEN + dataLength)
+
+      self._processFrame(fields, frameData, senderAddr)
+
+
+   def _sendRequest(self, opcode, device, register, position, length, data = None, retries = None):
+      """
+      Queue a request frame for sending, returning the Deferred that fires
+      with the response.
+      """
+      if retries is None:
+         retries = self._retries
+      request = _SrdpRequest(opcode, device, register, position, length, data, retries)
+      self._sendQueue.append(request)
+      if len(self._sendQueue) > self.metrics.queueMax:
+         self.metrics.queueMax = len(self._sendQueue)
+      self._sendQueued()
+      return request.deferred
+
+
+   def _sendQueued(self):
+      """
+      Put queued requests in flight as long as the send window allows.
+      """
+      while self._sendQueue and self._window.canSend() and not self._pending.isFull() and self._isConnected:
+         self._transmit(self._sendQueue.popleft())
+
+      if self._sendableWaiters and len(self._sendQueue) < self._queueLimit:
+         waiters, self._sendableWaiters = self._sendableWaiters, []
+         for d in waiters:
+            d.callback(None)
+
+
+   def _transmit(self, request):
+      """
+      Encode and send a request frame. The frame is encoded directly into its
+      wire representation without constructing a header object.
+      """
+      self._pending.allocate(request)
+      request.ticket = self._window.acquire()
+
+      request.wireData, _ = encodeFrame(SrdpFrameHeader.SRDP_FT_REQ,
+                                        request.opcode,
+                                        request.device,
+                                        request.seq,
+                                        request.register,
+                                        request.position,
+                                        request.length,
+                                        request.data)
+      self._write(request.wireData)
+      self.metrics.frameSent(SrdpFrameHeader.SRDP_FT_REQ, request.opcode, len(request.wireData))
+
+      request.sentAt = self._reactor.seconds()
+      if request.retries is not None:
+         request.rto = self._rtt.rto
+         request.timer = self._reactor.callLater(request.rto, self._requestTimeout, request)
 
-   def readRegister(self, device, register, position = 0, length = 0):
+      if self._debug:
+         header = SrdpFrameHeader()
+         header.parse(request.wireData)
+         self._logFrame("SRDP frame sent", header, request.data)
+
+
+   def _requestTimeout(self, request):
+      """
+      No response within the RTO: retransmit the request (with the same
+      sequence number) or fail it when the retry budget is exhausted.
+      """
+      request.timer = None
+
+      ## the RTO of the channel backs off once per loss event (timeouts of
+      ## requests sent before the window was decreased belong to the same
+      ## event), while each request doubles its own timeout on every
+      ## retransmission
+      ##
+      if self._window.onTimeout(request.ticket):
+         self._rtt.backoff()
+
+      if request.retransmits < request.retries:
+         request.retransmits += 1
+         request.rto = min(max(request.rto * 2., self._rtt.rto), self._rtt.maximum)
+         self._write(request.wireData)
+         self.metrics.frameSent(SrdpFrameHeader.SRDP_FT_REQ, request.opcode, len(request.wireData))
+         self.metrics.retransmits += 1
+         request.timer = self._reactor.callLater(request.rto, self._requestTimeout, request)
+         if self._debug:
+            log.msg("SRDP request retransmitted [seq = %d, retransmits = %d, %s]" % (request.seq, request.retransmits, self._rtt))
+      else:
+         self._pending.pop(request.seq)
+         self._duplicates.add(request.seq)
+         self._window.release(request.ticket, congested = True)
+         self.metrics.timeouts += 1
+         request.deferred.errback(Failure(SrdpTimeoutException(request.retransmits)))
+         self._sendQueued()
+
+
+   def _requestDone(self, request):
+      """
+      Response for request received: stop its timer, record the request
+      latency and, for requests that were never retransmitted, feed the RTT
+      estimator.
+      """
+      self._duplicates.add(request.seq)
+      latency = self._reactor.seconds() - request.sentAt
+      self.metrics.requestDone(request.device, request.register, latency)
+      if request.timer is not None:
+         request.timer.cancel()
+         request.timer = None
+         if request.retransmits == 0:
+            self._rtt.sample(latency)
+
+
+   def _failRequests(self, reason):
+      """
+      Fail all queued and in flight requests (eg when the channel was closed).
+      """
+      inflight = self._pending.clear()
+      for request in inflight:
+         self._window.abandon(request.ticket)
+      requests = list(self._sendQueue) + inflight
+      self._sendQueue.clear()
+      for request in requests:
+         if request.timer is not None:
+            request.timer.cancel()
+            request.timer = None
+         request.deferred.errback(Failure(Exception("SRDP channel closed (%s)" % reason)))
+
+
+   def whenSendable(self):
+      """
+      Backpressure for bulk producers: returns a Deferred that fires when
+      fewer than queueLimit requests are waiting behind the send window.
+      """
+      d = Deferred()
+      if len(self._sendQueue) < self._queueLimit:
+         d.callback(None)
+      else:
+         self._sendableWaiters.append(d)
+      return d
+
+
+   def getMetrics(self):
+      """
+      Snapshot of the channel metrics, including the current state of the
+      send window and RTT estimator, as a dict of plain values.
+      """
+      m = self.metrics.snapshot()
+      m['window'] = {'size': self._window.size,
+                     'inflight': self._window.inflight,
+                     'inflightMax': self._window.inflightMax}
+      m['queued'] = len(self._sendQueue)
+      m['rtt'] = {'srtt': self._rtt.srtt,
+                  'rttvar': self._rtt.rttvar,
+                  'rto': self._rtt.rto}
+      return m
+
+
+   def readRegister(self, device, register, position = 0, length = 0, retries = None):
       if not self._isConnected:
          raise Exception("cannot send register read request when not connected")
 
-      self._seq += 1
-      frame = SrdpFrameHeader(seq = self._seq,
-                              frametype = SrdpFrameHeader.SRDP_FT_REQ,
-                              opcode = SrdpFrameHeader.SRDP_OP_READ,
-                              device = device,
-                              register = register,
-                              position = position,
-                              length = length)
-      self._sendFrame(frame)
-      d = Deferred()
-      self._pending[self._seq] = d
-      return d
+      return self._sendRequest(SrdpFrameHeader.SRDP_OP_READ, device, register, position, length, retries = retries)
 
 
-   def writeRegister(self, device, register, data, position = 0):
+   def readRegisters(self, device, registers, concurrency = None, retries = None):
+      """
+      Read a set of registers of a device concurrently (see readRegisters).
+      Returns a Deferred that fires with a dict register -> data or
+      exception.
+      """
+      return readRegisters(lambda register: self.readRegister(device, register, retries = retries), registers, concurrency)
+
+
+   def writeRegister(self, device, register, data, position = 0, retries = None):
       if not self._isConnected:
          raise Exception("cannot send register write request when not connected")
 
-      self._seq += 1
-      frame = SrdpFrameHeader(self._seq,
-                              frametype = SrdpFrameHeader.SRDP_FT_REQ,
-                              opcode = SrdpFrameHeader.SRDP_OP_WRITE,
-                              device = device,
-                              register = register,
-                              position = position,
-                              length = len(data))
-      self._sendFrame(frame, data)
-      d = Deferred()
-      self._pending[self._seq] = d
-      return d
+      return self._sendRequest(SrdpFrameHeader.SRDP_OP_WRITE, device, register, position, len(data), data, retries = retries)
 
 
-   def notifyRegister(self, device, register, position, length):
+   def subscribe(self, handler, device = None, register = None):
+      """
+      Subscribe handler to register change notifications received on this
+      channel (see SrdpSubscriptionRegistry).
+      """
+      return self.subscriptions.subscribe(handler, device, register)
+
 
+   def notifyRegister(self, device, register, position, length):
+      """
+      Notify the peer of a register change: the register is read from the
+      provider (onRegisterRead) and sent in a CHANGE request. Returns a
+      Deferred that fires with the number of octets sent.
+      """
       if not self._isConnected:
          raise Exception("cannot send register change notification when not connected")
 
-      pass # FIXME: process and potential send ACK
+      d = maybeDeferred(self._provider.onRegisterRead, device, register, position, length)
+
+      def send(data):
+         if data is None:
+            raise SrdpException(SrdpFrameHeader.SRDP_ERR_NOT_IMPLEMENTED)
+         if not self._isConnected:
+            raise Exception("cannot send register change notification when not connected")
+         self._seqOut = self._seqOut % 0xffff + 1
+         header = SrdpFrameHeader(seq = self._seqOut,
+                                  frametype = SrdpFrameHeader.SRDP_FT_REQ,
+                                  opcode = SrdpFrameHeader.SRDP_OP_CHANGE,
+                                  device = device,
+                                  register = register,
+                                  position = position,
+                                  length = len(data))
+         self._sendFrame(header, data)
+         return len(data)
+
+      d.addCallback(send)
+      return d
 
 
-   def _processFrame(self, header, data):
-      if header.frametype == SrdpFrameHeader.SRDP_FT_REQ:
+   def _serveRequest(self, fields, data, senderAddr):
+      """
+      Dispatch a register read or write request received from the peer to
+      the provider. The provider may answer right away or return a Deferred,
+      so any number of requests can be processed concurrently; each response
+      echoes the sequence number of its request and is sent when ready.
+      """
+      _, opcode, device, seq, register, position, length, _ = fields
+      key = (senderAddr, seq)
+      if self._serving.has_key(key):
+         ## retransmission of a request still being processed
+         ##
+         if self._debug:
+            log.msg("SRDP duplicate request dropped [seq = %d]" % seq)
+         return
+
+      response = SrdpFrameHeader(seq = seq,
+                                 opcode = opcode,
+                                 device = device,
+                                 register = register,
+                                 position = position)
+      response.senderAddr = senderAddr
+      self._serving[key] = response
+
+      if opcode == SrdpFrameHeader.SRDP_OP_READ:
+         handler = getattr(self._provider, 'onRegisterRead', None)
+         args = (device, register, position, length)
+      else:
+         handler = getattr(self._provider, 'onRegisterWrite', None)
+         args = (device, register, position, data)
 
-         if header.opcode == SrdpFrameHeader.SRDP_OP_CHANGE:
-            res = self._provider.onRegisterChange(header.device, header.register, header.position, data)
+      if handler is None:
+         d = Deferred()
+         d.errback(SrdpException(SrdpFrameHeader.SRDP_ERR_NOT_IMPLEMENTED))
+      else:
+         d = maybeDeferred(handler, *args)
+      d.addCallbacks(self._serveDone, self._serveFailed, callbackArgs = (response, data), errbackArgs = (response,))
 
-         elif header.opcode == SrdpFrameHeader.SRDP_OP_READ:
-            pass
 
-         elif header.opcode == SrdpFrameHeader.SRDP_OP_WRITE:
-            pass
+   def _serveDone(self, res, response, data):
+      if response.opcode == SrdpFrameHeader.SRDP_OP_READ:
+         ## onRegisterRead returns the register data
+         ##
+         if res is None:
+            return self._serveFailed(Failure(SrdpException(SrdpFrameHeader.SRDP_ERR_NOT_IMPLEMENTED)), response)
+         res = str(res)
+         response.length = len(res)
+      else:
+         ## onRegisterWrite returns the number of octets written, or None
+         ## when all were written
+         ##
+         if res is None:
+            res = len(data)
+         response.length = res
+         res = None
 
+      response.frametype = SrdpFrameHeader.SRDP_FT_ACK
+      self._serveRespond(response, res)
 
-      elif header.frametype in [SrdpFrameHeader.SRDP_FT_ACK, SrdpFrameHeader.SRDP_FT_ERR]:
-         if self._pending.has_key(header.seq):
-            if header.frametype == SrdpFrameHeader.SRDP_FT_ACK:
-               self._pending[header.seq].callback(data)
+
+   def _serveFailed(self, failure, response):
+      if failure.check(SrdpException):
+         code = failure.value.args[0]
+      else:
+         log.err(failure, "SRDP provider failed to process register request")
+         code = SrdpFrameHeader.SRDP_ERR_NOT_IMPLEMENTED
+
+      response.frametype = SrdpFrameHeader.SRDP_FT_ERR
+      response.position = 0
+      response.length = 4
+      self._serveRespond(response, struct.pack("<l", code))
+
+
+   def _serveRespond(self, response, data):
+      del self._serving[(response.senderAddr, response.seq)]
+      ## a channel that is not connected (an unconnected datagram channel
+      ## serving requests) replies to the sender of the request
+      ##
+      if self._isConnected or response.senderAddr is not None:
+         self._sendFrame(response, data)
+
+
+   def _processFrame(self, fields, data, senderAddr):
+      frametype, opcode, device, seq, register, position = fields[:6]
+
+      if frametype == SrdpFrameHeader.SRDP_FT_REQ:
+
+         if opcode == SrdpFrameHeader.SRDP_OP_CHANGE:
+            self.subscriptions.dispatch(device, register, position, data)
+            res = self._provider.onRegisterChange(device, register, position, data)
+
+         elif opcode in (SrdpFrameHeader.SRDP_OP_READ, SrdpFrameHeader.SRDP_OP_WRITE):
+            self._serveRequest(fields, data, senderAddr)
+
+
+      elif opcode == SrdpFrameHeader.SRDP_OP_CHANGE:
+         ## peer acknowledged (or rejected) a register change notification
+         ##
+         if frametype == SrdpFrameHeader.SRDP_FT_ERR:
+            self.metrics.errorReceived(SrdpException(data).args[0])
+
+
+      elif frametype in [SrdpFrameHeader.SRDP_FT_ACK, SrdpFrameHeader.SRDP_FT_ERR]:
+         request = self._pending.pop(seq)
+         if request is not None:
+            self._requestDone(request)
+            if frametype == SrdpFrameHeader.SRDP_FT_ACK:
+               self._window.release(request.ticket)
+               request.deferred.callback(data)
             else:
-               self._pending[header.seq].errback(Failure(SrdpException(data)))
-            del self._pending[header.seq]
+               ## errors defined by SRDP (no such register etc) are regular
+               ## responses, other error codes count as congestion
+               ##
+               e = SrdpException(data)
+               self.metrics.errorReceived(e.args[0])
+               congested = not SrdpFrameHeader.SRDP_ERR_DESC.has_key(e.args[0])
+               self._window.release(request.ticket, congested)
+               request.deferred.errback(Failure(e))
+            self._sendQueued()
+         elif self._duplicates.isDuplicate(seq):
+            ## late response to a request we retransmitted
+            ##
+            self.metrics.duplicates += 1
+            if self._debug:
+               log.msg("SRDP duplicate response dropped [seq = %d]" % seq)
          else:
             log.msg("NO SUCH SEQ!")
 
@@ -278,8 +919,8 @@ class SrdpProtocol(object):
 
 class SrdpDatagramProtocol(DatagramProtocol, SrdpProtocol):
 
-   def __init__(self, provider, addr = None, debug = False):
-      SrdpProtocol.__init__(self, provider, debug = debug)
+   def __init__(self, provider, addr = None, debug = False, window = None, retries = 3, reactor = None):
+      SrdpProtocol.__init__(self, provider, debug = debug, window = window, retries = retries, reactor = reactor)
       self._addr = addr
 
 
@@ -296,79 +937,264 @@ class SrdpDatagramProtocol(DatagramProtocol, SrdpProtocol):
       self._provider.onChannelOpen(self)
 
    def stopProtocol(self):
+      self._failRequests("datagram protocol stopped")
       self._provider.onChannelClose(None)
 
 
-   def _sendFrame(self, header, data = None):
-      header.crc16 = header.computeCrc(data)
-
-      if data:
-         wireData = header.serialize() + data
-      else:
-         wireData = header.serialize()
-
+   def _write(self, wireData, addr = None):
       if self._addr:
          ## if this UDP socket is connected, our peer is fixed
          ## and we don't provide a receiver address
          ##
          self.transport.write(wireData)
-      elif header.senderAddr:
-         ## if 
-         self.transport.write(wireData, header.senderAddr)
+      elif addr:
+         ## otherwise we reply to the sender of the frame
+         ##
+         self.transport.write(wireData, addr)
       else:
          raise Exception("logic error")
 
+
+   def _sendFrame(self, header, data = None):
+      wireData = header.encode(data)
+      self._write(wireData, header.senderAddr)
+      self.metrics.frameSent(header.frametype, header.opcode, len(wireData))
+
       if self._debug:
          self._logFrame("SRDP frame sent", header, data)
 
 
    def datagramReceived(self, datagram, addr):   
       if self._debug:
-         log.msg("Octets received [data = %s]" % binascii.hexlify(data))
+         log.msg("Octets received [data = %s]" % binascii.hexlify(datagram))
 
-      if len(datagram) < SrdpFrameHeader.SRDP_FRAME_HEADER_LEN:
-         raise Exception("invalid SRDP datagram (shorter than header)")
+      fields, dataLength, headerCrc, data = _parseDatagram(datagram)
+      self._frameReceived(fields, dataLength, headerCrc, data, addr)
 
-      header = SrdpFrameHeader()
-      header.parse(datagram[0:SrdpFrameHeader.SRDP_FRAME_HEADER_LEN])
 
-      if (header.frametype, header.opcode) \
-         in [(SrdpFrameHeader.SRDP_FT_REQ, SrdpFrameHeader.SRDP_OP_SYNC),
-             (SrdpFrameHeader.SRDP_FT_REQ, SrdpFrameHeader.SRDP_OP_READ),
-             (SrdpFrameHeader.SRDP_FT_ACK, SrdpFrameHeader.SRDP_OP_WRITE)]:
-         header.dataLength = 0
-      else:
-         header.dataLength = header.length
 
-      if len(datagram) < SrdpFrameHeader.SRDP_FRAME_HEADER_LEN + header.dataLength:
-         raise Exception("invalid SRDP datagram (shorter than header+payload)")
+def _parseDatagram(datagram):
+   """
+   Parse a datagram carrying one SRDP frame. Returns a tuple (fields,
+   dataLength, headerCrc, data), see _unpackReceivedHeader.
+   """
+   if len(datagram) < SrdpFrameHeader.SRDP_FRAME_HEADER_LEN:
+      raise Exception("invalid SRDP datagram (shorter than header)")
+
+   fields, dataLength, headerCrc = _unpackReceivedHeader(datagram)
 
-      data = datagram[SrdpFrameHeader.SRDP_FRAME_HEADER_LEN:]
+   if len(datagram) < SrdpFrameHeader.SRDP_FRAME_HEADER_LEN + dataLength:
+      raise Exception("invalid SRDP datagram (shorter than header+payload)")
 
-      ## note the datagram sender, so we can set the receiver in
-      ## the reply later
+   data = datagram[SrdpFrameHeader.SRDP_FRAME_HEADER_LEN:]
+
+   return fields, dataLength, headerCrc, data
+
+
+
+class SrdpDatagramSession(SrdpProtocol):
+   """
+   SRDP channel to one peer on a UDP socket shared by many peers (see
+   SrdpDatagramServerProtocol). Each session has its own sequence space,
+   pending requests, send window, RTT estimator and provider.
+   """
+
+   def __init__(self, server, addr, provider, debug = False, window = None, retries = 3, reactor = None):
+      SrdpProtocol.__init__(self, provider, debug = debug, window = window, retries = retries, reactor = reactor)
+      self._server = server
+      self._addr = addr
+      self._isConnected = True
+      self.lastActivity = self._reactor.seconds()
+
+
+   def getPeer(self):
+      return self._addr
+
+
+   def close(self):
+      self._server.closeSession(self._addr)
+
+
+   def isIdle(self, now, timeout):
+      return len(self._pending) == 0 and len(self._sendQueue) == 0 and now - self.lastActivity >= timeout
+
+
+   def _write(self, wireData, addr = None):
+      ## lastActivity is only updated on receive: a peer that went away
+      ## must not be kept alive by our own traffic to it
       ##
-      header.senderAddr = addr
+      self._server.transport.write(wireData, self._addr)
 
-      self._frameReceived(header, data)
+
+   def _sendFrame(self, header, data = None):
+      wireData = header.encode(data)
+      self._write(wireData)
+      self.metrics.frameSent(header.frametype, header.opcode, len(wireData))
+
+      if self._debug:
+         self._logFrame("SRDP frame sent", header, data)
+
+
+
+class SrdpDatagramServerProtocol(DatagramProtocol):
+   """
+   SRDP over one (unconnected) UDP socket serving many adapters.
+
+   Incoming datagrams are demultiplexed by sender address onto per-peer
+   sessions (SrdpDatagramSession), created on first contact (or explicitly
+   via openSession) with a provider from providerFactory(addr). Sessions
+   without requests in flight and without traffic for sessionTimeout
+   seconds are evicted.
+   """
+
+   def __init__(self,
+                providerFactory,
+                sessionTimeout = 300.,
+                debug = False,
+                retries = 3,
+                reactor = None):
+      self._providerFactory = providerFactory
+      self._sessionTimeout = sessionTimeout
+      self._debug = debug
+      self._retries = retries
+      if reactor is None:
+         from twisted.internet import reactor
+      self._reactor = reactor
+      self._sessions = {}
+      self._evictor = None
+
+
+   def startProtocol(self):
+      if self._sessionTimeout:
+         self._evictor = LoopingCall(self._evictIdleSessions)
+         self._evictor.clock = self._reactor
+         self._evictor.start(self._sessionTimeout / 2., now = False)
+
+
+   def stopProtocol(self):
+      if self._evictor and self._evictor.running:
+         self._evictor.stop()
+      self._evictor = None
+      for addr in self._sessions.keys():
+         self.closeSession(addr, "datagram protocol stopped")
+
+
+   def getSession(self, addr):
+      return self._sessions.get(addr, None)
+
+
+   def getSessions(self):
+      return self._sessions.values()
+
+
+   def openSession(self, addr):
+      """
+      Get the session for the given peer address, creating it if needed.
+      """
+      session = self._sessions.get(addr, None)
+      if session is None:
+         provider = self._providerFactory(addr)
+         session = SrdpDatagramSession(self,
+                                       addr,
+                                       provider,
+                                       debug = self._debug,
+                                       retries = self._retries,
+                                       reactor = self._reactor)
+         self._sessions[addr] = session
+         if self._debug:
+            log.msg("SRDP session opened [peer = %s]" % (addr,))
+         provider.onChannelOpen(session)
+      return session
+
+
+   def closeSession(self, addr, reason = "session closed"):
+      session = self._sessions.pop(addr, None)
+      if session is not None:
+         session._isConnected = False
+         session._failRequests(reason)
+         if self._debug:
+            log.msg("SRDP session closed [peer = %s, %s]" % (addr, reason))
+         session._provider.onChannelClose(reason)
+
+
+   def _evictIdleSessions(self):
+      now = self._reactor.seconds()
+      for addr, session in self._sessions.items():
+         if session.isIdle(now, self._sessionTimeout):
+            self.closeSession(addr, "session idle")
+
+
+   def datagramReceived(self, datagram, addr):
+      if self._debug:
+         log.msg("Octets received [peer = %s, data = %s]" % (addr, binascii.hexlify(datagram)))
+
+      fields, dataLength, headerCrc, data = _parseDatagram(datagram)
+      session = self.openSession(addr)
+      session.lastActivity = self._reactor.seconds()
+      session._frameReceived(fields, dataLength, headerCrc, data, addr)
 
 
 
 class SrdpStreamProtocol(Protocol, SrdpProtocol):
 
-   def __init__(self, provider, debug = False):
-      SrdpProtocol.__init__(self, provider, debug = debug)
+   ## serial line octets per second = baudrate / BITS_PER_OCTET (8N1)
+   ##
+   BITS_PER_OCTET = 10
+
+   def __init__(self,
+                provider,
+                debug = False,
+                window = None,
+                retries = 3,
+                reactor = None,
+                batchLimit = 4096,
+                baudrate = None,
+                peerBufferSize = 64):
+      ## frames with CRC errors are dropped, so a corrupted response would
+      ## keep its request (and send window slot) forever without a retry
+      ## budget: stream requests time out by default too
+      ##
+      SrdpProtocol.__init__(self, provider, debug = debug, window = window, retries = retries, reactor = reactor)
+
+      ## output batching: frames produced within one reactor iteration are
+      ## gathered and flushed together at the end of the iteration, in
+      ## batches of at most batchLimit octets (only a single frame larger
+      ## than that is written alone). a batchLimit of 0 writes every frame
+      ## directly
+      ##
+      self._batchLimit = batchLimit
+      self._outgoing = []
+      self._outgoingNum = 0
+      self._flushCall = None
+
+      ## receive buffer: octets not yet consumed by frame reassembly
+      ##
+      self._received = bytearray()
 
-      self._received = []
-      self._receivedNum = 0
-      self._needed = SrdpFrameHeader.SRDP_FRAME_HEADER_LEN
+      ## chunks received while frames are being dispatched (re-entrant
+      ## dataReceived), since the buffer cannot grow while views on it exist
+      ##
+      self._receivedPending = []
+      self._receiving = False
 
+      ## header (as returned by _unpackReceivedHeader) of a frame whose data
+      ## has not yet been completely received
+      ##
       self._srdpFrameHeader = None
-      self._srdpFrameData = None
 
-      self._chopup = False
-      self._send_queue = deque()
-      self._send_queue_triggered = False
+      ## output pacing: when a baudrate is given, output is released through
+      ## a token bucket refilled at line rate, with a capacity of the peer's
+      ## receive buffer size, so slow adapters are not overrun
+      ##
+      if baudrate:
+         self._pacer = SrdpTokenBucket(float(baudrate) / SrdpStreamProtocol.BITS_PER_OCTET,
+                                       peerBufferSize,
+                                       self._reactor.seconds())
+      else:
+         self._pacer = None
+      self._paced = deque()
+      self._pacedOffset = 0
+      self._paceCall = None
 
 
    def close(self):
@@ -378,48 +1204,108 @@ class SrdpStreamProtocol(Protocol, SrdpProtocol):
    def connectionMade(self):
       self._isConnected = True
       self._provider.onChannelOpen(self)
+      self._sendQueued()
 
 
    def connectionLost(self, reason):
       self._isConnected = False
+      if self._flushCall is not None:
+         self._flushCall.cancel()
+         self._flushCall = None
+      self._outgoing = []
+      self._outgoingNum = 0
+      if self._paceCall is not None:
+         self._paceCall.cancel()
+         self._paceCall = None
+      self._paced.clear()
+      self._pacedOffset = 0
+      self._failRequests(reason.getErrorMessage())
       self._provider.onChannelClose(reason)
 
 
-   def _send(self):
-      if len(self._send_queue) > 0:
-         d = self._send_queue.popleft()
-         self.transport.write(d)
-         #FIXME
-         #reactor.callLater(0.1, self._send)
-      else:
-         self._send_queue_triggered = False
-
-
-   def _trigger(self):
-      if not self._send_queue_triggered:
-         self._send_queue_triggered = True
-         self._send()
-
-
    def _write(self, data):
       if self._debug:
          log.msg("Octets sent [data = %s]" % binascii.hexlify(data))
 
-      if self._chopup:
-         for c in data:
-            self._send_queue.append(c)
-         self._trigger()
+      if self._pacer:
+         self._paced.append(data)
+         if self._paceCall is None:
+            self._pace()
+      elif self._batchLimit:
+         ## a batch never grows beyond batchLimit octets: flush the pending
+         ## batch before a frame that would cross the limit
+         ##
+         if self._outgoingNum + len(data) > self._batchLimit:
+            self._flush()
+         self._outgoing.append(data)
+         self._outgoingNum += len(data)
+         if self._outgoingNum >= self._batchLimit:
+            self._flush()
+         elif self._flushCall is None:
+            self._flushCall = self._reactor.callLater(0, self._flush)
       else:
          self.transport.write(data)
 
 
+   def _flush(self):
+      """
+      Write all frames gathered for output in one go.
+      """
+      if self._flushCall is not None:
+         if self._flushCall.active():
+            self._flushCall.cancel()
+         self._flushCall = None
+
+      if self._outgoing:
+         outgoing = self._outgoing
+         self._outgoing = []
+         self._outgoingNum = 0
+         self.transport.writeSequence(outgoing)
+
+
+   def _pace(self):
+      """
+      Release as much paced output as the token bucket allows, and schedule
+      the (single) pacing timer for when the next piece can go out.
+      """
+      self._paceCall = None
+      pacer = self._pacer
+      pacer.refill(self._reactor.seconds())
+
+      released = []
+      paced = self._paced
+      while paced:
+         head = paced[0]
+         rest = len(head) - self._pacedOffset
+         n = min(rest, int(pacer.tokens + 1e-9))
+         if n <= 0:
+            break
+         if n == rest:
+            if self._pacedOffset:
+               released.append(head[self._pacedOffset:])
+            else:
+               released.append(head)
+            paced.popleft()
+            self._pacedOffset = 0
+         else:
+            ## frames larger than the available tokens go out in pieces
+            ##
+            released.append(head[self._pacedOffset:self._pacedOffset + n])
+            self._pacedOffset += n
+         pacer.consume(n)
+
+      if released:
+         self.transport.writeSequence(released)
+
+      if paced:
+         rest = len(paced[0]) - self._pacedOffset
+         self._paceCall = self._reactor.callLater(pacer.delay(rest), self._pace)
+
+
    def _sendFrame(self, header, data = None):
-      header.crc16 = header.computeCrc(data)
-      if data:
-         wireData = header.serialize() + data
-      else:
-         wireData = header.serialize()
+      wireData = header.encode(data)
       self._write(wireData)
+      self.metrics.frameSent(header.frametype, header.opcode, len(wireData))
 
       if self._debug:
          self._logFrame("SRDP frame sent", header, data)
@@ -431,64 +1317,65 @@ class SrdpStreamProtocol(Protocol, SrdpProtocol):
       if self._debug:
          log.msg("Octets received [data = %s]" % binascii.hexlify(data))
 
-      ## buffer up received octets ..
-      ##
-      self._received.append(data)
-      self._receivedNum += len(data)
-
-      ## .. until we have enough to begin processing the frame
-      ##
-      if self._receivedNum >= self._needed:
-         data = ''.join(self._received)
-         self._received = []
-         self._receiveFrame(data)
-
-
-   def _receiveFrame(self, data):
-
-      if self._srdpFrameHeader is None:
-
-         ## awaiting frame header ..
-         ##
-         self._srdpFrameHeader = SrdpFrameHeader()
-         self._srdpFrameHeader.parse(data[0:SrdpFrameHeader.SRDP_FRAME_HEADER_LEN])
-
-         rest = data[SrdpFrameHeader.SRDP_FRAME_HEADER_LEN:]
-
-         if (self._srdpFrameHeader.frametype, self._srdpFrameHeader.opcode) \
-            in [(SrdpFrameHeader.SRDP_FT_REQ, SrdpFrameHeader.SRDP_OP_SYNC),
-                (SrdpFrameHeader.SRDP_FT_REQ, SrdpFrameHeader.SRDP_OP_READ),
-                (SrdpFrameHeader.SRDP_FT_ACK, SrdpFrameHeader.SRDP_OP_WRITE)]:
-            self._srdpFrameHeader.dataLength = 0
-         else:
-            self._srdpFrameHeader.dataLength = self._srdpFrameHeader.length
-
-         self._needed = self._srdpFrameHeader.dataLength
-
-      else:
-
-         ## got complete frame data. frame is ready to be processed.
-         ##
-         if self._srdpFrameHeader.dataLength > 0:
-            self._srdpFrameData = data[0:self._srdpFrameHeader.dataLength]
-            rest = data[self._srdpFrameHeader.dataLength:]
-         else:
-            self._srdpFrameData = None
-            rest = data
-
-         ## process SRDP frame and reset everything
-         ##
-         self._frameReceived(self._srdpFrameHeader, self._srdpFrameData)
-         self._srdpFrameHeader = None
-         self._srdpFrameData = None
-         self._needed = SrdpFrameHeader.SRDP_FRAME_HEADER_LEN
+      if self._receiving:
+         self._receivedPending.append(data)
+         return
+
+      self._receiving = True
+      try:
+         self._received.extend(data)
+         self._receiveFrames()
+         while self._receivedPending:
+            for chunk in self._receivedPending:
+               self._received.extend(chunk)
+            self._receivedPending = []
+            self._receiveFrames()
+      finally:
+         self._receiving = False
+
+
+   def _receiveFrames(self):
+      """
+      Process all complete frames in the receive buffer in one flat loop.
+
+      Frame headers are unpacked in place into tuples (no header objects are
+      constructed), and frame data is handed on as a memoryview into the
+      receive buffer. Consumed octets are dropped from
+      the buffer once at the end, so the buffer never holds more than one
+      incomplete frame between calls.
+      """
+      buf = self._received
+      end = len(buf)
+      pos = 0
+
+      view = memoryview(buf)
+      try:
+         while True:
+            header = self._srdpFrameHeader
+            if header is None:
+               if end - pos < SrdpFrameHeader.SRDP_FRAME_HEADER_LEN:
+                  break
+               header = _unpackReceivedHeader(buf, pos)
+               pos += SrdpFrameHeader.SRDP_FRAME_HEADER_LEN
+               self._srdpFrameHeader = header
+
+            fields, dataLength, headerCrc = header
+            if end - pos < dataLength:
+               break
+
+            if dataLength > 0:
+               data = view[pos:pos + dataLength]
+               pos += dataLength
+            else:
+               data = None
 
-      if len(rest) < self._needed:
-         ## need to receive more data to continue ..
-         ##
-         self._received.append(rest)
-         self._receivedNum = len(rest)
-      else:
-         ## process the rest of already received data
+            self._srdpFrameHeader = None
+            self._frameReceived(fields, dataLength, headerCrc, data)
+            data = None
+      finally:
+         ## release all views before the buffer gets resized
          ##
-         self._receiveFrame(rest)
+         data = None
+         view = None
+         if pos > 0:
+            del buf[:pos]
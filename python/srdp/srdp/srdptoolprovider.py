@@ -33,6 +33,7 @@ from twisted.internet.defer import Deferred, \
 from srdp import SrdpFrameHeader
 from interfaces import ISrdpProvider
 from srdpprovider import SrdpProvider
+from discovery import SrdpDiscovery, SrdpDeviceRegistry
 
 
 def tabify(fields, formats, truncate = 120, filler = ['-', '+']):
@@ -146,21 +147,30 @@ class SrdpToolProvider(SrdpProvider):
       reactor.stop()
 
 
+   def onRegisterChange(self, device, register, position, data):
+      ## register changes are handled by subscriptions on the channel
+      pass
+
+
    @inlineCallbacks
    def listDevices(self, _):
       """
       List all devices currently connected to the adapter.
       """
       try:
-         em = yield self.getDeviceEdsMap()
-         im = yield self.getDeviceUuidMap()
+         registry = SrdpDeviceRegistry(self._config.get('registry', None))
+         discovery = SrdpDiscovery(self.channel,
+                                   self._edsDb,
+                                   registry,
+                                   revalidate = self._config.get('revalidate', False))
+         devices = yield discovery.discover()
 
          print
          print "SRDP Adapter: Connected Devices"
          print "==============================="
          print
-         print "Adapter UUID    : %s" % (binascii.hexlify(im[1]))
-         print "Adapter EDS URI : %s" % (em[1])
+         print "Adapter UUID    : %s" % (binascii.hexlify(devices[1].uuid))
+         print "Adapter EDS URI : %s" % (devices[1].edsUri)
          print
 
          LINEFORMAT = ['r7', 'l32', 'l*', 'c9']
@@ -168,14 +178,20 @@ class SrdpToolProvider(SrdpProvider):
          print tabify(["Device", "UUID", "EDS URI", "Registers"], LINEFORMAT, self.LINELENGTH)
          print tabify(None, LINEFORMAT, self.LINELENGTH)
 
-         for i in sorted(em.keys()):
+         for i in sorted(devices.keys()):
             if i == 2:
                print tabify(None, LINEFORMAT, self.LINELENGTH, filler = ['.', '|'])
-            eds = self._edsDb.getEdsByUri(em[i])
-            print tabify([i, binascii.hexlify(im[i]), em[i], len(eds.registersByIndex)], LINEFORMAT, self.LINELENGTH)
+            device = devices[i]
+            if device.eds is not None:
+               registers = len(device.eds.registersByIndex)
+            else:
+               registers = '?'
+            print tabify([i, binascii.hexlify(device.uuid), device.edsUri, registers], LINEFORMAT, self.LINELENGTH)
 
          print tabify(None, LINEFORMAT, self.LINELENGTH)
          print
+         if self._debug:
+            log.msg("Device discovery done with %d register reads" % discovery.reads)
       finally:
          self.channel.close()
 
@@ -303,25 +319,36 @@ class SrdpToolProvider(SrdpProvider):
          print tabify(["Register", "Path", "Current Value"], LINEFORMAT, self.LINELENGTH)
          print tabify(None, LINEFORMAT, self.LINELENGTH)
 
+         ## read all readable registers concurrently
+         ##
+         readable = [k for k in sorted(eds.registersByIndex.keys()) if eds.registersByIndex[k]['access'] in ['read', 'readwrite']]
+         values = yield self.channel.readRegisters(device, readable)
+
          sysRegsDone = False
-         for k in sorted(eds.registersByIndex.keys()):
+         for k in readable:
 
             if not sysRegsDone and k >= 1024:
                print tabify(None, LINEFORMAT, self.LINELENGTH, filler = ['.', '|'])
                sysRegsDone = True
 
             reg = eds.registersByIndex[k]
-            if reg['access'] in ['read', 'readwrite']:
-               try:
-                  data = yield self.channel.readRegister(device, reg['index'])
-               except Exception, e:
-                  if reg['optional'] and e.args[0] == SrdpFrameHeader.SRDP_ERR_NO_SUCH_REGISTER:
-                     print tabify([k, reg['path'], '- (not implemented)'], LINEFORMAT, self.LINELENGTH)
-                  else:
-                     print tabify([k, reg['path'], 'Error: %s.' % e.args[1]], LINEFORMAT, self.LINELENGTH)
+            data = values[k]
+            if isinstance(data, Exception):
+               ## SRDP errors and timeouts carry (error code, error text), other
+               ## failures (eg channel closed) only a message
+               ##
+               e = data
+               if len(e.args) >= 2:
+                  code, text = e.args[0], e.args[1]
+               else:
+                  code, text = None, str(e)
+               if reg['optional'] and code == SrdpFrameHeader.SRDP_ERR_NO_SUCH_REGISTER:
+                  print tabify([k, reg['path'], '- (not implemented)'], LINEFORMAT, self.LINELENGTH)
                else:
-                  _, val = eds.unserialize(k, data)
-                  print tabify([k, reg['path'], val], LINEFORMAT, self.LINELENGTH)
+                  print tabify([k, reg['path'], 'Error: %s.' % text], LINEFORMAT, self.LINELENGTH)
+            else:
+               _, val = eds.unserialize(k, data)
+               print tabify([k, reg['path'], val], LINEFORMAT, self.LINELENGTH)
 
          print tabify(None, LINEFORMAT, self.LINELENGTH)
          print
@@ -365,14 +392,15 @@ class SrdpToolProvider(SrdpProvider):
 
          _printHeader()
 
-         def _onRegisterChange(device, register, position, data):
+         def _onRegisterChange(device, register, position, value):
             self.LINES += 1
             if (self.LINES % 40) == 0:
                _printHeader()
-            reg, val = eds.unserialize(register, data)
-            print tabify([reg['index'], reg['path'], val], LINEFORMAT, self.LINELENGTH)
+            reg = eds.getRegister(register)
+            print tabify([reg['index'], reg['path'], value], LINEFORMAT, self.LINELENGTH)
 
-         self.onRegisterChange = _onRegisterChange
+         self.channel.subscriptions.setDeviceEds(device, eds)
+         self.channel.subscribe(_onRegisterChange, device)
 
       finally:
          #self.channel.close()
@@ -24,6 +24,7 @@ import sys, os,  uuid, json, pkg_resources, argparse
 
 from twisted.python import log
 from twisted.internet.serialport import SerialPort
+from twisted.internet.task import LoopingCall
 
 from _version import __version__
 
@@ -125,6 +126,52 @@ class SrdpToolRunner(object):
                           default = 1.0,
                           action = "store")
 
+      group3.add_argument("--pace",
+                          type = int,
+                          metavar = "<peer buffer size>",
+                          help = "Pace serial output at line rate for adapters with the given receive buffer size (octets).")
+
+      group3.add_argument("--registry",
+                          type = str,
+                          default = os.path.join(os.path.expanduser("~"), ".srdp", "devices.json"),
+                          metavar = "<file path>",
+                          help = "Device registry file, so devices already known do not need to be queried again.")
+
+      group3.add_argument("--eds-cache",
+                          type = str,
+                          default = os.path.join(os.path.expanduser("~"), ".srdp", "eds.cache"),
+                          metavar = "<file path>",
+                          help = "EDS database cache file, used when no EDS file changed since the cache was written.")
+
+      group3.add_argument("--no-eds-cache",
+                          help = "Always load the EDS database from the EDS directories (and do not write the cache).",
+                          action = "store_true")
+
+      group3.add_argument("-j",
+                          "--jobs",
+                          type = int,
+                          default = 1,
+                          metavar = "<processes>",
+                          help = "Number of processes for parsing and validating EDS files when checking the EDS database (0 for one per CPU).")
+
+      group3.add_argument("--eds-timings",
+                          help = "Print the parse and validation time of each EDS file loaded.",
+                          action = "store_true")
+
+      group3.add_argument("--revalidate",
+                          help = "Re-read the EDS URIs of devices known from the registry (by default only their UUIDs are re-read, to detect replaced devices).",
+                          action = "store_true")
+
+      group3.add_argument("--stats",
+                          type = float,
+                          metavar = "<interval>",
+                          help = "Print channel statistics (frames and octets by frame type and opcode, errors, request latencies) every N seconds (float) and on exit.")
+
+      group3.add_argument("--stats-file",
+                          type = str,
+                          metavar = "<file path>",
+                          help = "Dump channel statistics as JSON to given file instead of printing them.")
+
       group3.add_argument("--linelength",
                           type = int,
                           default = 120,
@@ -247,6 +294,14 @@ class SrdpToolRunner(object):
       config['port'] = port
       config['baudrate'] = baudrate
       config['linelength'] = linelength
+      config['pace'] = args.pace
+      config['stats'] = args.stats
+      config['registry'] = args.registry
+      config['edscache'] = None if args.no_eds_cache else args.eds_cache
+      config['jobs'] = args.jobs or None
+      config['edstimings'] = args.eds_timings
+      config['revalidate'] = args.revalidate
+      config['statsfile'] = args.stats_file
 
       return config
 
@@ -272,17 +327,47 @@ class SrdpToolRunner(object):
 
       elif config['mode'] in ['check', 'list', 'show', 'read', 'monitor']:
 
-         edsDb = SrdpEdsDatabase(debug = config['debug'])
-
-         total = 0
-         for d in config['edsdirs']:
-            l = edsDb.loadFromDir(d)
-            total += l
-            print "Ok: loaded and checked %d EDS files from %s" % (l, d)
+         ## only check mode needs all EDS, otherwise EDS are loaded
+         ## when used (for the devices found)
+         ##
+         edsDb = SrdpEdsDatabase(debug = config['debug'], lazy = config['mode'] != 'check')
+
+         l = None
+         if config['edscache'] and config['mode'] != 'check':
+            l = edsDb.loadCache(config['edscache'], config['edsdirs'])
+            if l is not None:
+               print "Ok: loaded %d EDS objects from cache %s" % (l, config['edscache'])
+
+         if l is None:
+            total = 0
+            for d in config['edsdirs']:
+               l = edsDb.loadFromDir(d, processes = config['jobs'])
+               total += l
+               if edsDb.lazy:
+                  print "Ok: indexed %d EDS files from %s" % (l, d)
+               else:
+                  print "Ok: loaded and checked %d EDS files from %s" % (l, d)
+
+            l = edsDb.check()
+
+            if config['edscache']:
+               try:
+                  edsDb.saveCache(config['edscache'])
+               except Exception, e:
+                  print "Warning: could not write EDS cache %s (%s)" % (config['edscache'], e)
 
-         l = edsDb.check()
          print "EDS database with %d objects initiated." % l
 
+         if config['edstimings'] and edsDb.timings:
+            print
+            print "  Seconds | EDS file"
+            print "----------+" + "-" * 60
+            for filename, seconds in sorted(edsDb.timings, key = lambda t: t[1], reverse = True):
+               print "%9.4f | %s" % (seconds, filename)
+            print "----------+" + "-" * 60
+            print "%9.4f | total (%d files)" % (sum([t[1] for t in edsDb.timings]), len(edsDb.timings))
+            print
+
          if config['mode'] == 'check':
             return False
 
@@ -294,7 +379,14 @@ class SrdpToolRunner(object):
 
             print "SRDP-over-Serial - connecting to %s at %d baud .." % (config['port'], config['baudrate'])
             
-            protocol = SrdpStreamProtocol(provider = srdptool, debug = config['debug'])
+            if config['pace']:
+               print "Pacing output for adapter receive buffer of %d octets." % config['pace']
+               protocol = SrdpStreamProtocol(provider = srdptool,
+                                             debug = config['debug'],
+                                             baudrate = config['baudrate'],
+                                             peerBufferSize = config['pace'])
+            else:
+               protocol = SrdpStreamProtocol(provider = srdptool, debug = config['debug'])
             serialPort = SerialPortFix(protocol, config['port'], reactor, baudrate = config['baudrate'])
 
          elif config['transport'] == 'udp':
@@ -302,12 +394,47 @@ class SrdpToolRunner(object):
             print "SRDP-over-UDP - connecting to %s:%d .." % (config['host'], config['port'])
 
             protocol = SrdpDatagramProtocol(provider = srdptool, addr = (config['host'], config['port']), debug = config['debug'])
-            reactor.listenUDP(config['port'], protocol)
+            ## bind an ephemeral local port, so the tool can run next to an
+            ## adapter (or emulator) listening on the same port on this host
+            ##
+            reactor.listenUDP(0, protocol)
 
          else:
             raise Exception("logic error")
 
+         if config['stats']:
+            self.startStats(protocol, config['stats'], config['statsfile'], reactor)
+
          return True
 
       else:
          raise Exception("logic error")
+
+
+   def startStats(self, protocol, interval, path, reactor):
+      """
+      Periodically print (or dump to file) the channel metrics, and once
+      more when the reactor shuts down.
+      """
+      def dump():
+         metrics = protocol.getMetrics()
+         if path:
+            with open(path, 'w') as f:
+               f.write(json.dumps(metrics, indent = 3, sort_keys = True))
+               f.write('\n')
+         else:
+            print
+            print "SRDP channel statistics:"
+            print protocol.metrics.summary()
+            print "window size = %.2f, inflight = %d (max %d), queued = %d, rto = %.3f s" % \
+                  (metrics['window']['size'], metrics['window']['inflight'], metrics['window']['inflightMax'], metrics['queued'], metrics['rtt']['rto'])
+
+      self._stats = LoopingCall(dump)
+      self._stats.clock = reactor
+      self._stats.start(interval, now = False)
+
+      def stop():
+         self._stats.stop()
+         dump()
+
+      reactor.addSystemEventTrigger('before', 'shutdown', stop)
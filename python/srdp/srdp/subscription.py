@@ -0,0 +1,324 @@
+###############################################################################
+##
+##  Copyright 2013 Tavendo GmbH
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##      http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+__all__ = ("SrdpSubscription",
+           "SrdpSubscriptionRegistry",
+           "SrdpChangeFilter",)
+
+from twisted.python import log
+
+
+class SrdpSubscription(object):
+   """
+   Handle of a subscription to register change notifications.
+   """
+
+   __slots__ = ('registry', 'device', 'register', 'handler')
+
+   def __init__(self, registry, device, register, handler):
+      self.registry = registry
+      self.device = device
+      self.register = register
+      self.handler = handler
+
+
+   def unsubscribe(self):
+      self.registry.unsubscribe(self)
+
+
+
+class SrdpSubscriptionRegistry(object):
+   """
+   Registry of handlers for register change notifications (CHANGE frames).
+
+   Handlers subscribe to a device, a register (index or path) on any
+   device, a register of a device, or to all changes. Subscriptions are
+   kept in a dispatch table indexed by (device, register) with None as
+   wildcard, so a notification only reaches the handlers subscribed to
+   it (with at most four lookups).
+
+   Handlers are called as handler(device, register, position, value).
+   When the EDS of the device is known (setDeviceEds), value is decoded
+   with the EDS codec, otherwise it is the raw register data.
+   """
+
+   def __init__(self):
+      self._handlers = {}
+      self._edsByDevice = {}
+
+
+   def setDeviceEds(self, device, eds):
+      """
+      Set the EDS used to decode register values of the device.
+      """
+      self._edsByDevice[device] = eds
+
+
+   def getDeviceEds(self, device):
+      return self._edsByDevice.get(device, None)
+
+
+   def subscribe(self, handler, device = None, register = None):
+      """
+      Subscribe handler to changes of register on device (either can be
+      None to match any). Registers given by path are resolved with the
+      EDS of the device. Returns a SrdpSubscription.
+      """
+      if type(register) in [str, unicode]:
+         eds = self._edsByDevice.get(device, None)
+         if eds is None:
+            raise Exception("cannot subscribe to register by path without EDS for device")
+         reg = eds.getRegister(register)
+         if reg is None:
+            raise Exception("no such register")
+         register = reg['index']
+
+      subscription = SrdpSubscription(self, device, register, handler)
+      key = (device, register)
+
+      ## handler lists are replaced, not modified in place, so handlers
+      ## may (un)subscribe while a notification is dispatched
+      ##
+      self._handlers[key] = self._handlers.get(key, ()) + (subscription,)
+      return subscription
+
+
+   def unsubscribe(self, subscription):
+      key = (subscription.device, subscription.register)
+      subscriptions = tuple([s for s in self._handlers.get(key, ()) if s is not subscription])
+      if subscriptions:
+         self._handlers[key] = subscriptions
+      else:
+         self._handlers.pop(key, None)
+
+
+   def __len__(self):
+      return sum([len(s) for s in self._handlers.values()])
+
+
+   def dispatch(self, device, register, position, data):
+      """
+      Dispatch a register change notification. Returns the number of
+      handlers called.
+      """
+      handlers = self._handlers
+      if not handlers:
+         return 0
+
+      subscriptions = handlers.get((device, register), ()) + \
+                      handlers.get((device, None), ()) + \
+                      handlers.get((None, register), ()) + \
+                      handlers.get((None, None), ())
+      if not subscriptions:
+         return 0
+
+      value = data
+      eds = self._edsByDevice.get(device, None)
+      if eds is not None and position == 0:
+         try:
+            _, value = eds.unserialize(register, data)
+         except Exception:
+            log.err(None, "SRDP could not decode value of register %d on device %d" % (register, device))
+            value = data
+
+      for subscription in subscriptions:
+         try:
+            subscription.handler(device, register, position, value)
+         except Exception:
+            log.err(None, "SRDP register change handler failed")
+
+      return len(subscriptions)
+
+
+
+class _SrdpChangeState(object):
+   """
+   Conditioning state of one register (see SrdpChangeFilter).
+   """
+
+   __slots__ = ('reported', 'reportedAt', 'latest', 'pending', 'timer', 'heartbeat')
+
+   def __init__(self):
+      self.reported = None
+      self.reportedAt = None
+      self.latest = None
+      self.pending = False
+      self.timer = None
+      self.heartbeat = None
+
+
+
+class SrdpChangeFilter(object):
+   """
+   Conditioning stage for register change notifications, wrapping a
+   subscription handler:
+
+      channel.subscribe(SrdpChangeFilter(handler, deadband = 0.5, minInterval = 1.), device)
+
+   State is kept per (device, register), and changes pass these stages:
+
+      - deadband: a value is only reported when it differs from the last
+        reported value by at least deadband (absolute) or by at least
+        relative * |last reported value| (for structured values, if any
+        numeric field does). Non-numeric values are reported when they
+        differ at all.
+      - window: a reportable change opens a coalescing window of the given
+        length, at the end of which the latest value (last value wins) is
+        reported.
+      - minInterval: reports of a register are at least minInterval apart,
+        changes in between are coalesced (last value wins) and reported
+        when the interval has passed.
+      - maxInterval: the latest value of a register (even if within the
+        deadband) is reported at least every maxInterval seconds.
+
+   Partial register values (position != 0) are passed through unfiltered.
+   """
+
+   def __init__(self,
+                handler,
+                window = None,
+                deadband = None,
+                relative = None,
+                minInterval = None,
+                maxInterval = None,
+                reactor = None):
+      self.handler = handler
+      self.window = window
+      self.deadband = deadband
+      self.relative = relative
+      self.minInterval = minInterval
+      self.maxInterval = maxInterval
+
+      if reactor is None:
+         from twisted.internet import reactor
+      self._reactor = reactor
+
+      self._states = {}
+      self.received = 0
+      self.reported = 0
+
+
+   def __call__(self, device, register, position, value):
+      self.received += 1
+      if position != 0:
+         self.handler(device, register, position, value)
+         return
+
+      key = (device, register)
+      state = self._states.get(key, None)
+      if state is None:
+         state = _SrdpChangeState()
+         self._states[key] = state
+      state.latest = value
+
+      if state.timer is not None:
+         ## window or minimum interval running: last value wins
+         ##
+         state.pending = True
+         return
+
+      if state.reportedAt is not None and not self._isSignificant(state.reported, value):
+         return
+
+      now = self._reactor.seconds()
+      due = now
+      if self.window:
+         due = now + self.window
+      if self.minInterval and state.reportedAt is not None:
+         due = max(due, state.reportedAt + self.minInterval)
+
+      if due > now:
+         state.pending = True
+         state.timer = self._reactor.callLater(due - now, self._flush, key, state)
+      else:
+         self._report(key, state, now)
+
+
+   def _isSignificant(self, last, value):
+      if type(value) is dict and type(last) is dict:
+         for field, v in value.items():
+            if self._isSignificant(last.get(field, None), v):
+               return True
+         return False
+
+      if type(value) in (int, long, float) and type(last) in (int, long, float):
+         delta = abs(value - last)
+         if self.deadband is None and self.relative is None:
+            return delta > 0
+         if self.deadband is not None and delta >= self.deadband:
+            return True
+         if self.relative is not None and delta >= self.relative * abs(last) and delta > 0:
+            return True
+         return False
+
+      return value != last
+
+
+   def _flush(self, key, state):
+      state.timer = None
+      if state.pending:
+         state.pending = False
+         if state.reportedAt is None or self._isSignificant(state.reported, state.latest):
+            self._report(key, state, self._reactor.seconds())
+
+
+   def _report(self, key, state, now):
+      state.reported = state.latest
+      state.reportedAt = now
+      self.reported += 1
+
+      if self.maxInterval:
+         if state.heartbeat is not None and state.heartbeat.active():
+            state.heartbeat.reset(self.maxInterval)
+         else:
+            state.heartbeat = self._reactor.callLater(self.maxInterval, self._heartbeat, key, state)
+
+      device, register = key
+      self.handler(device, register, 0, state.latest)
+
+
+   def _heartbeat(self, key, state):
+      state.heartbeat = None
+      if state.timer is not None:
+         state.timer.cancel()
+         state.timer = None
+      state.pending = False
+      self._report(key, state, self._reactor.seconds())
+
+
+   def flush(self):
+      """
+      Report all pending (coalesced) changes right away.
+      """
+      for key, state in self._states.items():
+         if state.timer is not None:
+            state.timer.cancel()
+            self._flush(key, state)
+
+
+   def stop(self):
+      """
+      Cancel all timers, dropping pending changes.
+      """
+      for state in self._states.values():
+         for timer in [state.timer, state.heartbeat]:
+            if timer is not None and timer.active():
+               timer.cancel()
+         state.timer = None
+         state.heartbeat = None
+         state.pending = False
@@ -0,0 +1,116 @@
+###############################################################################
+##
+##  Copyright 2013 Tavendo GmbH
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##      http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+## helpers shared by the SRDP unit tests
+
+from zope.interface import implementer
+
+from twisted.test.proto_helpers import StringTransport
+
+from srdp.interfaces import ISrdpProvider
+from srdp.srdp import SrdpFrameHeader, encodeFrame, unpackFrameHeader
+
+
+@implementer(ISrdpProvider)
+class DummyProvider(object):
+   """
+   Provider recording channel events, answering register reads with
+   the values in registers (dict (device, register) -> data).
+   """
+
+   def __init__(self, registers = None):
+      self.registers = registers or {}
+      self.changes = []
+      self.writes = []
+
+   def onChannelOpen(self, channel):
+      pass
+
+   def onChannelClose(self, reason):
+      pass
+
+   def onRegisterRead(self, device, register, position, length):
+      return self.registers.get((device, register), None)
+
+   def onRegisterWrite(self, device, register, position, data):
+      self.writes.append((device, register, position, data))
+
+   def onRegisterChange(self, device, register, position, data):
+      self.changes.append((device, register, position, data))
+
+
+
+class FakeAdapter(object):
+   """
+   Peer of a stream channel connected to a StringTransport: decodes the
+   request frames written by the channel (until it stops sending) and
+   answers them through
+   handler(header, data) -> (frametype, position, length, data), or
+   drops them when handler returns None. corrupt(n) flips a bit in the
+   next n response frames.
+   """
+
+   def __init__(self, channel, transport, handler):
+      self.channel = channel
+      self.transport = transport
+      self.handler = handler
+      self.received = bytearray()
+      self.requests = []
+      self._corrupt = 0
+
+   def corrupt(self, n = 1):
+      self._corrupt += n
+
+   def run(self):
+      while self.transport.value():
+         self.received.extend(self.transport.value())
+         self.transport.clear()
+         self._answer()
+
+
+   def _answer(self):
+      out = ''
+      while len(self.received) >= SrdpFrameHeader.SRDP_FRAME_HEADER_LEN:
+         header = unpackFrameHeader(self.received)
+         frametype, opcode, device, seq, register, position, length, crc = header
+         dataLength = 0
+         if frametype == SrdpFrameHeader.SRDP_FT_REQ and opcode != SrdpFrameHeader.SRDP_OP_READ:
+            dataLength = length
+         if len(self.received) < SrdpFrameHeader.SRDP_FRAME_HEADER_LEN + dataLength:
+            break
+         data = str(self.received[SrdpFrameHeader.SRDP_FRAME_HEADER_LEN:SrdpFrameHeader.SRDP_FRAME_HEADER_LEN + dataLength])
+         del self.received[:SrdpFrameHeader.SRDP_FRAME_HEADER_LEN + dataLength]
+         self.requests.append(header)
+
+         response = self.handler(header, data)
+         if response is not None:
+            rframetype, rposition, rlength, rdata = response
+            frame = bytearray(encodeFrame(rframetype, opcode, device, seq, register, rposition, rlength, rdata)[0])
+            if self._corrupt:
+               self._corrupt -= 1
+               frame[-1] ^= 0x01
+            out += str(frame)
+      if out:
+         self.channel.dataReceived(out)
+
+
+
+def connectStream(channel):
+   transport = StringTransport()
+   channel.makeConnection(transport)
+   return transport
@@ -0,0 +1,215 @@
+###############################################################################
+##
+##  Copyright 2013 Tavendo GmbH
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##      http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+from twisted.trial import unittest
+from twisted.internet.defer import Deferred, succeed, fail
+
+from srdp.srdp import SrdpFrameHeader, SrdpException
+from srdp.blockwise import SrdpBlockwiseTransfer
+
+
+
+class FakeChannel(object):
+   """
+   Channel answering register reads and writes immediately from / to one
+   register buffer, recording the (position, length) of every chunk.
+   maxPayload limits the chunks the fake adapter accepts: reads are
+   answered short, writes rejected with SRDP_ERR_INVALID_REG_POSLEN.
+   """
+
+   def __init__(self, size, maxPayload = None):
+      self.register = bytearray(size)
+      self.maxPayload = maxPayload
+      self.chunks = []
+
+   def readRegister(self, device, register, position = 0, length = 0):
+      self.chunks.append((position, length))
+      if self.maxPayload is not None:
+         length = min(length, self.maxPayload)
+      return succeed(str(self.register[position:position + length]))
+
+   def writeRegister(self, device, register, data, position = 0):
+      self.chunks.append((position, len(data)))
+      if self.maxPayload is not None and len(data) > self.maxPayload:
+         return fail(SrdpException(SrdpFrameHeader.SRDP_ERR_INVALID_REG_POSLEN))
+      self.register[position:position + len(data)] = data
+      return succeed(None)
+
+
+
+class DeferredChannel(object):
+   """
+   Channel leaving all chunk requests outstanding until answered.
+   """
+
+   def __init__(self):
+      self.requests = []
+
+   def readRegister(self, device, register, position = 0, length = 0):
+      d = Deferred()
+      self.requests.append((position, length, d))
+      return d
+
+   def writeRegister(self, device, register, data, position = 0):
+      d = Deferred()
+      self.requests.append((position, len(data), d))
+      return d
+
+
+
+class ChunkingTest(unittest.TestCase):
+
+   def test_readChunks(self):
+      channel = FakeChannel(200)
+      channel.register[:] = ''.join([chr(i) for i in range(200)])
+      blockwise = SrdpBlockwiseTransfer(channel, maxPayload = 64)
+      d = blockwise.readRegister(1, 10, 200)
+      self.assertEqual(self.successResultOf(d), channel.register)
+      self.assertEqual(channel.chunks, [(0, 64), (64, 64), (128, 64), (192, 8)])
+
+
+   def test_writeChunks(self):
+      channel = FakeChannel(150)
+      data = ''.join([chr(i) for i in range(150)])
+      blockwise = SrdpBlockwiseTransfer(channel, maxPayload = 50)
+      d = blockwise.writeRegister(1, 10, data)
+      self.assertIdentical(self.successResultOf(d), None)
+      self.assertEqual(str(channel.register), data)
+      self.assertEqual(channel.chunks, [(0, 50), (50, 50), (100, 50)])
+
+
+   def test_empty(self):
+      channel = FakeChannel(0)
+      blockwise = SrdpBlockwiseTransfer(channel)
+      self.assertEqual(self.successResultOf(blockwise.readRegister(1, 10, 0)), bytearray())
+      self.assertIdentical(self.successResultOf(blockwise.writeRegister(1, 10, '')), None)
+      self.assertEqual(channel.chunks, [])
+
+
+   def test_concurrency(self):
+      channel = DeferredChannel()
+      blockwise = SrdpBlockwiseTransfer(channel, maxPayload = 10, concurrency = 3)
+      d = blockwise.readRegister(1, 10, 45)
+      self.assertEqual([(pos, n) for pos, n, _ in channel.requests], [(0, 10), (10, 10), (20, 10)])
+
+      ## chunks may complete out of order, each one frees a place for the
+      ## next chunk
+      ##
+      channel.requests[1][2].callback('b' * 10)
+      self.assertEqual(len(channel.requests), 4)
+      for pos, n, r in list(channel.requests):
+         if not r.called:
+            r.callback(chr(ord('a') + pos // 10) * n)
+      while not d.called:
+         pos, n, r = channel.requests[-1]
+         r.callback(chr(ord('a') + pos // 10) * n)
+      self.assertEqual(self.successResultOf(d), bytearray('a' * 10 + 'b' * 10 + 'c' * 10 + 'd' * 10 + 'e' * 5))
+      self.assertEqual(sorted([request[:2] for request in channel.requests]), [(0, 10), (10, 10), (20, 10), (30, 10), (40, 5)])
+
+
+   def test_shortRead(self):
+      channel = FakeChannel(100, maxPayload = 30)
+      channel.register[:] = ''.join([chr(i) for i in range(100)])
+      blockwise = SrdpBlockwiseTransfer(channel, maxPayload = 40, concurrency = 1)
+      d = blockwise.readRegister(1, 10, 100)
+      self.assertEqual(self.successResultOf(d), channel.register)
+      self.assertEqual(channel.chunks, [(0, 40), (30, 10), (40, 30), (70, 30)])
+      self.assertEqual(blockwise.maxPayload, 30)
+
+
+   def test_rejectedWrite(self):
+      channel = FakeChannel(100, maxPayload = 25)
+      blockwise = SrdpBlockwiseTransfer(channel, maxPayload = 60, concurrency = 1)
+      d = blockwise.writeRegister(1, 10, 'x' * 100)
+      self.assertIdentical(self.successResultOf(d), None)
+      self.assertEqual(channel.register, bytearray('x' * 100))
+      self.assertEqual(channel.chunks[:3], [(0, 60), (0, 30), (0, 15)])
+      self.assertEqual(blockwise.maxPayload, 15)
+
+
+   def test_failure(self):
+      channel = DeferredChannel()
+      blockwise = SrdpBlockwiseTransfer(channel, maxPayload = 10)
+      d = blockwise.readRegister(1, 10, 40)
+      channel.requests[0][2].callback('a' * 10)
+      channel.requests[1][2].errback(SrdpException(SrdpFrameHeader.SRDP_ERR_NO_SUCH_REGISTER))
+      failure = self.failureResultOf(d, SrdpException)
+      self.assertEqual(failure.value.args[0], SrdpFrameHeader.SRDP_ERR_NO_SUCH_REGISTER)
+
+      ## chunks still in flight are ignored after the transfer failed
+      ##
+      for pos, n, r in channel.requests[2:]:
+         r.callback('a' * n)
+
+
+   def test_noProgress(self):
+      channel = DeferredChannel()
+      blockwise = SrdpBlockwiseTransfer(channel, maxPayload = 10, concurrency = 1)
+      d = blockwise.readRegister(1, 10, 20)
+      channel.requests[0][2].callback('')
+      self.failureResultOf(d)
+
+
+
+class PayloadProbingTest(unittest.TestCase):
+
+   MAX = SrdpBlockwiseTransfer.SRDP_FRAME_DATA_MAX_LEN
+
+   def test_noProbingByDefault(self):
+      channel = FakeChannel(4096)
+      blockwise = SrdpBlockwiseTransfer(channel)
+      blockwise.writeRegister(1, 10, '\x55' * 4096)
+      blockwise.readRegister(1, 10, 4096)
+      self.assertEqual(max([n for pos, n in channel.chunks]), self.MAX)
+      self.assertEqual(blockwise.maxPayload, self.MAX)
+
+
+   def test_maxPayloadCapped(self):
+      blockwise = SrdpBlockwiseTransfer(FakeChannel(0), maxPayload = 1000)
+      self.assertEqual(blockwise.maxPayload, self.MAX)
+      blockwise = SrdpBlockwiseTransfer(FakeChannel(0), maxPayload = 1000, payloadLimit = 0x10000)
+      self.assertEqual(blockwise.maxPayload, 1000)
+      self.assertEqual(blockwise.payloadLimit, SrdpBlockwiseTransfer.SRDP_FRAME_DATA_LIMIT)
+
+
+   def test_probeWithinLimit(self):
+      channel = FakeChannel(8192)
+      blockwise = SrdpBlockwiseTransfer(channel, payloadLimit = 200, probe = True, concurrency = 1)
+      blockwise.writeRegister(1, 10, '\x55' * 8192)
+      sizes = [n for pos, n in channel.chunks]
+      self.assertEqual(sizes[:5], [self.MAX] * 4 + [2 * self.MAX])
+      self.assertEqual(max(sizes), 200)
+      self.assertEqual(blockwise.maxPayload, 200)
+
+
+   def test_probeRejected(self):
+      channel = FakeChannel(8192, maxPayload = 100)
+      blockwise = SrdpBlockwiseTransfer(channel, payloadLimit = 1000, probe = True, concurrency = 1)
+      d = blockwise.writeRegister(1, 10, '\x55' * 8192)
+      self.assertEqual(self.successResultOf(d), None)
+      self.assertEqual(blockwise.maxPayload, self.MAX)
+      self.assertEqual(channel.register, bytearray('\x55' * 8192))
+
+
+   def test_probeShortRead(self):
+      channel = FakeChannel(8192, maxPayload = 100)
+      channel.register[:] = ''.join([chr(i % 251) for i in range(8192)])
+      blockwise = SrdpBlockwiseTransfer(channel, payloadLimit = 1000, probe = True, concurrency = 1)
+      d = blockwise.readRegister(1, 10, 8192)
+      self.assertEqual(self.successResultOf(d), channel.register)
+      self.assertEqual(blockwise.maxPayload, 100)
@@ -0,0 +1,102 @@
+###############################################################################
+##
+##  Copyright 2013 Tavendo GmbH
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##      http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+from twisted.trial import unittest
+from twisted.internet.task import Clock
+from twisted.internet.defer import succeed
+
+from srdp.cache import SrdpRegisterCache
+from srdp.subscription import SrdpSubscriptionRegistry
+
+
+
+class FakeChannel(object):
+   """
+   Channel answering register reads with a counter, so every read from the
+   device returns a new value.
+   """
+
+   def __init__(self):
+      self.subscriptions = SrdpSubscriptionRegistry()
+      self.reads = 0
+
+   def subscribe(self, handler, device = None, register = None):
+      return self.subscriptions.subscribe(handler, device, register)
+
+   def readRegister(self, device, register, position = 0, length = 0, retries = None):
+      self.reads += 1
+      return succeed(str(self.reads))
+
+
+
+class RegisterCacheTest(unittest.TestCase):
+
+   def setUp(self):
+      self.clock = Clock()
+      self.channel = FakeChannel()
+      self.cache = SrdpRegisterCache(self.channel, reactor = self.clock)
+
+
+   def read(self, register, maxAge = None):
+      return self.successResultOf(self.cache.readRegister(2, register, maxAge = maxAge))
+
+
+   def test_volatile(self):
+      self.assertEqual(self.read(10), '1')
+      self.assertEqual(self.read(10), '2')
+      self.assertEqual(self.read(10, maxAge = 5), '2')
+
+
+   def test_maxAge(self):
+      self.read(10)
+      self.clock.advance(5)
+      self.assertEqual(self.read(10, maxAge = 5), '1')
+      self.clock.advance(1)
+      self.assertEqual(self.read(10, maxAge = 5), '2')
+
+
+   def test_maxAgeZero(self):
+      self.assertEqual(self.read(1), '1')
+      self.assertEqual(self.read(1), '1')
+      self.assertEqual(self.read(1, maxAge = 0), '2')
+      self.assertEqual(self.read(10, maxAge = 0), '3')
+      self.assertEqual(self.read(10, maxAge = 0), '4')
+      self.assertEqual(self.cache.hits, 1)
+
+
+   def test_ttl(self):
+      self.cache.setPolicy(10, SrdpRegisterCache.POLICY_TTL, ttl = 2)
+      self.read(10)
+      self.clock.advance(2)
+      self.assertEqual(self.read(10), '1')
+      self.clock.advance(1)
+      self.assertEqual(self.read(10), '2')
+
+
+   def test_warmBulkRead(self):
+      registers = range(1024, 1024 + 500)
+      for register in registers:
+         self.cache.setPolicy(register, SrdpRegisterCache.POLICY_IMMUTABLE)
+      cold = self.successResultOf(self.cache.readRegisters(2, registers, concurrency = 4))
+      self.assertEqual(self.channel.reads, 500)
+      warm = self.successResultOf(self.cache.readRegisters(2, registers, concurrency = 4))
+      self.assertEqual(warm, cold)
+      self.assertEqual(self.channel.reads, 500)
+      self.assertEqual(self.cache.hits, 500)
+      warm = self.successResultOf(self.cache.readRegisters(2, registers))
+      self.assertEqual(warm, cold)
@@ -0,0 +1,129 @@
+###############################################################################
+##
+##  Copyright 2013 Tavendo GmbH
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##      http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+from twisted.trial import unittest
+from twisted.internet.task import Clock
+from twisted.internet.defer import Deferred
+from twisted.test.proto_helpers import FakeDatagramTransport
+
+from srdp.srdp import SrdpDatagramProtocol, SrdpDatagramServerProtocol, SrdpFrameHeader, encodeFrame, unpackFrameHeader
+
+from helper import DummyProvider
+
+
+
+class DatagramResponderTest(unittest.TestCase):
+
+   def setUp(self):
+      self.provider = DummyProvider({(1, 4): 'abc'})
+      self.channel = SrdpDatagramProtocol(self.provider, reactor = Clock())
+      self.transport = FakeDatagramTransport()
+      self.channel.transport = self.transport
+      self.channel.startProtocol()
+      self.peer = ('127.0.0.1', 1910)
+
+
+   def request(self, opcode, register, length, data = None):
+      frame = encodeFrame(SrdpFrameHeader.SRDP_FT_REQ, opcode, 1, 7, register, 0, length, data)[0]
+      self.channel.datagramReceived(frame, self.peer)
+      self.assertEqual(len(self.transport.written), 1)
+      datagram, addr = self.transport.written.pop()
+      self.assertEqual(addr, self.peer)
+      return unpackFrameHeader(datagram), datagram[SrdpFrameHeader.SRDP_FRAME_HEADER_LEN:]
+
+
+   def test_readResponse(self):
+      header, data = self.request(SrdpFrameHeader.SRDP_OP_READ, 4, 0)
+      self.assertEqual(header[0], SrdpFrameHeader.SRDP_FT_ACK)
+      self.assertEqual(header[3], 7)
+      self.assertEqual(data, 'abc')
+
+
+   def test_writeResponse(self):
+      header, data = self.request(SrdpFrameHeader.SRDP_OP_WRITE, 5, 2, 'xy')
+      self.assertEqual(header[0], SrdpFrameHeader.SRDP_FT_ACK)
+      self.assertEqual(header[6], 2)
+      self.assertEqual(self.provider.writes, [(1, 5, 0, 'xy')])
+
+
+   def test_samePeerSeq(self):
+      """
+      Requests of different peers with the same sequence number, served
+      concurrently, are all answered.
+      """
+      pending = []
+      def onRegisterRead(device, register, position, length):
+         d = Deferred()
+         pending.append(d)
+         return d
+      self.provider.onRegisterRead = onRegisterRead
+      frame = encodeFrame(SrdpFrameHeader.SRDP_FT_REQ, SrdpFrameHeader.SRDP_OP_READ, 1, 7, 4, 0, 0)[0]
+      peers = [('10.0.0.1', 1910), ('10.0.0.2', 1910)]
+      for peer in peers:
+         self.channel.datagramReceived(frame, peer)
+      ## retransmission while the request is still being served
+      ##
+      self.channel.datagramReceived(frame, peers[0])
+      self.assertEqual(len(pending), 2)
+      for d in pending:
+         d.callback('abc')
+      self.assertEqual(sorted([addr for datagram, addr in self.transport.written]), peers)
+
+
+   def test_errorResponse(self):
+      header, data = self.request(SrdpFrameHeader.SRDP_OP_READ, 9, 0)
+      self.assertEqual(header[0], SrdpFrameHeader.SRDP_FT_ERR)
+
+
+
+class DatagramSessionTest(unittest.TestCase):
+
+   def setUp(self):
+      self.clock = Clock()
+      self.server = SrdpDatagramServerProtocol(lambda addr: DummyProvider({(1, 4): 'abc'}),
+                                               sessionTimeout = 10.,
+                                               reactor = self.clock)
+      self.server.transport = FakeDatagramTransport()
+      self.server.startProtocol()
+      self.peer = ('127.0.0.1', 1910)
+
+
+   def test_idleEviction(self):
+      self.server.openSession(self.peer)
+      self.clock.advance(5)
+      self.assertEqual(len(self.server.getSessions()), 1)
+      self.clock.advance(5)
+      self.assertEqual(self.server.getSessions(), [])
+
+
+   def test_receiveKeepsAlive(self):
+      frame = encodeFrame(SrdpFrameHeader.SRDP_FT_REQ, SrdpFrameHeader.SRDP_OP_READ, 1, 1, 4, 0, 0)[0]
+      for i in range(4):
+         self.server.datagramReceived(frame, self.peer)
+         self.clock.advance(5)
+      self.assertEqual(len(self.server.getSessions()), 1)
+
+
+   def test_sendDoesNotKeepAlive(self):
+      session = self.server.openSession(self.peer)
+      session.notifyRegister(1, 4, 0, 3)
+      self.clock.advance(5)
+      session.notifyRegister(1, 4, 0, 3)
+      self.clock.advance(5)
+      self.assertEqual(self.server.getSessions(), [])
+      self.assertEqual(len(self.server.transport.written), 2)
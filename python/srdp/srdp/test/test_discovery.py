@@ -0,0 +1,162 @@
+###############################################################################
+##
+##  Copyright 2013 Tavendo GmbH
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##      http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+import os, struct
+
+from twisted.trial import unittest
+from twisted.internet.defer import succeed
+
+from srdp.srdpprovider import SrdpProvider
+from srdp.discovery import SrdpDiscovery, SrdpDeviceRegistry
+from srdp.subscription import SrdpSubscriptionRegistry
+
+
+
+class FakeAdapterChannel(object):
+   """
+   Channel answering the discovery registers of an adapter with the given
+   devices (dict device index -> (UUID, EDS URI)), counting the reads.
+   """
+
+   def __init__(self, devices):
+      self.devices = devices
+      self.reads = []
+      self.subscriptions = SrdpSubscriptionRegistry()
+
+   def readRegister(self, device, register, position = 0, length = 0):
+      self.reads.append((device, register))
+      if register == SrdpProvider.IDX_REG_ID:
+         return succeed(self.devices[device][0])
+      elif register == SrdpProvider.IDX_REG_EDS:
+         uri = self.devices[device][1]
+         return succeed(struct.pack("<H", len(uri)) + uri)
+      elif register == SrdpProvider.IDX_REG_DEVICES:
+         indices = sorted([i for i in self.devices if i != 1])
+         return succeed(struct.pack("<H%dH" % len(indices), len(indices), *indices))
+      raise Exception("unexpected read")
+
+
+
+class FakeEdsDatabase(object):
+
+   def __init__(self, uris):
+      self.uris = uris
+
+   def getEdsByUri(self, uri):
+      if uri in self.uris:
+         return "eds %s" % uri
+      return None
+
+
+
+class DiscoveryTest(unittest.TestCase):
+
+   def setUp(self):
+      self.devices = {1: ('A' * 16, 'http://eds.example.com/adapter'),
+                      2: ('B' * 16, 'http://eds.example.com/sensor'),
+                      3: ('C' * 16, 'http://eds.example.com/actor')}
+      self.registry = SrdpDeviceRegistry()
+
+
+   def discover(self, revalidate = False, edsDb = None):
+      channel = FakeAdapterChannel(self.devices)
+      discovery = SrdpDiscovery(channel, edsDb = edsDb, registry = self.registry, revalidate = revalidate)
+      devices = self.successResultOf(discovery.discover())
+      return channel, devices
+
+
+   def edsReads(self, channel):
+      return sorted([d for d, r in channel.reads if r == SrdpProvider.IDX_REG_EDS])
+
+
+   def test_cold(self):
+      channel, devices = self.discover()
+      self.assertEqual(sorted(devices.keys()), [1, 2, 3])
+      for index, (uuid, uri) in self.devices.items():
+         self.assertEqual(devices[index].uuid, uuid)
+         self.assertEqual(devices[index].edsUri, uri)
+      self.assertEqual(self.edsReads(channel), [1, 2, 3])
+
+
+   def test_warmReadsUuids(self):
+      self.discover()
+      channel, devices = self.discover()
+      self.assertEqual(self.edsReads(channel), [])
+      self.assertEqual(sorted([d for d, r in channel.reads if r == SrdpProvider.IDX_REG_ID]), [1, 2, 3])
+      self.assertEqual(devices[3].edsUri, self.devices[3][1])
+
+
+   def test_replacedDevice(self):
+      self.discover()
+      self.devices[3] = ('D' * 16, 'http://eds.example.com/other')
+      channel, devices = self.discover()
+      self.assertEqual(self.edsReads(channel), [3])
+      self.assertEqual(devices[3].uuid, 'D' * 16)
+      self.assertEqual(devices[3].edsUri, 'http://eds.example.com/other')
+      self.assertEqual(self.registry.getAdapter('A' * 16)[3], ('D' * 16, 'http://eds.example.com/other'))
+
+
+   def test_revalidate(self):
+      self.discover()
+      self.devices[2] = ('B' * 16, 'http://eds.example.com/sensor-v2')
+      channel, devices = self.discover()
+      self.assertEqual(devices[2].edsUri, 'http://eds.example.com/sensor')
+      channel, devices = self.discover(revalidate = True)
+      self.assertEqual(self.edsReads(channel), [1, 2, 3])
+      self.assertEqual(devices[2].edsUri, 'http://eds.example.com/sensor-v2')
+
+
+   def test_subscriptionEds(self):
+      self.discover()
+      edsDb = FakeEdsDatabase(['http://eds.example.com/adapter', 'http://eds.example.com/sensor'])
+      channel, devices = self.discover(edsDb = edsDb)
+      self.assertEqual(devices[2].eds, 'eds http://eds.example.com/sensor')
+      self.assertIdentical(devices[3].eds, None)
+      self.assertEqual(channel.subscriptions.getDeviceEds(1), 'eds http://eds.example.com/adapter')
+      self.assertEqual(channel.subscriptions.getDeviceEds(2), 'eds http://eds.example.com/sensor')
+      self.assertIdentical(channel.subscriptions.getDeviceEds(3), None)
+
+
+
+class DeviceRegistryTest(unittest.TestCase):
+
+   def test_persist(self):
+      path = os.path.join(self.mktemp(), 'devices.json')
+      registry = SrdpDeviceRegistry(path)
+      channel = FakeAdapterChannel({1: ('A' * 16, 'http://eds.example.com/adapter'),
+                                    2: ('B' * 16, 'http://eds.example.com/sensor')})
+      self.successResultOf(SrdpDiscovery(channel, registry = registry).discover())
+      self.assertTrue(os.path.exists(path))
+      self.assertEqual(SrdpDeviceRegistry(path).getAdapter('A' * 16),
+                       {1: ('A' * 16, 'http://eds.example.com/adapter'),
+                        2: ('B' * 16, 'http://eds.example.com/sensor')})
+
+
+   def test_unwritable(self):
+      """
+      Discovery succeeds when the registry cannot be written.
+      """
+      blocker = self.mktemp()
+      open(blocker, 'w').close()
+      path = os.path.join(blocker, 'devices.json')
+      registry = SrdpDeviceRegistry(path)
+      channel = FakeAdapterChannel({1: ('A' * 16, 'http://eds.example.com/adapter')})
+      devices = self.successResultOf(SrdpDiscovery(channel, registry = registry).discover())
+      self.assertEqual(devices[1].edsUri, 'http://eds.example.com/adapter')
+      self.assertFalse(registry.save())
+      self.assertEqual(registry.getAdapter('A' * 16), {1: ('A' * 16, 'http://eds.example.com/adapter')})
@@ -0,0 +1,252 @@
+###############################################################################
+##
+##  Copyright 2013 Tavendo GmbH
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##      http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+from twisted.trial import unittest
+from twisted.internet.task import Clock
+
+from srdp.srdp import SrdpStreamProtocol, SrdpFrameHeader
+from srdp.flowcontrol import SrdpSendWindow, SrdpRttEstimator
+
+from helper import DummyProvider, FakeAdapter, connectStream
+
+
+
+class SendWindowTest(unittest.TestCase):
+
+   def fill(self, window):
+      tickets = []
+      while window.canSend():
+         tickets.append(window.acquire())
+      return tickets
+
+
+   def test_limits(self):
+      self.assertRaises(Exception, SrdpSendWindow, initial = 0)
+      self.assertRaises(Exception, SrdpSendWindow, initial = 2, minimum = 3)
+      self.assertRaises(Exception, SrdpSendWindow, initial = 9, maximum = 8)
+
+
+   def test_slowStart(self):
+      window = SrdpSendWindow(initial = 1, maximum = 8)
+      for size in [2, 3, 4, 5, 6, 7, 8, 8]:
+         window.release(window.acquire())
+         self.assertEqual(window.size, size)
+
+
+   def test_congestionAvoidance(self):
+      window = SrdpSendWindow(initial = 4, maximum = 16)
+      window.ssthresh = 4.
+      window.release(window.acquire())
+      self.assertAlmostEqual(window.size, 4.25)
+      for i in range(4):
+         window.release(window.acquire())
+      self.assertEqual(int(window.size), 5)
+
+
+   def test_slots(self):
+      window = SrdpSendWindow(initial = 3)
+      tickets = self.fill(window)
+      self.assertEqual(len(tickets), 3)
+      self.assertEqual(window.inflight, 3)
+      self.assertEqual(window.inflightMax, 3)
+      self.assertFalse(window.canSend())
+
+      window.abandon(tickets[0])
+      self.assertEqual(window.inflight, 2)
+      self.assertEqual(window.size, 3)
+      self.assertTrue(window.canSend())
+
+      window.release(tickets[1], congested = True)
+      window.release(tickets[2])
+      self.assertEqual(window.inflight, 0)
+      self.assertEqual(window.inflightMax, 3)
+
+
+   def test_lossHalvesOncePerWindow(self):
+      window = SrdpSendWindow(initial = 8, maximum = 8)
+      tickets = self.fill(window)
+      for ticket in tickets:
+         window.release(ticket, congested = True)
+      self.assertEqual(window.size, 4)
+      self.assertEqual(window.ssthresh, 4)
+      self.assertEqual(window.inflight, 0)
+
+      ## requests sent after the decrease are counted again
+      ##
+      tickets = self.fill(window)
+      window.onTimeout(tickets[0])
+      window.onLoss()
+      self.assertEqual(window.size, 2)
+      self.assertEqual(window.inflight, 4)
+
+
+   def test_lossKeepsSlot(self):
+      window = SrdpSendWindow(initial = 4, maximum = 4)
+      tickets = self.fill(window)
+      window.onLoss()
+      self.assertEqual(window.size, 2)
+      self.assertEqual(window.inflight, 4)
+      self.assertFalse(window.canSend())
+      for ticket in tickets:
+         window.release(ticket, congested = True)
+      self.assertEqual(window.inflight, 0)
+      self.assertTrue(window.canSend())
+
+
+   def test_minimum(self):
+      window = SrdpSendWindow(initial = 8, minimum = 3, maximum = 8)
+      for i in range(5):
+         window.release(window.acquire(), congested = True)
+      self.assertEqual(window.size, 3)
+      self.assertEqual(window.ssthresh, 3)
+
+      window = SrdpSendWindow(initial = 1, maximum = 8)
+      for i in range(5):
+         window.release(window.acquire(), congested = True)
+      self.assertEqual(window.size, 1)
+      self.assertTrue(window.canSend())
+
+
+
+class RttEstimatorTest(unittest.TestCase):
+
+   def test_firstSample(self):
+      rtt = SrdpRttEstimator()
+      self.assertEqual(rtt.rto, 1.)
+      rtt.sample(0.1)
+      self.assertAlmostEqual(rtt.srtt, 0.1)
+      self.assertAlmostEqual(rtt.rttvar, 0.05)
+      self.assertAlmostEqual(rtt.rto, 0.3)
+
+
+   def test_smoothing(self):
+      rtt = SrdpRttEstimator()
+      rtt.sample(0.1)
+      rtt.sample(0.5)
+      self.assertAlmostEqual(rtt.rttvar, 0.75 * 0.05 + 0.25 * 0.4)
+      self.assertAlmostEqual(rtt.srtt, 0.875 * 0.1 + 0.125 * 0.5)
+      self.assertAlmostEqual(rtt.rto, rtt.srtt + 4 * rtt.rttvar)
+
+
+   def test_clamps(self):
+      rtt = SrdpRttEstimator(minimum = 0.2, maximum = 5.)
+      rtt.sample(0.001)
+      self.assertEqual(rtt.rto, 0.2)
+      rtt.sample(100.)
+      self.assertEqual(rtt.rto, 5.)
+
+
+   def test_backoff(self):
+      rtt = SrdpRttEstimator(initial = 1., maximum = 5.)
+      rtt.backoff()
+      self.assertEqual(rtt.rto, 2.)
+      rtt.backoff()
+      rtt.backoff()
+      self.assertEqual(rtt.rto, 5.)
+      rtt.sample(0.1)
+      self.assertAlmostEqual(rtt.rto, 0.3)
+
+
+
+class KarnTest(unittest.TestCase):
+   """
+   Only responses to requests that were never retransmitted feed the RTT
+   estimator.
+   """
+
+   def setUp(self):
+      self.clock = Clock()
+      self.channel = SrdpStreamProtocol(DummyProvider(), reactor = self.clock, batchLimit = 0)
+      self.transport = connectStream(self.channel)
+      self.dropped = 0
+      self.adapter = FakeAdapter(self.channel, self.transport, self.answer)
+
+
+   def answer(self, header, data):
+      if self.dropped < self.drop:
+         self.dropped += 1
+         return None
+      return (SrdpFrameHeader.SRDP_FT_ACK, header[5], 1, 'x')
+
+
+   def test_sample(self):
+      self.drop = 0
+      self.channel.readRegister(1, 4)
+      self.clock.advance(0.25)
+      self.adapter.run()
+      self.assertAlmostEqual(self.channel._rtt.srtt, 0.25)
+
+
+   def test_retransmittedNotSampled(self):
+      self.drop = 1
+      results = []
+      self.channel.readRegister(1, 4).addCallback(results.append)
+      self.adapter.run()
+      self.clock.advance(self.channel._rtt.rto)
+      self.adapter.run()
+      self.assertEqual(results, ['x'])
+      self.assertEqual(self.channel.getMetrics()['retransmits'], 1)
+      self.assertIdentical(self.channel._rtt.srtt, None)
+      self.assertEqual(self.channel._rtt.rto, 2.)
+      self.assertEqual(self.channel._window.inflight, 0)
+
+
+
+class BackoffTest(unittest.TestCase):
+   """
+   A burst of timeouts backs off the channel RTO once, while each request
+   doubles its own retransmission timeout.
+   """
+
+   def setUp(self):
+      self.clock = Clock()
+      self.window = SrdpSendWindow(initial = 8, maximum = 8)
+      self.channel = SrdpStreamProtocol(DummyProvider(), window = self.window, reactor = self.clock, batchLimit = 0)
+      self.transport = connectStream(self.channel)
+      self.adapter = FakeAdapter(self.channel, self.transport, lambda header, data: None)
+
+
+   def test_burstLoss(self):
+      failures = []
+      for i in range(8):
+         self.channel.readRegister(1, 4).addErrback(failures.append)
+      self.adapter.run()
+      self.assertEqual(len(self.adapter.requests), 8)
+
+      self.clock.advance(1.)
+      self.adapter.run()
+      self.assertEqual(len(self.adapter.requests), 16)
+      self.assertEqual(self.channel._rtt.rto, 2.)
+      self.assertEqual(self.window.size, 4)
+
+      ## retransmissions time out after 2, 4 and 8 seconds
+      ##
+      self.clock.advance(1.99)
+      self.adapter.run()
+      self.assertEqual(len(self.adapter.requests), 16)
+      self.clock.advance(0.01)
+      self.adapter.run()
+      self.assertEqual(len(self.adapter.requests), 24)
+      self.clock.advance(4.)
+      self.adapter.run()
+      self.assertEqual(len(self.adapter.requests), 32)
+      self.assertEqual(failures, [])
+      self.clock.advance(8.)
+      self.assertEqual(len(failures), 8)
+      self.assertEqual(self.window.inflight, 0)
+      self.assertEqual(self.channel._rtt.rto, 2.)
@@ -0,0 +1,56 @@
+###############################################################################
+##
+##  Copyright 2013 Tavendo GmbH
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##      http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+from twisted.trial import unittest
+from twisted.internet.task import Clock
+
+from srdp.srdp import SrdpStreamProtocol, SrdpFrameHeader
+from srdp.metrics import SrdpChannelMetrics
+
+from helper import DummyProvider, FakeAdapter, connectStream
+
+
+
+class ChannelMetricsTest(unittest.TestCase):
+
+   def test_octetsByFrame(self):
+      metrics = SrdpChannelMetrics()
+      metrics.frameSent(SrdpFrameHeader.SRDP_FT_REQ, SrdpFrameHeader.SRDP_OP_READ, 12)
+      metrics.frameSent(SrdpFrameHeader.SRDP_FT_REQ, SrdpFrameHeader.SRDP_OP_WRITE, 16)
+      metrics.frameSent(SrdpFrameHeader.SRDP_FT_REQ, SrdpFrameHeader.SRDP_OP_WRITE, 20)
+      metrics.frameReceived(SrdpFrameHeader.SRDP_FT_ACK, SrdpFrameHeader.SRDP_OP_READ, 15)
+      m = metrics.snapshot()
+      self.assertEqual(m['frames'], {'tx REQ/READ': 1, 'tx REQ/WRITE': 2, 'rx ACK/READ': 1})
+      self.assertEqual(m['octets'], {'tx REQ/READ': 12, 'tx REQ/WRITE': 36, 'rx ACK/READ': 15})
+      self.assertEqual(m['octetsTotal'], {'tx': 48, 'rx': 15})
+
+      summary = metrics.summary().splitlines()
+      self.assertIn("tx REQ/WRITE              2 frames           36 octets", summary)
+      self.assertIn("tx total                  3 frames           48 octets", summary)
+
+
+   def test_channel(self):
+      channel = SrdpStreamProtocol(DummyProvider(), reactor = Clock(), batchLimit = 0)
+      transport = connectStream(channel)
+      adapter = FakeAdapter(channel, transport, lambda header, data: (SrdpFrameHeader.SRDP_FT_ACK, 0, 3, 'abc'))
+      channel.readRegister(1, 4)
+      adapter.run()
+      m = channel.getMetrics()
+      self.assertEqual(m['octets'], {'tx REQ/READ': 12, 'rx ACK/READ': 15})
+      self.assertEqual(m['latency']['1/4']['count'], 1)
+      self.assertIn("latency 1/4: 1 requests", channel.metrics.summary())
@@ -0,0 +1,128 @@
+###############################################################################
+##
+##  Copyright 2013 Tavendo GmbH
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##      http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+from twisted.trial import unittest
+
+from srdp.pending import SrdpPendingTable
+
+
+
+class Entry(object):
+   seq = None
+
+
+
+class PendingTableTest(unittest.TestCase):
+
+   def test_size(self):
+      for size in [0, 1, 3, 100, 0x20000]:
+         self.assertRaises(Exception, SrdpPendingTable, size)
+      SrdpPendingTable(2)
+      SrdpPendingTable(0x10000)
+
+
+   def test_allocate(self):
+      table = SrdpPendingTable()
+      entries = [Entry() for i in range(3)]
+      self.assertEqual([table.allocate(e) for e in entries], [1, 2, 3])
+      self.assertEqual([e.seq for e in entries], [1, 2, 3])
+      self.assertEqual(len(table), 3)
+      self.assertIdentical(table.get(2), entries[1])
+      self.assertIdentical(table.pop(2), entries[1])
+      self.assertIdentical(table.get(2), None)
+      self.assertIdentical(table.pop(2), None)
+      self.assertEqual(len(table), 2)
+
+
+   def test_wraparound(self):
+      table = SrdpPendingTable()
+      seqs = []
+      for i in range(SrdpPendingTable.SEQ_MAX + 2):
+         seq = table.allocate(Entry())
+         seqs.append(seq)
+         table.pop(seq)
+      self.assertEqual(seqs[:2], [1, 2])
+      self.assertEqual(seqs[-4:], [SrdpPendingTable.SEQ_MAX - 1, SrdpPendingTable.SEQ_MAX, 1, 2])
+      self.assertNotIn(0, seqs)
+      self.assertEqual(len(table), 0)
+
+
+   def test_staleSeq(self):
+      """
+      A sequence number sharing the slot of a request in flight does not
+      match it (eg a late response to an earlier request).
+      """
+      table = SrdpPendingTable()
+      entry = Entry()
+      for i in range(256):
+         table.pop(table.allocate(Entry()))
+      self.assertEqual(table.allocate(entry), 257)
+      self.assertIdentical(table.get(1), None)
+      self.assertIdentical(table.pop(1), None)
+      self.assertIdentical(table.pop(257), entry)
+
+
+   def test_full(self):
+      table = SrdpPendingTable()
+      entries = []
+      while not table.isFull():
+         entry = Entry()
+         table.allocate(entry)
+         entries.append(entry)
+      self.assertEqual(len(table), 255)
+      self.assertRaises(Exception, table.allocate, Entry())
+
+      ## allocation continues after the last sequence number, skipping the
+      ## slots still taken until the freed one
+      ##
+      table.pop(entries[10].seq)
+      self.assertFalse(table.isFull())
+      entry = Entry()
+      self.assertEqual(table.allocate(entry), 256)
+      self.assertIdentical(table.get(256), entry)
+      self.assertTrue(table.isFull())
+
+      table.pop(entries[20].seq)
+      self.assertEqual(table.allocate(Entry()), 256 + entries[10].seq)
+      self.assertEqual(len(table), 255)
+
+
+   def test_skipTaken(self):
+      table = SrdpPendingTable(4)
+      a, b, c = Entry(), Entry(), Entry()
+      self.assertEqual(table.allocate(a), 1)
+      self.assertEqual(table.allocate(b), 2)
+      table.pop(1)
+      self.assertEqual(table.allocate(c), 3)
+      ## slot of seq 6 is still taken by seq 2
+      ##
+      self.assertEqual(table.allocate(Entry()), 4)
+      table.pop(3)
+      table.pop(4)
+      self.assertEqual(table.allocate(Entry()), 5)
+      self.assertEqual(table.allocate(Entry()), 7)
+
+
+   def test_clear(self):
+      table = SrdpPendingTable()
+      entries = [Entry() for i in range(5)]
+      for entry in entries:
+         table.allocate(entry)
+      self.assertEqual(sorted(table.clear()), sorted(entries))
+      self.assertEqual(len(table), 0)
+      self.assertIdentical(table.get(entries[0].seq), None)
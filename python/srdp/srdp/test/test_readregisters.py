@@ -0,0 +1,64 @@
+###############################################################################
+##
+##  Copyright 2013 Tavendo GmbH
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##      http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+from twisted.trial import unittest
+from twisted.internet.defer import Deferred, succeed
+
+from srdp.srdp import readRegisters
+
+
+
+class ReadRegistersTest(unittest.TestCase):
+
+   def test_synchronous(self):
+      """
+      Reads completing synchronously must not recurse once per register.
+      """
+      for concurrency in [None, 1, 4]:
+         d = readRegisters(lambda register: succeed(str(register)), range(5000), concurrency)
+         res = self.successResultOf(d)
+         self.assertEqual(len(res), 5000)
+         self.assertEqual(res[4999], '4999')
+
+
+   def test_raising(self):
+      def read(register):
+         raise Exception("not connected")
+      res = self.successResultOf(readRegisters(read, range(2000), 4))
+      self.assertEqual(len(res), 2000)
+      self.assertEqual(str(res[1999]), "not connected")
+
+
+   def test_empty(self):
+      self.assertEqual(self.successResultOf(readRegisters(lambda register: succeed(None), [])), {})
+
+
+   def test_concurrency(self):
+      pending = []
+      def read(register):
+         d = Deferred()
+         pending.append((register, d))
+         return d
+
+      d = readRegisters(read, range(10), 3)
+      self.assertEqual([request[0] for request in pending], [0, 1, 2])
+      while pending:
+         register, r = pending.pop(0)
+         r.callback(register * 2)
+         self.assertTrue(len(pending) <= 3)
+      self.assertEqual(self.successResultOf(d), dict([(i, i * 2) for i in range(10)]))
@@ -0,0 +1,287 @@
+###############################################################################
+##
+##  Copyright 2013 Tavendo GmbH
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##      http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+from twisted.trial import unittest
+from twisted.internet.task import Clock
+from twisted.internet.error import ConnectionDone
+from twisted.python.failure import Failure
+from twisted.test.proto_helpers import StringTransport
+
+from srdp import srdp
+from srdp.srdp import SrdpStreamProtocol, SrdpFrameHeader, encodeFrame
+from srdp.flowcontrol import SrdpSendWindow
+
+from helper import DummyProvider, FakeAdapter, connectStream
+
+
+def answerReads(header, data):
+   return (SrdpFrameHeader.SRDP_FT_ACK, header[5], 3, 'abc')
+
+
+
+class StreamRequestTest(unittest.TestCase):
+
+   def setUp(self):
+      self.clock = Clock()
+      self.window = SrdpSendWindow(initial = 1, maximum = 1)
+      self.channel = SrdpStreamProtocol(DummyProvider(),
+                                        window = self.window,
+                                        reactor = self.clock,
+                                        batchLimit = 0)
+      self.transport = connectStream(self.channel)
+      self.adapter = FakeAdapter(self.channel, self.transport, answerReads)
+
+
+   def test_read(self):
+      results = []
+      self.channel.readRegister(1, 4).addCallback(results.append)
+      self.adapter.run()
+      self.assertEqual(results, ['abc'])
+      self.assertEqual(self.window.inflight, 0)
+
+
+   def test_corruptResponseFreesSlot(self):
+      """
+      A response dropped for its CRC error must not wedge the channel:
+      the request is retransmitted and the queued request sent after it.
+      """
+      results = []
+      self.adapter.corrupt()
+      self.channel.readRegister(1, 4).addCallback(results.append)
+      self.channel.readRegister(1, 5).addCallback(results.append)
+      self.adapter.run()
+      self.assertEqual(results, [])
+      self.assertEqual(self.channel.getMetrics()['crcErrors'], 1)
+      self.assertEqual(len(self.adapter.requests), 1)
+
+      self.clock.advance(self.channel._rtt.rto)
+      self.adapter.run()
+      self.assertEqual(results, ['abc', 'abc'])
+      self.assertEqual(len(self.adapter.requests), 3)
+      self.assertEqual(self.window.inflight, 0)
+
+
+   def test_lostResponsesTimeOut(self):
+      """
+      Requests without any response fail after their retries and release
+      their send window slot.
+      """
+      failures = []
+      self.adapter.handler = lambda header, data: None
+      self.channel.readRegister(1, 4).addErrback(failures.append)
+      self.channel.readRegister(1, 5).addErrback(failures.append)
+      for i in range(20):
+         self.clock.advance(60)
+         self.adapter.run()
+      self.assertEqual(len(failures), 2)
+      self.assertEqual(self.window.inflight, 0)
+
+
+   def test_closeReleasesSlots(self):
+      failures = []
+      self.channel.readRegister(1, 4).addErrback(failures.append)
+      self.channel.readRegister(1, 5).addErrback(failures.append)
+      self.channel.connectionLost(Failure(ConnectionDone()))
+      self.assertEqual(len(failures), 2)
+      self.assertEqual(self.window.inflight, 0)
+
+
+
+class BatchingTransport(StringTransport):
+
+   def __init__(self):
+      StringTransport.__init__(self)
+      self.batches = []
+
+   def write(self, data):
+      self.batches.append(len(data))
+      StringTransport.write(self, data)
+
+   def writeSequence(self, data):
+      self.batches.append(sum([len(d) for d in data]))
+      StringTransport.write(self, ''.join(data))
+
+
+
+class StreamBatchingTest(unittest.TestCase):
+
+   def setUp(self):
+      self.clock = Clock()
+      self.transport = BatchingTransport()
+
+
+   def connect(self, batchLimit):
+      channel = SrdpStreamProtocol(DummyProvider(),
+                                   window = SrdpSendWindow(initial = 8, maximum = 8),
+                                   reactor = self.clock,
+                                   batchLimit = batchLimit)
+      channel.makeConnection(self.transport)
+      return channel
+
+
+   def test_batchLimit(self):
+      channel = self.connect(30)
+      for i in range(5):
+         channel.readRegister(1, 4)
+      self.assertEqual(self.transport.batches, [24, 24])
+      self.clock.advance(0)
+      self.assertEqual(self.transport.batches, [24, 24, 12])
+
+
+   def test_largeFrame(self):
+      channel = self.connect(30)
+      channel.readRegister(1, 4)
+      channel.writeRegister(1, 5, 'x' * 40)
+      channel.readRegister(1, 4)
+      self.clock.advance(0)
+      self.assertEqual(self.transport.batches, [12, 52, 12])
+
+
+   def test_flushAtEndOfIteration(self):
+      channel = self.connect(4096)
+      for i in range(3):
+         channel.readRegister(1, 4)
+      self.assertEqual(self.transport.batches, [])
+      self.clock.advance(0)
+      self.assertEqual(self.transport.batches, [36])
+
+
+   def test_unbatched(self):
+      channel = self.connect(0)
+      for i in range(3):
+         channel.readRegister(1, 4)
+      self.assertEqual(self.transport.batches, [12, 12, 12])
+
+
+
+class CountingFrameHeader(SrdpFrameHeader):
+   created = 0
+
+   def __init__(self, *args, **kwargs):
+      CountingFrameHeader.created += 1
+      SrdpFrameHeader.__init__(self, *args, **kwargs)
+
+
+
+class StreamReceiveTest(unittest.TestCase):
+
+   def setUp(self):
+      self.connect()
+
+
+   def connect(self):
+      self.provider = DummyProvider({(1, 4): 'abc'})
+      self.channel = SrdpStreamProtocol(self.provider, reactor = Clock(), batchLimit = 0)
+      self.transport = connectStream(self.channel)
+      self.changes = []
+      self.channel.subscribe(lambda *args: self.changes.append(args), 2)
+
+
+   def frames(self):
+      """
+      Mixed frame sequence: change notifications with payloads of
+      several lengths around a read request served by the channel.
+      """
+      return [self.change(1, 'a'),
+              self.change(2, 'v' * 40),
+              encodeFrame(SrdpFrameHeader.SRDP_FT_REQ, SrdpFrameHeader.SRDP_OP_READ, 1, 3, 4, 0, 0)[0],
+              self.change(4, 'xyz')]
+
+
+   def expected(self):
+      return [(2, 1029, 0, 'a'), (2, 1029, 0, 'v' * 40), (2, 1029, 0, 'xyz')]
+
+
+   def assertReceived(self, reply):
+      self.assertEqual(self.provider.changes, self.expected())
+      self.assertEqual(len(self.changes), 3)
+      self.assertEqual(self.transport.value(), reply)
+      self.assertEqual(self.channel.getMetrics()['crcErrors'], 0)
+
+
+   def change(self, seq, value):
+      return encodeFrame(SrdpFrameHeader.SRDP_FT_REQ, SrdpFrameHeader.SRDP_OP_CHANGE, 2, seq, 1029, 0, len(value), value)[0]
+
+
+   def test_changesWithoutHeaderObjects(self):
+      """
+      Change notifications are dispatched without constructing header
+      objects.
+      """
+      self.patch(srdp, 'SrdpFrameHeader', CountingFrameHeader)
+      CountingFrameHeader.created = 0
+      self.channel.dataReceived(''.join([self.change(i + 1, 'v%d' % i) for i in range(10)]))
+      self.assertEqual(len(self.provider.changes), 10)
+      self.assertEqual(self.provider.changes[9], (2, 1029, 0, 'v9'))
+      self.assertEqual(len(self.changes), 10)
+      self.assertEqual(CountingFrameHeader.created, 0)
+
+
+   def test_serveRequest(self):
+      self.channel.dataReceived(encodeFrame(SrdpFrameHeader.SRDP_FT_REQ, SrdpFrameHeader.SRDP_OP_READ, 1, 9, 4, 0, 0)[0])
+      self.assertEqual(self.transport.value(), encodeFrame(SrdpFrameHeader.SRDP_FT_ACK, SrdpFrameHeader.SRDP_OP_READ, 1, 9, 4, 0, 3, 'abc')[0])
+
+
+   def test_severalFramesInOneChunk(self):
+      self.channel.dataReceived(''.join(self.frames()))
+      self.assertReceived(self.transport.value())
+      self.assertIn(encodeFrame(SrdpFrameHeader.SRDP_FT_ACK, SrdpFrameHeader.SRDP_OP_READ, 1, 3, 4, 0, 3, 'abc')[0],
+                    self.transport.value())
+
+
+   def test_splitAtEveryByte(self):
+      """
+      The frame sequence split into two chunks at every byte boundary is
+      received as if it came in one chunk.
+      """
+      data = ''.join(self.frames())
+      self.channel.dataReceived(data)
+      reply = self.transport.value()
+
+      for i in range(len(data) + 1):
+         self.connect()
+         self.channel.dataReceived(data[:i])
+         self.channel.dataReceived(data[i:])
+         self.assertReceived(reply)
+
+
+   def test_byteByByte(self):
+      data = ''.join(self.frames())
+      self.channel.dataReceived(data)
+      reply = self.transport.value()
+
+      self.connect()
+      for c in data:
+         self.channel.dataReceived(c)
+      self.assertReceived(reply)
+
+
+   def test_splitAtHeaderBoundary(self):
+      frame = self.change(1, 'v' * 40)
+      self.channel.dataReceived(frame[:SrdpFrameHeader.SRDP_FRAME_HEADER_LEN])
+      self.assertEqual(self.provider.changes, [])
+      self.channel.dataReceived(frame[SrdpFrameHeader.SRDP_FRAME_HEADER_LEN:-1])
+      self.assertEqual(self.provider.changes, [])
+
+      ## the rest of the payload comes with the header of the next frame
+      ##
+      nextFrame = self.change(2, 'xyz')
+      self.channel.dataReceived(frame[-1] + nextFrame[:SrdpFrameHeader.SRDP_FRAME_HEADER_LEN])
+      self.assertEqual(self.provider.changes, [(2, 1029, 0, 'v' * 40)])
+      self.channel.dataReceived(nextFrame[SrdpFrameHeader.SRDP_FRAME_HEADER_LEN:])
+      self.assertEqual(self.provider.changes, [(2, 1029, 0, 'v' * 40), (2, 1029, 0, 'xyz')])
@@ -0,0 +1,413 @@
+###############################################################################
+##
+##  Copyright 2013 Tavendo GmbH
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##      http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+from twisted.trial import unittest
+from twisted.internet.task import Clock
+
+from srdp.subscription import SrdpSubscriptionRegistry, SrdpChangeFilter
+
+
+
+class RecordingHandler(object):
+   """
+   Change handler recording (time, device, register, position, value).
+   """
+
+   def __init__(self, clock):
+      self.clock = clock
+      self.calls = []
+
+   def __call__(self, device, register, position, value):
+      self.calls.append((self.clock.seconds(), device, register, position, value))
+
+   def values(self):
+      return [c[4] for c in self.calls]
+
+
+
+class FakeEds(object):
+   """
+   EDS with registers by path, decoding values as integers.
+   """
+
+   def __init__(self, registers):
+      self.registers = registers
+
+   def getRegister(self, register):
+      if register in self.registers:
+         return {'index': self.registers[register], 'path': register}
+      return None
+
+   def unserialize(self, register, data):
+      return len(data), int(data)
+
+
+
+class SubscriptionRegistryTest(unittest.TestCase):
+
+   def setUp(self):
+      self.registry = SrdpSubscriptionRegistry()
+      self.calls = []
+
+
+   def handler(self, name):
+      def onChange(device, register, position, value):
+         self.calls.append((name, device, register, position, value))
+      return onChange
+
+
+   def test_dispatch(self):
+      r = self.registry
+      r.subscribe(self.handler('all'))
+      r.subscribe(self.handler('device'), device = 2)
+      r.subscribe(self.handler('register'), register = 10)
+      r.subscribe(self.handler('both'), device = 2, register = 10)
+      self.assertEqual(len(r), 4)
+
+      self.assertEqual(r.dispatch(2, 10, 0, '1'), 4)
+      self.assertEqual(sorted([c[0] for c in self.calls]), ['all', 'both', 'device', 'register'])
+
+      self.calls = []
+      self.assertEqual(r.dispatch(3, 10, 0, '1'), 2)
+      self.assertEqual(sorted([c[0] for c in self.calls]), ['all', 'register'])
+
+      self.calls = []
+      self.assertEqual(r.dispatch(2, 11, 0, '1'), 2)
+      self.assertEqual(sorted([c[0] for c in self.calls]), ['all', 'device'])
+
+
+   def test_dispatch_empty(self):
+      r = self.registry
+      self.assertEqual(r.dispatch(2, 10, 0, '1'), 0)
+      r.subscribe(self.handler('other'), device = 3)
+      self.assertEqual(r.dispatch(2, 10, 0, '1'), 0)
+      self.assertEqual(self.calls, [])
+
+
+   def test_unsubscribe(self):
+      r = self.registry
+      s1 = r.subscribe(self.handler('a'), device = 2)
+      s2 = r.subscribe(self.handler('b'), device = 2)
+      s1.unsubscribe()
+      self.assertEqual(len(r), 1)
+      self.assertEqual(r.dispatch(2, 10, 0, '1'), 1)
+      self.assertEqual(self.calls[0][0], 'b')
+
+      ## empty dispatch table entries are dropped
+      ##
+      s2.unsubscribe()
+      self.assertEqual(len(r), 0)
+      self.assertEqual(r._handlers, {})
+
+      ## unsubscribing twice is harmless
+      ##
+      s2.unsubscribe()
+      self.assertEqual(len(r), 0)
+
+
+   def test_unsubscribe_while_dispatching(self):
+      r = self.registry
+      subscriptions = []
+
+      def once(device, register, position, value):
+         self.calls.append(('once', device, register, position, value))
+         subscriptions[0].unsubscribe()
+
+      subscriptions.append(r.subscribe(once, device = 2))
+      r.subscribe(self.handler('other'), device = 2)
+
+      self.assertEqual(r.dispatch(2, 10, 0, '1'), 2)
+      self.assertEqual(r.dispatch(2, 10, 0, '2'), 1)
+      self.assertEqual([c[0] for c in self.calls], ['once', 'other', 'other'])
+
+
+   def test_failing_handler(self):
+      r = self.registry
+
+      def fail(device, register, position, value):
+         raise Exception("handler failed")
+
+      r.subscribe(fail, device = 2)
+      r.subscribe(self.handler('ok'), device = 2)
+      self.assertEqual(r.dispatch(2, 10, 0, '1'), 2)
+      self.assertEqual([c[0] for c in self.calls], ['ok'])
+      self.assertEqual(len(self.flushLoggedErrors(Exception)), 1)
+
+
+   def test_subscribe_by_path(self):
+      r = self.registry
+      self.assertRaises(Exception, r.subscribe, self.handler('a'), 2, '/temperature')
+
+      eds = FakeEds({'/temperature': 10})
+      r.setDeviceEds(2, eds)
+      self.assertIdentical(r.getDeviceEds(2), eds)
+      self.assertIdentical(r.getDeviceEds(3), None)
+      self.assertRaises(Exception, r.subscribe, self.handler('a'), 2, '/pressure')
+
+      s = r.subscribe(self.handler('a'), 2, '/temperature')
+      self.assertEqual((s.device, s.register), (2, 10))
+      r.dispatch(2, 10, 0, '42')
+      self.assertEqual(self.calls, [('a', 2, 10, 0, 42)])
+
+
+   def test_decode(self):
+      r = self.registry
+      r.setDeviceEds(2, FakeEds({}))
+      r.subscribe(self.handler('a'))
+
+      ## values are decoded with the EDS of the device, partial values
+      ## and values of devices without EDS are passed raw
+      ##
+      r.dispatch(2, 10, 0, '42')
+      r.dispatch(2, 10, 4, '42')
+      r.dispatch(3, 10, 0, '42')
+      self.assertEqual([c[4] for c in self.calls], [42, '42', '42'])
+
+      ## undecodable values are passed raw
+      ##
+      r.dispatch(2, 10, 0, 'x')
+      self.assertEqual(self.calls[-1][4], 'x')
+      self.assertEqual(len(self.flushLoggedErrors(ValueError)), 1)
+
+
+
+class ChangeFilterTest(unittest.TestCase):
+
+   def setUp(self):
+      self.clock = Clock()
+      self.handler = RecordingHandler(self.clock)
+
+
+   def filter(self, **kwargs):
+      return SrdpChangeFilter(self.handler, reactor = self.clock, **kwargs)
+
+
+   def change(self, f, value, at = None, register = 10, position = 0):
+      if at is not None:
+         self.clock.advance(at - self.clock.seconds())
+      f(2, register, position, value)
+
+
+   def test_unfiltered(self):
+      f = self.filter()
+      for v in [1, 1, 2, 2, 3]:
+         self.change(f, v)
+      self.assertEqual(self.handler.values(), [1, 2, 3])
+      self.assertEqual(f.received, 5)
+      self.assertEqual(f.reported, 3)
+      self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+   def test_deadband(self):
+      f = self.filter(deadband = 0.5)
+      for v in [10., 10.25, 10.5, 10.75, 10.25, 9.75]:
+         self.change(f, v)
+
+      ## deltas are taken against the last reported value, not the last
+      ## received one, so slow drifts are reported eventually
+      ##
+      self.assertEqual(self.handler.values(), [10., 10.5, 9.75])
+
+
+   def test_deadband_relative(self):
+      f = self.filter(relative = 0.1)
+      for v in [100, 105, 109, 111, 120, 0, 0]:
+         self.change(f, v)
+      self.assertEqual(self.handler.values(), [100, 111, 0])
+
+
+   def test_deadband_structured(self):
+      f = self.filter(deadband = 1)
+      self.change(f, {'x': 1, 'y': 1})
+      self.change(f, {'x': 1.5, 'y': 0.5})
+      self.change(f, {'x': 1.5, 'y': 2})
+      self.assertEqual(self.handler.values(), [{'x': 1, 'y': 1}, {'x': 1.5, 'y': 2}])
+
+
+   def test_deadband_non_numeric(self):
+      f = self.filter(deadband = 10)
+      for v in ['a', 'a', 'b']:
+         self.change(f, v)
+      self.assertEqual(self.handler.values(), ['a', 'b'])
+
+
+   def test_partial_values_pass(self):
+      f = self.filter(deadband = 10, minInterval = 5)
+      self.change(f, 'xy', position = 4)
+      self.change(f, 'xy', position = 4)
+      self.assertEqual(self.handler.calls, [(0, 2, 10, 4, 'xy'), (0, 2, 10, 4, 'xy')])
+      self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+   def test_min_interval(self):
+      f = self.filter(minInterval = 1.)
+      self.change(f, 1, at = 0.)
+      self.change(f, 2, at = 0.2)
+      self.change(f, 3, at = 0.5)
+      self.assertEqual(self.handler.values(), [1])
+
+      ## coalesced changes are reported when the interval has passed,
+      ## last value wins
+      ##
+      self.clock.advance(0.5)
+      self.assertEqual(self.handler.calls, [(0., 2, 10, 0, 1), (1., 2, 10, 0, 3)])
+
+      ## a change after the interval is reported right away
+      ##
+      self.change(f, 4, at = 2.5)
+      self.assertEqual(self.handler.calls[-1], (2.5, 2, 10, 0, 4))
+      self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+   def test_min_interval_no_change(self):
+      f = self.filter(minInterval = 1.)
+      self.change(f, 1, at = 0.)
+      self.change(f, 2, at = 0.2)
+      self.change(f, 1, at = 0.4)
+
+      ## the coalesced value equals the reported one: nothing to report
+      ##
+      self.clock.advance(1.)
+      self.assertEqual(self.handler.values(), [1])
+
+
+   def test_min_interval_per_register(self):
+      f = self.filter(minInterval = 1.)
+      self.change(f, 1, register = 10)
+      self.change(f, 1, register = 11)
+      self.change(f, 2, register = 10)
+      self.assertEqual([(c[2], c[4]) for c in self.handler.calls], [(10, 1), (11, 1)])
+      self.clock.advance(1.)
+      self.assertEqual([(c[2], c[4]) for c in self.handler.calls], [(10, 1), (11, 1), (10, 2)])
+
+
+   def test_window(self):
+      f = self.filter(window = 0.5)
+      self.change(f, 1, at = 0.)
+      self.change(f, 2, at = 0.1)
+      self.change(f, 3, at = 0.3)
+      self.assertEqual(self.handler.calls, [])
+
+      self.clock.advance(0.2)
+      self.assertEqual(self.handler.calls, [(0.5, 2, 10, 0, 3)])
+
+      ## the next change opens a new window
+      ##
+      self.change(f, 4, at = 2.)
+      self.assertEqual(len(self.handler.calls), 1)
+      self.clock.advance(0.5)
+      self.assertEqual(self.handler.calls[-1], (2.5, 2, 10, 0, 4))
+      self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+   def test_window_and_min_interval(self):
+      f = self.filter(window = 0.2, minInterval = 1.)
+      self.change(f, 1, at = 0.)
+      self.clock.advance(0.2)
+      self.change(f, 2, at = 0.5)
+
+      ## the window would close at 0.7, the minimum interval holds the
+      ## report back until 1.2
+      ##
+      self.clock.advance(0.2)
+      self.assertEqual(self.handler.values(), [1])
+      self.clock.advance(0.5)
+      self.assertEqual(self.handler.calls[-1], (1.2, 2, 10, 0, 2))
+
+
+   def test_window_deadband(self):
+      f = self.filter(window = 0.5, deadband = 1)
+      self.change(f, 10, at = 0.)
+      self.clock.advance(0.5)
+
+      ## a change within the deadband does not open a window, a coalesced
+      ## value within the deadband is not reported
+      ##
+      self.change(f, 10.5, at = 1.)
+      self.assertEqual(self.clock.getDelayedCalls(), [])
+      self.change(f, 12, at = 2.)
+      self.change(f, 10.2, at = 2.1)
+      self.clock.advance(0.4)
+      self.assertEqual(self.handler.values(), [10])
+
+
+   def test_heartbeat(self):
+      f = self.filter(deadband = 1, maxInterval = 2.)
+      self.change(f, 10, at = 0.)
+      self.change(f, 10.5, at = 0.5)
+      self.assertEqual(self.handler.values(), [10])
+
+      ## the latest value is reported every maxInterval, even within the
+      ## deadband
+      ##
+      self.clock.advance(1.5)
+      self.assertEqual(self.handler.calls[-1], (2., 2, 10, 0, 10.5))
+      self.clock.advance(2.)
+      self.assertEqual(self.handler.calls[-1], (4., 2, 10, 0, 10.5))
+      self.assertEqual(len(self.handler.calls), 3)
+
+
+   def test_heartbeat_reset(self):
+      f = self.filter(deadband = 1, maxInterval = 2.)
+      self.change(f, 10, at = 0.)
+      self.change(f, 20, at = 1.5)
+
+      ## a report restarts the heartbeat interval
+      ##
+      self.clock.advance(1.)
+      self.assertEqual([c[0] for c in self.handler.calls], [0., 1.5])
+      self.clock.advance(1.)
+      self.assertEqual(self.handler.calls[-1], (3.5, 2, 10, 0, 20))
+      self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+
+
+   def test_heartbeat_cancels_pending(self):
+      f = self.filter(minInterval = 5., maxInterval = 2.)
+      self.change(f, 1, at = 0.)
+      self.change(f, 2, at = 1.)
+
+      ## the heartbeat reports the coalesced value before the minimum
+      ## interval has passed and takes over the pending change
+      ##
+      self.clock.advance(1.)
+      self.assertEqual(self.handler.calls, [(0., 2, 10, 0, 1), (2., 2, 10, 0, 2)])
+      self.clock.advance(2.)
+      self.assertEqual(self.handler.calls[-1], (4., 2, 10, 0, 2))
+      self.clock.advance(1.)
+      self.assertEqual(len(self.handler.calls), 3)
+
+
+   def test_flush(self):
+      f = self.filter(window = 1.)
+      self.change(f, 1, register = 10)
+      self.change(f, 2, register = 10)
+      self.change(f, 3, register = 11)
+      f.flush()
+      self.assertEqual(sorted([(c[2], c[4]) for c in self.handler.calls]), [(10, 2), (11, 3)])
+      self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+   def test_stop(self):
+      f = self.filter(window = 1., maxInterval = 2.)
+      self.change(f, 1)
+      self.clock.advance(1.)
+      self.change(f, 2)
+      f.stop()
+      self.assertEqual(self.clock.getDelayedCalls(), [])
+      self.clock.advance(10.)
+      self.assertEqual(self.handler.values(), [1])